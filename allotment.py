@@ -0,0 +1,388 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from enum import Enum
+from typing import NamedTuple
+
+import httpx
+
+import http_client
+import metrics
+from async_db import get_cached_allotments, save_allotments
+from circuit_breaker import CircuitOpen
+from database import FINAL_ALLOTMENT_STATUSES
+from log_setup import should_log_payload
+
+logger = logging.getLogger(__name__)
+
+# How long lookups from different users are collected before being sent upstream
+ALLOTMENT_BATCH_WINDOW = float(os.getenv("ALLOTMENT_BATCH_WINDOW_MS", 100)) / 1000
+# Maximum number of PANs sent in one check-allotment request (lookups from
+# different users are merged up to this size)
+ALLOTMENT_MAX_BATCH_SIZE = int(os.getenv("ALLOTMENT_MAX_BATCH_SIZE", 20))
+# A user's PANs are split into chunks of this size that go into different
+# requests, so they are fetched concurrently
+ALLOTMENT_CHUNK_SIZE = int(os.getenv("ALLOTMENT_CHUNK_SIZE", 5))
+# Maximum number of check-allotment requests in flight across all users
+ALLOTMENT_MAX_CONCURRENCY = int(os.getenv("ALLOTMENT_MAX_CONCURRENCY", 10))
+# Deadline for one chunk; only that chunk's PANs fail when it is exceeded
+ALLOTMENT_CHUNK_TIMEOUT = float(os.getenv("ALLOTMENT_CHUNK_TIMEOUT", 20))
+
+
+class AllotmentCheckError(Exception):
+    """Raised when the check-allotment API rejects or fails a request"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _consume_exception(future):
+    # Waiters may have gone away; don't warn about unretrieved exceptions
+    if not future.cancelled():
+        future.exception()
+
+
+class _Batch:
+    """PANs of one IPO waiting to be sent in one request"""
+
+    __slots__ = ("futures", "lookups")
+
+    def __init__(self):
+        self.futures = {}     # pan -> future
+        self.lookups = set()  # ids of the lookups with a chunk in this batch
+
+
+class AllotmentDispatcher:
+    """Coalesces (ipoid, PAN) lookups from all users into batched requests.
+
+    Each lookup's new PANs are split into chunks of at most chunk_size.
+    Chunks arriving within the batch window are merged per IPO into batches
+    of at most max_batch_size PANs, never two chunks of the same lookup in
+    one batch, so a user's PANs are fetched concurrently while different
+    users' PANs share requests. A full batch is sent at once, the rest when
+    the window ends (at most max_concurrency requests at a time). PANs
+    already pending or in flight are not looked up twice: each caller gets
+    a future per PAN that resolves to that PAN's response data.
+    """
+
+    def __init__(self, url, window=ALLOTMENT_BATCH_WINDOW, max_batch_size=ALLOTMENT_MAX_BATCH_SIZE,
+                 chunk_size=ALLOTMENT_CHUNK_SIZE, max_concurrency=ALLOTMENT_MAX_CONCURRENCY,
+                 chunk_timeout=ALLOTMENT_CHUNK_TIMEOUT):
+        self.url = url
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.chunk_size = min(chunk_size, max_batch_size)
+        self.max_concurrency = max_concurrency
+        self.chunk_timeout = chunk_timeout
+        self._loop = None
+        self._semaphore = None
+        self._pending = {}    # ipoid -> [_Batch] waiting for the next flush
+        self._inflight = {}   # (ipoid, pan) -> future, pending or being fetched
+        self._lookup_ids = itertools.count()
+        self._flush_handle = None
+        self._tasks = set()
+
+    def lookup(self, ipo_id, pan_numbers):
+        """Queue PANs of an IPO for checking and return {pan: future}"""
+        self._bind_loop()
+        futures = {}
+        new = {}
+
+        for pan in pan_numbers:
+            future = self._inflight.get((ipo_id, pan))
+            if future is None:
+                future = self._loop.create_future()
+                future.add_done_callback(_consume_exception)
+                self._inflight[(ipo_id, pan)] = future
+                new[pan] = future
+            futures[pan] = future
+
+        if new:
+            self._add_chunks(ipo_id, new)
+        return futures
+
+    def _add_chunks(self, ipo_id, new):
+        lookup_id = next(self._lookup_ids)
+        batches = self._pending.setdefault(ipo_id, [])
+        pans = list(new)
+        for start in range(0, len(pans), self.chunk_size):
+            chunk = pans[start:start + self.chunk_size]
+            batch = next(
+                (batch for batch in batches
+                 if lookup_id not in batch.lookups and len(batch.futures) + len(chunk) <= self.max_batch_size),
+                None
+            )
+            if batch is None:
+                batch = _Batch()
+                batches.append(batch)
+            batch.lookups.add(lookup_id)
+            batch.futures.update((pan, new[pan]) for pan in chunk)
+            if len(batch.futures) >= self.max_batch_size:
+                # A full batch does not need to wait for the window
+                batches.remove(batch)
+                self._send(ipo_id, batch.futures)
+
+        if not batches:
+            self._pending.pop(ipo_id, None)
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.window, self._flush)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # The bot was restarted on a new event loop; old futures are unusable
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._pending = {}
+            self._inflight = {}
+            self._flush_handle = None
+            self._tasks = set()
+
+    def _flush(self):
+        self._flush_handle = None
+        pending, self._pending = self._pending, {}
+        for ipo_id, batches in pending.items():
+            for batch in batches:
+                self._send(ipo_id, batch.futures)
+
+    def _send(self, ipo_id, batch):
+        task = self._loop.create_task(self._send_batch(ipo_id, batch))
+        # Keep a reference so the batch isn't garbage-collected mid-flight
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, ipo_id, batch):
+        try:
+            async with self._semaphore:
+                fetched = await self._post(ipo_id, list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for pan, future in batch.items():
+                if not future.done():
+                    future.set_result(fetched.get(pan, {}))
+        finally:
+            for pan in batch:
+                self._inflight.pop((ipo_id, pan), None)
+
+    async def _post(self, ipo_id, pan_numbers):
+        payload = {
+            "ipoid": ipo_id,
+            "pancard": pan_numbers
+        }
+
+        # Payloads and bodies are only logged for a sampled fraction of requests
+        log_payload = should_log_payload(logger)
+        if log_payload:
+            logger.debug("Allotment request for IPO %s: %s", ipo_id, payload)
+
+        # A lookup, so safe to retry; the client enforces the chunk deadline itself so an
+        # upstream that stops answering counts against its circuit breaker
+        response = await http_client.post(
+            self.url, json=payload, timeout=self.chunk_timeout, total_timeout=self.chunk_timeout, idempotent=True
+        )
+
+        if log_payload:
+            logger.debug("Allotment response for IPO %s (%s): %s", ipo_id, response.status_code, response.text)
+
+        if response.status_code != 200:
+            logger.warning(
+                "Allotment API returned %s for IPO %s (%d PAN(s))", response.status_code, ipo_id, len(pan_numbers),
+                extra={"event": "upstream_error", "ipo_id": ipo_id, "status_code": response.status_code}
+            )
+            raise AllotmentCheckError("Failed to check allotment", status_code=response.status_code)
+
+        result = response.json()
+        if not result.get("success"):
+            raise AllotmentCheckError(result.get("message", "Failed to check allotment"))
+
+        # Create a mapping of PAN to response data for easy lookup
+        fetched = {}
+        for item in result.get("data", []):
+            fetched[item.get("pancard", "")] = item.get("data", {})
+
+        await save_allotments(ipo_id, fetched)
+        return fetched
+
+
+class AllotmentStatus(Enum):
+    """Outcome of the allotment check for one PAN"""
+    ALLOTTED = "allotted"
+    NOT_ALLOTTED = "not_allotted"
+    NOT_APPLIED = "not_applied"
+    OTHER = "other"          # any other registrar status, shown as-is
+    PENDING = "pending"      # still being checked
+    FAILED = "failed"        # the PAN's chunk failed or timed out
+
+
+class PanResult(NamedTuple):
+    pan: str
+    status: AllotmentStatus
+    shares: str = "0"
+    status_text: str = ""    # registrar's status string
+    source: str = ""         # "cache" or "upstream"
+    latency: float = 0.0     # seconds from the start of the check
+    error: str = None
+
+    @property
+    def is_final(self):
+        """True once the registrar has published this PAN's result"""
+        return self.status_text.lower() in FINAL_ALLOTMENT_STATUSES
+
+
+def classify(pan, pan_response, source, latency):
+    """Turn one PAN's check-allotment response data into a PanResult"""
+    if pan_response.get("error") is not None:
+        return PanResult(pan, AllotmentStatus.FAILED, source=source, latency=latency,
+                         error=pan_response["error"])
+    if not pan_response.get("success"):
+        # No valid response for this PAN
+        return PanResult(pan, AllotmentStatus.NOT_APPLIED, source=source, latency=latency)
+
+    data_result = pan_response.get("dataResult", {})
+    status_text = data_result.get("status", "Unknown")
+    shares = data_result.get("shares_allotted", "0")
+    normalized = status_text.lower()
+
+    if normalized == "not apply":
+        status = AllotmentStatus.NOT_APPLIED
+    elif normalized == "allotted":
+        status = AllotmentStatus.ALLOTTED
+    elif normalized in ("not allotted", "not alloted"):
+        status = AllotmentStatus.NOT_ALLOTTED
+    else:
+        status = AllotmentStatus.OTHER
+    return PanResult(pan, status, shares, status_text, source, latency)
+
+
+class AllotmentReport:
+    """Per-PAN results of one allotment check, in the order the PANs were given"""
+
+    def __init__(self, ipo_id, pan_numbers):
+        self.ipo_id = ipo_id
+        self.results = {pan: PanResult(pan, AllotmentStatus.PENDING) for pan in pan_numbers}
+
+    def count(self, status):
+        return sum(1 for result in self.results.values() if result.status is status)
+
+    @property
+    def pending(self):
+        return self.count(AllotmentStatus.PENDING)
+
+    @property
+    def failed(self):
+        return all(result.status is AllotmentStatus.FAILED for result in self.results.values())
+
+    @property
+    def published(self):
+        """True when every PAN has a final result (nothing left to wait for)"""
+        return all(result.is_final for result in self.results.values())
+
+    def subset(self, pan_numbers):
+        """A report with only the given PANs' results"""
+        report = AllotmentReport(self.ipo_id, pan_numbers)
+        for pan in pan_numbers:
+            report.results[pan] = self.results[pan]
+        return report
+
+
+class CheckFailure(Enum):
+    """Why a whole allotment check failed"""
+    API_ERROR = "api_error"  # the upstream answered with an error status
+    REJECTED = "rejected"    # the upstream reported success: false
+    TIMEOUT = "timeout"
+    UNAVAILABLE = "unavailable"  # the upstream's circuit is open
+    ERROR = "error"
+
+
+def classify_failure(error):
+    """Map an exception raised by AllotmentService.check to a CheckFailure"""
+    if isinstance(error, CircuitOpen):
+        return CheckFailure.UNAVAILABLE
+    if isinstance(error, AllotmentCheckError):
+        return CheckFailure.API_ERROR if error.status_code is not None else CheckFailure.REJECTED
+    if isinstance(error, (httpx.TimeoutException, asyncio.TimeoutError)):
+        return CheckFailure.TIMEOUT
+    return CheckFailure.ERROR
+
+
+class AllotmentService:
+    """Checks allotment status for a user's PANs; the one path used by every handler.
+
+    Cached results are served from the database, the rest are coalesced
+    with other users' lookups by the dispatcher and fetched upstream.
+    """
+
+    def __init__(self, url, **dispatcher_options):
+        # dispatcher_options override the batching defaults (see AllotmentDispatcher)
+        self.dispatcher = AllotmentDispatcher(url, **dispatcher_options)
+
+    async def check(self, ipo_id, pan_numbers, on_progress=None):
+        """Return an AllotmentReport for the given PANs of an IPO.
+
+        PANs whose chunk failed are marked FAILED; the error is raised only
+        if every PAN failed. on_progress, if given, is awaited with the
+        report each time a chunk finishes while others are still pending.
+        """
+        start = time.monotonic()
+        report = AllotmentReport(ipo_id, pan_numbers)
+
+        cached = await get_cached_allotments(ipo_id, pan_numbers)
+        elapsed = time.monotonic() - start
+        for pan, pan_response in cached.items():
+            report.results[pan] = classify(pan, pan_response, "cache", elapsed)
+
+        missing = [pan for pan in report.results if pan not in cached]
+        metrics.cache_requests_total.inc("allotment_results", "hit", amount=len(report.results) - len(missing))
+        metrics.cache_requests_total.inc("allotment_results", "miss", amount=len(missing))
+        if not missing:
+            logger.info("Allotment results for IPO %s served from cache", ipo_id)
+            return report
+
+        # Shared futures are shielded so one user giving up doesn't cancel others
+        waiters = {
+            asyncio.ensure_future(asyncio.shield(future)): pan
+            for pan, future in self.dispatcher.lookup(ipo_id, missing).items()
+        }
+        first_error = None
+        unavailable = []
+
+        try:
+            while waiters:
+                done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                elapsed = time.monotonic() - start
+                for waiter in done:
+                    pan = waiters.pop(waiter)
+                    if waiter.exception() is None:
+                        pan_response = waiter.result()
+                    else:
+                        first_error = first_error or waiter.exception()
+                        if isinstance(waiter.exception(), CircuitOpen):
+                            unavailable.append(pan)
+                        pan_response = {"success": False, "error": str(waiter.exception())}
+                    report.results[pan] = classify(pan, pan_response, "upstream", elapsed)
+
+                if on_progress is not None and waiters:
+                    await on_progress(report)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+        if unavailable:
+            # The upstream is down: an expired result is better than none
+            stale = await get_cached_allotments(ipo_id, unavailable, include_expired=True)
+            for pan, pan_response in stale.items():
+                report.results[pan] = classify(pan, pan_response, "cache", time.monotonic() - start)
+
+        logger.info(
+            "Allotment check for IPO %s: %d PAN(s), %d from cache, %.2fs",
+            ipo_id, len(report.results), len(cached), time.monotonic() - start
+        )
+        if first_error is not None and report.failed:
+            raise first_error
+        return report
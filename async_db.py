@@ -0,0 +1,82 @@
+"""Async wrappers around database.py for use from handlers.
+
+Every call runs on one dedicated worker thread (the same model as
+aiosqlite), so the shared SQLite connection is only ever touched from that
+thread and slow disk I/O never blocks the event loop. Semantics, return
+values and exceptions are the same as the synchronous functions.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+
+def _timed(func, *args):
+    # Runs on the database thread, so queueing time is not included
+    with metrics.sqlite_query_seconds.time(func.__name__):
+        return func(*args)
+
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(_timed, func, *args))
+
+
+async def init_db():
+    return await _run(database.init_db)
+
+
+async def close_db():
+    return await _run(database.close_db)
+
+
+async def ping():
+    return await _run(database.ping)
+
+
+async def add_pan(user_id, name, pan):
+    return await _run(database.add_pan, user_id, name, pan)
+
+
+async def get_all_pans(user_id):
+    return await _run(database.get_all_pans, user_id)
+
+
+async def get_pan_count(user_id):
+    return await _run(database.get_pan_count, user_id)
+
+
+async def delete_pan_by_id(pan_id, user_id):
+    return await _run(database.delete_pan_by_id, pan_id, user_id)
+
+
+async def delete_pan(user_id):
+    return await _run(database.delete_pan, user_id)
+
+
+async def get_cached_allotments(ipoid, pans, include_expired=False):
+    return await _run(database.get_cached_allotments, ipoid, pans, include_expired)
+
+
+async def save_allotments(ipoid, pan_responses):
+    return await _run(database.save_allotments, ipoid, pan_responses)
+
+
+async def add_watch(user_id, ipoid, ipo_name):
+    return await _run(database.add_watch, user_id, ipoid, ipo_name)
+
+
+async def remove_watch(user_id, ipoid):
+    return await _run(database.remove_watch, user_id, ipoid)
+
+
+async def get_watch_targets():
+    return await _run(database.get_watch_targets)
+
+
+async def purge_watches(max_age):
+    return await _run(database.purge_watches, max_age)
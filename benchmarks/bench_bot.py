@@ -0,0 +1,250 @@
+"""End-to-end throughput benchmark of the bot's handlers, fully offline.
+
+Starts the fake ipoedge API (fake_ipoedge.py), builds the bot's PTB
+Application with bot.build_application, as in production, on a stubbed
+Bot API (telegram_stub.py) and drives synthetic users through
+Application.process_update. Bot API calls go through the send scheduler,
+so throughput is capped by SEND_GLOBAL_RATE (raise it to measure the
+handlers alone). For each scenario it reports
+updates/sec, p50/p95/p99 handler latency and the upstream and Bot API
+calls made; --json writes the same numbers for diffing between runs.
+
+Scenarios:
+    paginate   every user opens the IPO list and pages Next, Next, Previous
+    same_ipo   every user (3 PANs each) checks the same IPO
+    pan_menu   every user opens PAN management, views the list, goes back
+
+Usage:
+    python benchmarks/bench_bot.py [--users 1000] [--check-users 500] [--concurrency 100]
+                                   [--latency-ms 50] [--error-rate 0] [--ipos 40]
+                                   [--scenarios paginate,same_ipo,pan_menu] [--json out.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ipoedge import FakeIpoedge  # noqa: E402
+from telegram_stub import StubRequest, UpdateFactory  # noqa: E402
+
+PANS_PER_USER = 3
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class Bench:
+    def __init__(self, bot, fake, concurrency):
+        self.bot = bot
+        self.fake = fake
+        self.concurrency = concurrency
+        self.stub = None
+        self.app = None
+        self.updates = None
+
+    async def setup(self):
+        # The production Application (send scheduler, state persistence), only the Bot API is stubbed
+        self.stub = StubRequest()
+        self.app = self.bot.build_application("1:bench", request=self.stub)
+        await self.bot.prepare_database()
+        await self.app.initialize()
+        self.updates = UpdateFactory(self.app.bot)
+
+    async def teardown(self):
+        await self.app.shutdown()
+
+    def reset(self):
+        """Start a scenario with a cold IPO cache and zeroed counters"""
+        from ipo_cache import IpoCache
+
+        self.bot.ipo_cache = IpoCache(self.bot.API_URL, self.bot.IPOS_PER_PAGE)
+        self.fake.reset_counts()
+        self.stub.calls = {}
+
+    async def run(self, users, steps):
+        """Run steps(user_id) -> [update factory calls] for every user, concurrently"""
+        import metrics
+
+        self.reset()
+        errors_before = _handler_errors(metrics)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies = []
+
+        async def drive(user_id):
+            async with semaphore:
+                for make_update in steps(user_id):
+                    update = make_update()
+                    start = time.perf_counter()
+                    await self.app.process_update(update)
+                    latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(drive(user_id) for user_id in users))
+        elapsed = time.perf_counter() - start
+
+        return {
+            "users": len(users),
+            "updates": len(latencies),
+            "seconds": round(elapsed, 3),
+            "updates_per_sec": round(len(latencies) / elapsed, 1),
+            "latency_ms": {
+                "mean": round(statistics.fmean(latencies) * 1000, 2),
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+                "max": round(max(latencies) * 1000, 2),
+            },
+            "handler_errors": _handler_errors(metrics) - errors_before,
+            "upstream_calls": dict(sorted(self.fake.calls.items())),
+            "bot_api_calls": dict(sorted(self.stub.calls.items())),
+        }
+
+
+def _handler_errors(metrics):
+    return sum(value for (handler, outcome), value in metrics.updates_total.samples().items() if outcome == "error")
+
+
+async def scenario_paginate(bench, args):
+    u = bench.updates
+
+    def steps(user_id):
+        return [
+            lambda: u.text(user_id, "📊 Check IPO Allotment"),
+            lambda: u.text(user_id, "Next ➡️"),
+            lambda: u.text(user_id, "Next ➡️"),
+            lambda: u.text(user_id, "⬅️ Previous"),
+        ]
+
+    return await bench.run(range(1, args.users + 1), steps)
+
+
+async def scenario_same_ipo(bench, args):
+    from async_db import add_pan
+
+    # Users get distinct PANs so every check starts from an empty result cache
+    users = range(100_001, 100_001 + args.check_users)
+    for user_id in users:
+        for k in range(PANS_PER_USER):
+            await add_pan(user_id, f"Holder {k}", f"{chr(65 + k)}{user_id:07d}PQ")
+
+    u = bench.updates
+    ipo_id = bench.fake.ipos[0]["ipoid"]
+    return await bench.run(users, lambda user_id: [lambda: u.callback(user_id, f"check_{ipo_id}")])
+
+
+async def scenario_pan_menu(bench, args):
+    u = bench.updates
+
+    def steps(user_id):
+        return [
+            lambda: u.text(user_id, "📋 Manage PAN Numbers"),
+            lambda: u.text(user_id, "📋 View PAN Numbers"),
+            lambda: u.text(user_id, "🔙 Back to Main Menu"),
+        ]
+
+    return await bench.run(range(100_001, 100_001 + args.users), steps)
+
+
+SCENARIOS = {
+    "paginate": scenario_paginate,
+    "same_ipo": scenario_same_ipo,
+    "pan_menu": scenario_pan_menu,
+}
+
+
+def report(name, result):
+    latency = result["latency_ms"]
+    print(f"{name}: {result['updates']:,} updates from {result['users']:,} users in {result['seconds']:.2f}s "
+          f"({result['updates_per_sec']:,.0f} updates/s)")
+    print(f"  latency: mean {latency['mean']:.1f} ms | p50 {latency['p50']:.1f} ms | "
+          f"p95 {latency['p95']:.1f} ms | p99 {latency['p99']:.1f} ms | max {latency['max']:.1f} ms")
+    print(f"  upstream calls: {result['upstream_calls']}")
+    print(f"  bot api calls: {result['bot_api_calls']}")
+    if result["handler_errors"]:
+        print(f"  handler errors: {result['handler_errors']}")
+
+
+async def run_all(args, fake):
+    import bot
+    import http_client
+
+    bench = Bench(bot, fake, args.concurrency)
+    await http_client.init_http_client()
+    await bench.setup()
+    results = {}
+    try:
+        for name in args.scenarios:
+            results[name] = await SCENARIOS[name](bench, args)
+            report(name, results[name])
+    finally:
+        await bench.teardown()
+        await http_client.close_http_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="users in the paginate and pan_menu scenarios")
+    parser.add_argument("--check-users", type=int, default=500, help="users in the same_ipo scenario")
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake API latency")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="extra random fake API latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake API calls that fail")
+    parser.add_argument("--ipos", type=int, default=40, help="IPOs in the fake allotted list")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    fake = FakeIpoedge(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000,
+                       error_rate=args.error_rate, ipo_count=args.ipos).start()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Must be set before bot/database are imported
+        os.environ["DATA_DIR"] = data_dir
+        os.environ["IPOEDGE_BASE_URL"] = fake.base_url
+        logging.disable(logging.INFO)
+
+        try:
+            results = asyncio.run(run_all(args, fake))
+        finally:
+            fake.stop()
+
+    if args.json:
+        output = {
+            "benchmark": "bench_bot",
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "config": {
+                "users": args.users,
+                "check_users": args.check_users,
+                "concurrency": args.concurrency,
+                "latency_ms": args.latency_ms,
+                "jitter_ms": args.jitter_ms,
+                "error_rate": args.error_rate,
+                "ipos": args.ipos,
+            },
+            "scenarios": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
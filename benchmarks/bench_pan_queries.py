@@ -0,0 +1,115 @@
+"""Benchmark get_all_pans before and after schema migration 1.
+
+Fills a throwaway database with --rows PANs spread over --users users, then
+times get_all_pans for random users on the base schema (implicit
+UNIQUE(user_id, pan) index + temp B-tree sort) and again after init_db()
+has applied the covering (user_id, created_at, id, name, pan) index.
+
+Usage:
+    python benchmarks/bench_pan_queries.py [--rows 1000000] [--users 100000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def fill(database, rows, users):
+    c = database.get_cursor()
+    per_user = max(1, rows // users)
+    base = time.time() - rows
+
+    def generate():
+        for i in range(rows):
+            user_id = i // per_user
+            created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i))
+            yield user_id, f"Holder {i}", f"PAN{i:07d}", created_at
+
+    c.executemany(
+        "INSERT INTO pan_numbers (user_id, name, pan, created_at) VALUES (?, ?, ?, ?)",
+        generate()
+    )
+    c.connection.commit()
+    return rows // per_user
+
+
+def measure(database, user_count, queries):
+    c = database.get_cursor()
+    plan = c.execute(
+        "EXPLAIN QUERY PLAN SELECT id, name, pan FROM pan_numbers WHERE user_id = ? ORDER BY created_at",
+        (0,)
+    ).fetchall()
+
+    samples = []
+    for _ in range(queries):
+        user_id = random.randrange(user_count)
+        start = time.perf_counter()
+        database.get_all_pans(user_id)
+        samples.append((time.perf_counter() - start) * 1e6)
+
+    return {
+        "plan": "; ".join(row[-1] for row in plan),
+        "mean_us": statistics.fmean(samples),
+        "p50_us": percentile(samples, 50),
+        "p95_us": percentile(samples, 95),
+        "p99_us": percentile(samples, 99),
+    }
+
+
+def report(label, result):
+    print(f"{label}")
+    print(f"  plan: {result['plan']}")
+    print(
+        f"  mean {result['mean_us']:.1f} us | p50 {result['p50_us']:.1f} us | "
+        f"p95 {result['p95_us']:.1f} us | p99 {result['p99_us']:.1f} us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=5_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        os.environ["DATA_DIR"] = data_dir
+        import database
+
+        # Measure SQLite itself, not the in-memory PAN list cache
+        database.pan_cache = database.PanListCache(0)
+
+        # Base schema only: create the tables, then undo migrations
+        database.init_db()
+        c = database.get_cursor()
+        c.execute("DROP INDEX IF EXISTS idx_pan_numbers_user_created")
+        c.execute("PRAGMA user_version = 0")
+        c.connection.commit()
+
+        start = time.perf_counter()
+        user_count = fill(database, args.rows, args.users)
+        print(f"Inserted {args.rows:,} rows for {user_count:,} users in {time.perf_counter() - start:.1f}s")
+
+        report("Before (schema version 0)", measure(database, user_count, args.queries))
+
+        start = time.perf_counter()
+        database.init_db()
+        print(f"Migrated to schema version {database.get_schema_version()} in {time.perf_counter() - start:.1f}s")
+
+        report("After (covering index)", measure(database, user_count, args.queries))
+        database.close_db()
+
+
+if __name__ == "__main__":
+    main()
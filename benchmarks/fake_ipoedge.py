@@ -0,0 +1,146 @@
+"""Local stand-in for the ipoedge API used by the benchmarks.
+
+Serves GET /api/ipos/allotedipo-list and POST /api/ipos/check-ipoallotment
+with configurable latency, error rate and list size, and counts the calls
+it receives. Can also be run on its own and pointed at by a real bot
+through IPOEDGE_BASE_URL.
+
+Usage:
+    python benchmarks/fake_ipoedge.py [--port 8765] [--latency-ms 50] [--error-rate 0] [--ipos 40]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LIST_PATH = "/api/ipos/allotedipo-list"
+CHECK_PATH = "/api/ipos/check-ipoallotment"
+
+# Registrar statuses returned for PANs, picked by a hash of the PAN
+STATUSES = ("Allotted", "Not Allotted", "Not Apply")
+
+
+def allotment_for(pan):
+    status = STATUSES[sum(map(ord, pan)) % len(STATUSES)]
+    shares = "15" if status == "Allotted" else "0"
+    return {"success": True, "dataResult": {"status": status, "shares_allotted": shares}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeIpoedge/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self, endpoint):
+        """Sleep for the configured latency; return True if this call should fail"""
+        fake = self.server.fake
+        fake.count(endpoint)
+        latency = fake.latency + random.uniform(0, fake.jitter)
+        if latency:
+            time.sleep(latency)
+        if fake.error_rate and random.random() < fake.error_rate:
+            fake.count(f"{endpoint}:error")
+            self._reply(500, {"success": False, "message": "Injected error"})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.path.split("?")[0] != LIST_PATH:
+            self._reply(404, {"success": False})
+            return
+        if self._simulate("allotedipo-list"):
+            return
+        self._reply(200, {"data": self.server.fake.ipos})
+
+    def do_POST(self):
+        if self.path != CHECK_PATH:
+            self._reply(404, {"success": False})
+            return
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self._simulate("check-ipoallotment"):
+            return
+        pans = payload.get("pancard", [])
+        self.server.fake.count("pans_checked", len(pans))
+        self._reply(200, {
+            "success": True,
+            "data": [{"pancard": pan, "data": allotment_for(pan)} for pan in pans]
+        })
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class FakeIpoedge:
+    """The fake API server, running in a background thread"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.05, jitter=0.0, error_rate=0.0, ipo_count=40):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.ipos = [{"ipoid": str(i), "iponame": f"Company {i} Limited IPO"} for i in range(1, ipo_count + 1)]
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _Handler)
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api"
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.calls[key] = self.calls.get(key, 0) + amount
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-ipoedge", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--ipos", type=int, default=40)
+    args = parser.parse_args()
+
+    fake = FakeIpoedge(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000,
+                       args.error_rate, args.ipos)
+    print(f"Serving fake ipoedge API at {fake.base_url} (Ctrl+C to stop)")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+        print(f"Calls: {fake.calls}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Offline Telegram side for the benchmarks.
+
+StubRequest answers Bot API calls locally (no network) and counts them, and
+UpdateFactory builds synthetic message and callback-query updates that can
+be fed to Application.process_update.
+"""
+import itertools
+import json
+import time
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class StubRequest(BaseRequest):
+    """Answers every Bot API method with a plausible successful result"""
+
+    def __init__(self):
+        self.calls = {}
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+
+        if api_method == "getMe":
+            result = BOT_USER
+        elif api_method in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id", 1), "type": "private"},
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    """Builds Update objects as Telegram would send them for a private chat"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _message(self, user_id, text):
+        return {
+            "message_id": next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+
+    def text(self, user_id, text):
+        """A text message (or reply-keyboard button press)"""
+        return Update.de_json({"update_id": next(self._ids), "message": self._message(user_id, text)}, self.bot)
+
+    def callback(self, user_id, data):
+        """An inline button press"""
+        return Update.de_json({
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "chat_instance": str(user_id),
+                "from": self._user(user_id),
+                "data": data,
+                "message": self._message(user_id, "menu"),
+            },
+        }, self.bot)
@@ -1,7 +1,25 @@
-import requests
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton
+# First import: times the imports below when STARTUP_PROFILE=true
+import startup
+import httpx
+from telegram import Bot, Update
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
-from database import init_db, add_pan, get_all_pans, delete_pan_by_id, get_pan_count
+from database import MAX_PANS_PER_USER
+from async_db import init_db, close_db, add_pan, get_all_pans, delete_pan_by_id, get_pan_count, add_watch, remove_watch
+import http_client
+from ipo_cache import IpoCache, IpoListUnavailable, IPO_SNAPSHOT_PATH
+from allotment import AllotmentService, CheckFailure, classify_failure
+from router import TextRouter, AWAITING_PAN, set_state, clear_state
+import render
+import metrics
+from ingress import IngressConsumer, IngressQueue, partition
+from web_server import start_web_server
+from health import HealthChecks
+from loop_watchdog import start_watchdog
+from log_setup import setup_logging
+from ipo_watcher import IpoWatcher
+from sender import SEND_GLOBAL_RATE, SendScheduler
+from state_store import StatePersistence, create_state_store
+from workers import WEB_WORKERS, WorkerPool
 from datetime import datetime
 import os
 import logging
@@ -10,96 +28,133 @@ import traceback
 import time
 import asyncio
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+startup.record("imports", startup.elapsed())
+
+# Configure logging (queued, PAN-masked; LOG_LEVEL / LOG_FORMAT)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-BASE_URL = "https://ipoedge-scraping-be.vercel.app/api"
+# ipoedge API (overridable, e.g. to point benchmarks at a local stand-in)
+BASE_URL = os.getenv("IPOEDGE_BASE_URL", "https://ipoedge-scraping-be.vercel.app/api")
 API_URL = f"{BASE_URL}/ipos/allotedipo-list"
 CHECK_ALLOTMENT_URL = f"{BASE_URL}/ipos/check-ipoallotment"
 
 # Pagination settings
 IPOS_PER_PAGE = 8  # Reduced from 10 to 8 to avoid scrolling on smaller devices
 
-init_db()
+# Minimum seconds between progress edits of the allotment loading message
+PROGRESS_EDIT_INTERVAL = 1.0
+
+# Shared cache of the allotted-IPO list (TTL / refresh / prefetch settings come
+# from env vars); the last good list is kept on disk for fast restarts
+ipo_cache = IpoCache(API_URL, IPOS_PER_PAGE, snapshot_path=IPO_SNAPSHOT_PATH)
+# Allotment checks backed by the (ipoid, PAN) result cache in database.py
+allotment_service = AllotmentService(CHECK_ALLOTMENT_URL)
+
+# Set once the schema is in place; a restart after a crash skips init_db
+_db_ready = False
+
+async def prepare_database():
+    """Create/migrate the database schema (once per process)"""
+    global _db_ready
+    if not _db_ready:
+        await init_db()
+        _db_ready = True
+
+async def warm_ipo_cache():
+    """Load the IPO list snapshot off the event loop (a no-op once the list is in memory)"""
+    await asyncio.to_thread(ipo_cache.load_snapshot)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logger.info(f"Start command received from user {update.message.from_user.id}")
-
-    # Send welcome message with bot description
-    welcome_msg = "🎉 *Welcome to IPO Allotment Bot!*\n\n"
-    welcome_msg += "This bot helps you check IPO allotment status for multiple PAN numbers.\n\n"
-    welcome_msg += "*Features:*\n"
-    welcome_msg += "• 📋 Manage multiple PAN numbers with names\n"
-    welcome_msg += "• 📊 Select from available IPOs\n"
-    welcome_msg += "• ✅ Check allotment status for all your PANs\n\n"
-    welcome_msg += "Use the menu below to get started! 👇"
-
-    # Reply keyboard (persistent keyboard at bottom)
-    reply_keyboard = [
-        ["📋 Manage PAN Numbers", "📊 Check IPO Allotment"],
-        ["ℹ️ Help"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-
-    # Inline keyboard (buttons below message)
-    inline_keyboard = [
-        [InlineKeyboardButton("📋 Manage PAN Numbers", callback_data="manage_pan"),
-         InlineKeyboardButton("📊 Check IPO Allotment", callback_data="ipo_list_0")],
-        [InlineKeyboardButton("ℹ️ Help", callback_data="help")]
-    ]
-
-    logger.info(f"Sending start message with {len(inline_keyboard)} rows of buttons")
+    logger.info("Start command received from user %s", update.message.from_user.id)
 
+    # Send welcome message with the main menu as a reply keyboard
     await update.message.reply_text(
-        welcome_msg,
-        reply_markup=reply_markup,  # Use reply keyboard instead of inline
+        render.WELCOME_MESSAGE,
+        reply_markup=render.MAIN_MENU_KEYBOARD,
         parse_mode="Markdown"
     )
 
     logger.info("Start message sent successfully")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = "📚 *How to use IPO Allotment Bot:*\n\n"
+    await update.message.reply_text(render.HELP_MESSAGE, parse_mode="Markdown")
 
-    msg += "*1. Manage PAN Numbers* 📋\n"
-    msg += "➕ Add PAN numbers with names (e.g., \"John Doe\")\n"
-    msg += "❌ Delete PAN numbers you no longer need\n"
-    msg += "👁️ View all your saved PAN numbers\n\n"
+async def show_main_menu(message, text=render.MAIN_MENU_MESSAGE):
+    await message.reply_text(text, reply_markup=render.MAIN_MENU_KEYBOARD, parse_mode="Markdown")
 
-    msg += "*2. Check IPO Allotment* 📊\n"
-    msg += "🔍 Click \"Check IPO Allotment\"\n"
-    msg += "📝 Select an IPO from the available list\n"
-    msg += "📈 Get allotment status for all your PAN numbers\n\n"
+async def reply_ipo_list(message, context, user_id, page):
+    """Reply with one page of the IPO list as reply-keyboard buttons"""
+    try:
+        catalog = await ipo_cache.get()
+        if not catalog:
+            await message.reply_text("❌ No IPOs found")
+            return
 
-    msg += "*Commands:*\n"
-    msg += "▶️ /start - Start the bot and show main menu\n"
-    msg += "ℹ️ /help - Show this help message\n\n"
+        # Get user's PAN count
+        pan_count = await get_pan_count(user_id)
 
-    msg += "*Flow:*\n"
-    msg += "1️⃣ Add your PAN numbers\n"
-    msg += "2️⃣ Click \"Check IPO Allotment\"\n"
-    msg += "3️⃣ Choose an IPO\n"
-    msg += "4️⃣ View results for all PANs\n\n"
+        # Only the page number is per-user; selections resolve via the catalog
+        context.user_data["current_page"] = page
 
-    msg += "💡 Use the keyboard buttons below to navigate!"
+        await message.reply_text(
+            render.ipo_list_message(len(catalog), pan_count, page, catalog.total_pages),
+            reply_markup=render.ipo_page_keyboard(catalog, page),
+            parse_mode="Markdown"
+        )
+    except IpoListUnavailable:
+        await message.reply_text("❌ Failed to fetch IPO list. Please try again later.")
+    except httpx.TimeoutException:
+        await message.reply_text("⏱️ Request timed out. Please try again.")
+    except Exception as e:
+        logger.error("Error fetching IPO list: %s", e)
+        await message.reply_text("❌ An error occurred. Please try again later.")
+
+async def reply_ipo_page(message, catalog, page):
+    """Reply with one page of the IPO list as inline check buttons"""
+    if catalog.page(page):
+        await message.reply_text(
+            render.ipo_page_title(page),
+            reply_markup=render.ipo_page_inline(catalog, page),
+            parse_mode="Markdown"
+        )
+    else:
+        await message.reply_text("❌ No IPOs available on this page.")
 
-    await update.message.reply_text(msg, parse_mode="Markdown")
+async def run_allotment_check(ipo_id, ipo_name, pans, on_progress=None):
+    """Check all of a user's PANs for an IPO; returns (rendered report, report).
 
-async def show_main_menu(message, text=None):
-    if text is None:
-        text = "🏠 *Main Menu*\n\nWhat would you like to do?"
+    Shared by the inline and reply-keyboard entry points; raises what
+    AllotmentService.check raises (see classify_failure).
+    """
+    pan_numbers = [pan_data["pan"] for pan_data in pans]
+    report = await allotment_service.check(ipo_id, pan_numbers, on_progress=on_progress)
+    return render.allotment_status(ipo_name, pans, report), report
 
-    # Reply keyboard for main menu
-    reply_keyboard = [
-        ["📋 Manage PAN Numbers", "📊 Check IPO Allotment"],
-        ["ℹ️ Help"]
-    ]
-    reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-    await message.reply_text(text, reply_markup=reply_markup, parse_mode="Markdown")
+async def get_ipo_name(ipo_id):
+    """Name of an IPO from the cached catalog ("IPO" if unknown)"""
+    try:
+        catalog = await ipo_cache.get()
+        entry = catalog.by_id.get(ipo_id)
+        if entry:
+            return entry.name
+    except Exception as e:
+        logger.error("Error fetching IPO name: %s", e)
+    return "IPO"
+
+# Callback data that carries an id/page after a fixed prefix
+CALLBACK_PREFIXES = ("check_", "ipo_list_", "delete_pan_", "watch_", "unwatch_")
+CALLBACK_ROUTES = {"manage_pan", "view_pans", "help", "add_pan", "delete_pan_menu", "back_to_menu"}
+
+def callback_route(update):
+    """Metrics label for a callback query (ids stripped to keep labels bounded)"""
+    data = update.callback_query.data or ""
+    if data in CALLBACK_ROUTES:
+        return f"callback:{data}"
+    for prefix in CALLBACK_PREFIXES:
+        if data.startswith(prefix):
+            return f"callback:{prefix.rstrip('_')}"
+    return "callback:unknown"
 
 async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -110,231 +165,62 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     if data == "manage_pan":
         # Show PAN management menu with reply keyboard
-        msg = "📋 *PAN Number Management*\n\n"
-        msg += "Choose an option:"
-
-        # Reply keyboard for PAN management
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-
-        await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+        await query.message.reply_text(render.PAN_MENU_MESSAGE, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
 
     elif data == "view_pans":
         # Show all PANs for the user
-        pans = get_all_pans(user_id)
-        total_pans = len(pans)
-
-        if not pans:
-            msg = "📋 *Your PAN Numbers:* (0/20)\n\n"
-            msg += "❌ No PAN numbers saved yet.\n\n"
-            msg += "💡 Add your first PAN to start checking IPO allotments."
-        else:
-            msg = f"📋 *Your PAN Numbers:* ({total_pans}/20)\n\n"
-            for idx, pan_data in enumerate(pans, 1):
-                msg += f"👤 {idx}. *{pan_data['name']}*\n"
-                msg += f"   📄 PAN: `{pan_data['pan']}`\n\n"
-
-        # Show PAN management keyboard
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-        await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+        pans = await get_all_pans(user_id)
+        await query.message.reply_text(render.pan_list(pans), reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
 
     elif data == "help":
-        msg = "📚 *How to use IPO Allotment Bot:*\n\n"
-
-        msg += "*1. Manage PAN Numbers* 📋\n"
-        msg += "• Add PAN numbers with names (e.g., \"John Doe\")\n"
-        msg += "• Delete PAN numbers you no longer need\n"
-        msg += "• View all your saved PAN numbers\n\n"
-
-        msg += "*2. Check IPO Allotment* 📊\n"
-        msg += "• Click \"Check IPO Allotment\"\n"
-        msg += "• Select an IPO from the available list\n"
-        msg += "• Get allotment status for all your PAN numbers\n\n"
-
-        msg += "*Commands:*\n"
-        msg += "/start - Start the bot and show main menu\n"
-        msg += "/help - Show this help message\n\n"
-
-        msg += "*Flow:*\n"
-        msg += "1️⃣ Add your PAN numbers\n"
-        msg += "2️⃣ Click \"Check IPO Allotment\"\n"
-        msg += "3️⃣ Choose an IPO\n"
-        msg += "4️⃣ View results for all PANs\n\n"
-
-        msg += "Use the buttons below to navigate! 👇"
-
-        keyboard = [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
-        await query.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
+        await query.message.reply_text(render.HELP_MESSAGE, reply_markup=render.BACK_TO_MENU_INLINE, parse_mode="Markdown")
 
     elif data == "add_pan":
         # Check if user has reached the limit
-        pan_count = get_pan_count(user_id)
-        if pan_count >= 20:
-            msg = "⚠️ *Limit Reached*\n\n"
-            msg += "You have reached the maximum limit of 20 PAN numbers.\n"
-            msg += "Please delete some PANs before adding new ones."
-
-            # Show PAN management keyboard
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+        pan_count = await get_pan_count(user_id)
+        if pan_count >= MAX_PANS_PER_USER:
+            await query.message.reply_text(render.PAN_LIMIT_MESSAGE, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
         else:
-            context.user_data["awaiting_pan"] = True
-            msg = f"➕ *Add New PAN Number* ({pan_count}/20)\n\n"
-            msg += "Please send your PAN details in one of these formats:\n\n"
-            msg += "*Format 1:* PAN only\n"
-            msg += "`ABCDE1234F`\n\n"
-            msg += "*Format 2:* PAN with name\n"
-            msg += "`ABCDE1234F  John Doe`\n\n"
-            msg += "� Tip: Separate PAN and name with a space"
-
-            # Show only Back to PAN Management button while waiting for PAN input
-            reply_keyboard = [
-                ["🔙 Back to PAN Management"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+            set_state(context, AWAITING_PAN)
+            await query.message.reply_text(
+                render.add_pan_prompt(pan_count),
+                reply_markup=render.AWAITING_PAN_KEYBOARD,
+                parse_mode="Markdown"
+            )
 
     elif data == "delete_pan_menu":
         # Show list of PANs to delete
-        pans = get_all_pans(user_id)
+        pans = await get_all_pans(user_id)
 
         if not pans:
-            msg = "❌ *No PAN Numbers*\n\n"
-            msg += "You don't have any PAN numbers to delete."
-
-            # Show PAN management keyboard
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+            await query.message.reply_text(
+                render.NO_PANS_TO_DELETE_MESSAGE,
+                reply_markup=render.PAN_MENU_KEYBOARD,
+                parse_mode="Markdown"
+            )
         else:
             # Store PANs in user context for deletion
             context.user_data["pans_for_deletion"] = pans
-
-            msg = "❌ *Delete PAN Number*\n\n"
-            msg += "Select a PAN to delete from the keyboard below:"
-
-            # Create keyboard with PAN list (2 buttons per row)
-            reply_keyboard = []
-            for idx, pan_data in enumerate(pans, 1):
-                name = pan_data['name']
-                pan = pan_data['pan']
-                button_text = f"🗑️ Delete {idx}: {pan} - {name}"
-
-                # Add 2 buttons per row
-                if idx % 2 == 1:
-                    reply_keyboard.append([button_text])
-                else:
-                    reply_keyboard[-1].append(button_text)
-
-            # Add back button
-            reply_keyboard.append(["🔙 Back to PAN Management"])
-
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+            await query.message.reply_text(
+                render.DELETE_PAN_PROMPT,
+                reply_markup=render.delete_pan_keyboard(pans),
+                parse_mode="Markdown"
+            )
 
     elif data.startswith("delete_pan_"):
         # Delete specific PAN
         pan_id = int(data.replace("delete_pan_", ""))
-        delete_pan_by_id(pan_id)
-
-        msg = "✅ *PAN Deleted Successfully*\n\n"
-        msg += "The PAN has been removed from your list."
-
-        # Show PAN management keyboard
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-        await query.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+        # Deletes are scoped to the requesting user
+        if await delete_pan_by_id(pan_id, user_id):
+            msg = render.PAN_REMOVED_MESSAGE
+        else:
+            msg = render.PAN_NOT_IN_LIST_MESSAGE
+        await query.message.reply_text(msg, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
 
     elif data.startswith("ipo_list_"):
         # Extract page number
         page = int(data.split("_")[-1])
-
-        try:
-            res = requests.get(API_URL, timeout=10)
-            if res.status_code == 200:
-                ipos = res.json().get("data", [])
-                if not ipos:
-                    await query.message.reply_text("❌ No IPOs found")
-                    return
-
-                # Get user's PAN count
-                pan_count = get_pan_count(user_id)
-
-                # Calculate pagination
-                total_ipos = len(ipos)
-                total_pages = (total_ipos + IPOS_PER_PAGE - 1) // IPOS_PER_PAGE
-                start_idx = page * IPOS_PER_PAGE
-                end_idx = min(start_idx + IPOS_PER_PAGE, total_ipos)
-
-                # Create reply keyboard with IPO buttons for current page (2 per row)
-                reply_keyboard = []
-                for idx, ipo in enumerate(ipos[start_idx:end_idx]):
-                    ipo_name = ipo.get('iponame', 'N/A')
-                    ipo_id = ipo.get('ipoid', '')
-                    # Truncate long names - no icon
-                    display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                    button_text = display_name
-
-                    # Add 2 buttons per row
-                    if idx % 2 == 0:
-                        reply_keyboard.append([button_text])
-                    else:
-                        reply_keyboard[-1].append(button_text)
-
-                # Store IPO mapping in context for button handling
-                context.user_data["ipo_list"] = ipos[start_idx:end_idx]
-                context.user_data["current_page"] = page
-
-                # Add pagination buttons (Previous and Next)
-                nav_buttons = []
-                if page > 0:
-                    nav_buttons.append("⬅️ Previous")
-                if page < total_pages - 1:
-                    nav_buttons.append("Next ➡️")
-
-                if nav_buttons:
-                    reply_keyboard.append(nav_buttons)
-
-                # Add refresh and back buttons in one row
-                reply_keyboard.append(["🔄 Refresh IPO List", "🔙 Back to Main Menu"])
-
-                reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-
-                # Build message with IPO count and PAN count
-                msg = f"📊 *IPO Allotment Check*\n\n"
-                msg += f"✅ IPO list updated ({total_ipos} IPOs available)\n\n"
-                msg += f"Select an IPO to check allotment status for your {pan_count} PAN number(s):\n\n"
-                msg += f"📄 Page {page + 1} of {total_pages}"
-
-                await query.message.reply_text(
-                    msg,
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
-            else:
-                await query.message.reply_text("❌ Failed to fetch IPO list. Please try again later.")
-        except requests.exceptions.Timeout:
-            await query.message.reply_text("⏱️ Request timed out. Please try again.")
-        except Exception as e:
-            logger.error(f"Error fetching IPO list: {e}")
-            await query.message.reply_text("❌ An error occurred. Please try again later.")
+        await reply_ipo_list(query.message, context, user_id, page)
 
     elif data == "back_to_menu":
         await show_main_menu(query.message)
@@ -343,809 +229,340 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Extract IPO ID from callback data
         ipo_id = data.replace("check_", "")
 
-        # Get IPO name from the API
-        ipo_name = "IPO"
-        try:
-            res = requests.get(API_URL, timeout=10)
-            if res.status_code == 200:
-                ipos = res.json().get("data", [])
-                for ipo in ipos:
-                    if ipo.get('ipoid') == ipo_id:
-                        ipo_name = ipo.get('iponame', 'IPO')
-                        break
-        except Exception as e:
-            logger.error(f"Error fetching IPO name: {e}")
+        # Get IPO name from the cached catalog
+        ipo_name = await get_ipo_name(ipo_id)
 
         # Get all user's PANs
-        pans = get_all_pans(user_id)
+        pans = await get_all_pans(user_id)
         if not pans:
-            keyboard = [[InlineKeyboardButton("➕ Add PAN Now", callback_data="add_pan")]]
             await query.message.reply_text(
-                "❌ *PAN Not Found!*\n\n"
-                "Please add your PAN card to check allotment status.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
+                render.PAN_REQUIRED_MESSAGE,
+                reply_markup=render.ADD_PAN_NOW_INLINE,
                 parse_mode="Markdown"
             )
             return
 
         # Show loading message
-        pan_count = len(pans)
-        loading_msg = await query.message.reply_text(
-            f"🔍 *Checking allotment status...*\n\n⏳ Checking {pan_count} PAN number(s)...\nPlease wait...",
-            parse_mode="Markdown"
-        )
+        loading_msg = await query.message.reply_text(render.checking_message(len(pans)), parse_mode="Markdown")
+
+        # Edit the loading message as chunks finish (throttled)
+        last_edit = 0.0
+
+        async def show_progress(report):
+            nonlocal last_edit
+            now = time.monotonic()
+            if now - last_edit < PROGRESS_EDIT_INTERVAL:
+                return
+            last_edit = now
+            try:
+                await loading_msg.edit_text(
+                    render.allotment_status(ipo_name, pans, report),
+                    parse_mode="Markdown"
+                )
+            except Exception as e:
+                logger.warning("Could not update progress message: %s", e)
 
-        # Call the check allotment API
         try:
-            # Extract just the PAN numbers
-            pan_numbers = [pan_data["pan"] for pan_data in pans]
-
-            payload = {
-                "ipoid": ipo_id,
-                "pancard": pan_numbers
-            }
-
-            # Log the payload for debugging
-            logger.info(f"Sending payload to API: {payload}")
-
-            response = requests.post(CHECK_ALLOTMENT_URL, json=payload, timeout=30)
-
-            # Log the response for debugging
-            logger.info(f"API Response Status: {response.status_code}")
-            logger.info(f"API Response Body: {response.text}")
-
-            if response.status_code == 200:
-                result = response.json()
-
-                # Format the response
-                if result.get("success"):
-                    data_array = result.get("data", [])
-
-                    # Create a mapping of PAN to response data for easy lookup
-                    pan_response_map = {}
-                    for item in data_array:
-                        pancard = item.get("pancard", "")
-                        pan_response_map[pancard] = item.get("data", {})
-
-                    # Build the message header
-                    msg = "🏦 *IPO Allotment Status*\n\n"
-                    msg += f"📋 *IPO:* {ipo_name}\n\n"
-
-                    # Track allotment status
-                    allotted_count = 0
-                    not_allotted_count = 0
-
-                    # Process each PAN and display status
-                    for idx, pan_data in enumerate(pans, 1):
-                        pan_number = pan_data["pan"]
-                        pan_name = pan_data["name"]
-
-                        msg += f"*{idx}.* 👤 *{pan_name}*\n"
-                        msg += f"      📋 PAN: `{pan_number}`\n"
-
-                        # Get the response for this PAN
-                        pan_response = pan_response_map.get(pan_number, {})
-
-                        if pan_response and pan_response.get("success"):
-                            # Extract dataResult from the nested structure
-                            data_result = pan_response.get("dataResult", {})
-                            status = data_result.get("status", "Unknown")
-                            shares_allotted = data_result.get("shares_allotted", "0")
-
-                            # Check status and display accordingly
-                            if status.lower() == "not apply":
-                                msg += f"      📊 Status: ❌ NOT APPLIED\n\n"
-                            elif status.lower() == "allotted":
-                                allotted_count += 1
-                                msg += f"      ✅ Status: *ALLOTTED*\n"
-                                msg += f"      📈 Shares: *{shares_allotted}*\n\n"
-                            else:
-                                # Check if it's "not allotted" status
-                                if status.lower() in ["not allotted", "not alloted"]:
-                                    not_allotted_count += 1
-                                    msg += f"      ❌ Status: *NOT ALLOTTED*\n\n"
-                                else:
-                                    # Show any other status
-                                    msg += f"      📊 Status: {status}\n"
-                                    if shares_allotted and shares_allotted != "0":
-                                        msg += f"      📈 Shares: {shares_allotted}\n"
-                                    msg += "\n"
-                        else:
-                            # No valid response for this PAN
-                            msg += f"      📊 Status: ❌ NOT APPLIED\n\n"
-
-                    # Add congratulatory or encouragement message
-                    if allotted_count > 0:
-                        if allotted_count == 1:
-                            msg += "🎉 *Congratulations!* You have been allotted 1 IPO!\n"
-                        else:
-                            msg += f"🎉 *Congratulations!* You have been allotted {allotted_count} IPOs!\n"
-                    elif not_allotted_count > 0:
-                        msg += "💪 *Better luck next time!* Keep trying.\n"
-
-                    # Add navigation buttons
-                    keyboard = [
-                        [InlineKeyboardButton("� Refresh IPO List", callback_data="ipo_list_0")],
-                        [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="back_to_menu")]
-                    ]
-                    await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
-                else:
-                    msg = f"❌ *Error*\n\n{result.get('message', 'Failed to check allotment')}"
-                    keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="ipo_list_0")]]
-                    await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
-            else:
-                msg = f"❌ *Failed to check allotment*\n\nError code: {response.status_code}\n\nPlease try again later."
-                keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="ipo_list_0")]]
-                await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
-
-        except requests.exceptions.Timeout:
-            msg = "⏱️ *Request Timed Out*\n\nThe server is taking too long to respond.\nPlease try again later."
-            keyboard = [[InlineKeyboardButton("🔄 Try Again", callback_data=f"check_{ipo_id}")]]
-            await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+            # Cached results are merged in; only missing PANs go upstream
+            msg, report = await run_allotment_check(ipo_id, ipo_name, pans, on_progress=show_progress)
+            await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=render.allotment_result_inline(report))
         except Exception as e:
-            logger.error(f"Error checking allotment: {e}")
-            msg = "❌ *An error occurred*\n\nPlease try again later."
-            keyboard = [[InlineKeyboardButton("🔙 Back", callback_data="ipo_list_0")]]
-            await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=InlineKeyboardMarkup(keyboard))
+            failure = classify_failure(e)
+            if failure is CheckFailure.ERROR:
+                logger.error("Error checking allotment: %s", e)
+            msg, reply_markup = render.allotment_failure(failure, e, ipo_id)
+            await loading_msg.edit_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
+
+    elif data.startswith("watch_"):
+        # Notify the user once this IPO's results are published
+        ipo_id = data.replace("watch_", "")
+        ipo_name = await get_ipo_name(ipo_id)
+        await add_watch(user_id, ipo_id, ipo_name)
+        await query.message.reply_text(
+            render.watch_added(ipo_name),
+            reply_markup=render.unwatch_inline(ipo_id),
+            parse_mode="Markdown"
+        )
 
-async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    elif data.startswith("unwatch_"):
+        ipo_id = data.replace("unwatch_", "")
+        await remove_watch(user_id, ipo_id)
+        await query.message.reply_text(render.WATCH_REMOVED_MESSAGE, reply_markup=render.BACK_TO_MENU_INLINE, parse_mode="Markdown")
+
+async def handle_pan_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text.strip()
     user_id = update.message.from_user.id
 
-    # IMPORTANT: Check awaiting_pan FIRST before any other text handling
-    if context.user_data.get("awaiting_pan"):
-        # Handle PAN input
-        # Parse the input - support multiple formats
-        # Format 1: ABCDE1234F (PAN only)
-        # Format 2: ABCDE1234F  John Doe (PAN with name, separated by spaces)
-
-        parts = text.split(None, 1)  # Split on first whitespace
-
-        if len(parts) == 1:
-            # Just PAN provided
-            pan = parts[0].upper()
-            name = "No Name"
-        elif len(parts) == 2:
-            # PAN and name provided
-            pan = parts[0].upper()
-            name = parts[1].strip()
+    # Handle PAN input (user is in the AWAITING_PAN state)
+    # Parse the input - support multiple formats
+    # Format 1: ABCDE1234F (PAN only)
+    # Format 2: ABCDE1234F  John Doe (PAN with name, separated by spaces)
+
+    parts = text.split(None, 1)  # Split on first whitespace
+
+    if len(parts) == 1:
+        # Just PAN provided
+        pan = parts[0].upper()
+        name = "No Name"
+    elif len(parts) == 2:
+        # PAN and name provided
+        pan = parts[0].upper()
+        name = parts[1].strip()
+    else:
+        await update.message.reply_text(render.INVALID_PAN_FORMAT_MESSAGE, parse_mode="Markdown")
+        return
+
+    # Validate PAN format (basic validation)
+    if len(pan) != 10:
+        await update.message.reply_text(render.INVALID_PAN_LENGTH_MESSAGE, parse_mode="Markdown")
+        return
+
+    # Add the PAN
+    try:
+        await add_pan(user_id, name, pan)
+        clear_state(context)
+        await update.message.reply_text(
+            render.pan_added(name, pan),
+            reply_markup=render.PAN_MENU_KEYBOARD,
+            parse_mode="Markdown"
+        )
+    except Exception as e:
+        logger.error("Error adding PAN: %s", e)
+        error_msg = str(e)
+
+        # Show specific error message
+        if "Maximum 20 PAN" in error_msg:
+            msg = render.PAN_LIMIT_MESSAGE
+        elif "already added" in error_msg:
+            msg = render.DUPLICATE_PAN_MESSAGE
         else:
-            await update.message.reply_text(
-                "❌ *Invalid Format*\n\n"
-                "Please use one of these formats:\n"
-                "• ABCDE1234F (PAN only)\n"
-                "• ABCDE1234F  John Doe (PAN with name)",
-                parse_mode="Markdown"
-            )
-            return
+            msg = render.ADD_PAN_FAILED_MESSAGE
+        await update.message.reply_text(msg, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
+        clear_state(context)
 
-        # Validate PAN format (basic validation)
-        if len(pan) != 10:
-            await update.message.reply_text(
-                "❌ *Invalid PAN*\n\n"
-                "PAN must be 10 characters long.\n"
-                "*Format:* ABCDE1234F",
-                parse_mode="Markdown"
-            )
-            return
+async def show_ipo_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Show IPO list with reply keyboard
+    await reply_ipo_list(update.message, context, update.message.from_user.id, 0)
 
-        # Add the PAN
-        try:
-            add_pan(user_id, name, pan)
-            context.user_data["awaiting_pan"] = False
-
-            msg = f"✅ *PAN Added Successfully!*\n\n"
-            msg += f"👤 *Name:* {name}\n"
-            msg += f"📄 *PAN:* `{pan}`\n\n"
-            msg += "🎉 You can now check IPO allotment status."
-
-            # Show PAN management keyboard
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
-        except Exception as e:
-            logger.error(f"Error adding PAN: {e}")
-            error_msg = str(e)
-
-            # Show PAN management keyboard after error
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-
-            # Show specific error message
-            if "Maximum 20 PAN" in error_msg:
-                await update.message.reply_text(
-                    "❌ *Limit Reached*\n\n"
-                    "You have reached the maximum limit of 20 PAN numbers.\n"
-                    "Please delete some PANs before adding new ones.",
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
-            elif "already added" in error_msg:
-                await update.message.reply_text(
-                    "❌ *Duplicate PAN*\n\n"
-                    "This PAN number is already added to your account.",
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
-            else:
-                await update.message.reply_text(
-                    "❌ *Error*\n\n"
-                    "Failed to add PAN. Please try again.",
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
-            context.user_data["awaiting_pan"] = False
+async def check_selected_ipo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    user_id = update.message.from_user.id
+
+    # Handle IPO selection from keyboard (fallback for text that's not a button)
+    catalog = ipo_cache.peek()
+    if not catalog:
         return
 
-    # Handle reply keyboard button presses
-    if text == "📊 Check IPO Allotment":
-        # Show IPO list with reply keyboard
-        try:
-            page = 0
-            res = requests.get(API_URL, timeout=10)
-            if res.status_code == 200:
-                ipos = res.json().get("data", [])
-                if not ipos:
-                    await update.message.reply_text("❌ No IPOs found")
-                    return
-
-                # Get user's PAN count
-                pan_count = get_pan_count(user_id)
-
-                # Calculate pagination
-                total_ipos = len(ipos)
-                total_pages = (total_ipos + IPOS_PER_PAGE - 1) // IPOS_PER_PAGE
-                start_idx = page * IPOS_PER_PAGE
-                end_idx = min(start_idx + IPOS_PER_PAGE, total_ipos)
-
-                # Create reply keyboard with IPO buttons for current page (2 per row)
-                reply_keyboard = []
-                for idx, ipo in enumerate(ipos[start_idx:end_idx]):
-                    ipo_name = ipo.get('iponame', 'N/A')
-                    ipo_id = ipo.get('ipoid', '')
-                    # Truncate long names - no icon
-                    display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                    button_text = display_name
-
-                    # Add 2 buttons per row
-                    if idx % 2 == 0:
-                        reply_keyboard.append([button_text])
-                    else:
-                        reply_keyboard[-1].append(button_text)
-
-                # Store IPO mapping in context for button handling
-                context.user_data["ipo_list"] = ipos[start_idx:end_idx]
-                context.user_data["current_page"] = page
-
-                # Add pagination buttons (Previous and Next)
-                nav_buttons = []
-                if page > 0:
-                    nav_buttons.append("⬅️ Previous")
-                if page < total_pages - 1:
-                    nav_buttons.append("Next ➡️")
-
-                if nav_buttons:
-                    reply_keyboard.append(nav_buttons)
-
-                # Add refresh and back buttons in one row
-                reply_keyboard.append(["🔄 Refresh IPO List", "🔙 Back to Main Menu"])
-
-                reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-
-                # Build message with IPO count and PAN count
-                msg = f"📊 *IPO Allotment Check*\n\n"
-                msg += f"✅ IPO list updated ({total_ipos} IPOs available)\n\n"
-                msg += f"Select an IPO to check allotment status for your {pan_count} PAN number(s):\n\n"
-                msg += f"📄 Page {page + 1} of {total_pages}"
-
-                await update.message.reply_text(
-                    msg,
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
-            else:
-                await update.message.reply_text("❌ Failed to fetch IPO list. Please try again later.")
-        except requests.exceptions.Timeout:
-            await update.message.reply_text("⏱️ Request timed out. Please try again.")
-        except Exception as e:
-            logger.error(f"Error fetching IPO list: {e}")
-            await update.message.reply_text("❌ An error occurred. Please try again later.")
-
-    elif text and not text.startswith("⬅️") and not text.startswith("Next") and not text.startswith("🔄") and not text.startswith("🔙") and not text.startswith("📋") and not text.startswith("❌") and not text.startswith("ℹ️") and not text.startswith("➕") and not text.startswith("🗑️"):
-        # Handle IPO selection from keyboard (any text that's not a special button)
-        ipo_list = context.user_data.get("ipo_list", [])
-        if ipo_list:
-            # Extract IPO name from button text
-            selected_ipo_name = text.strip()
-
-            # Find the matching IPO
-            selected_ipo = None
-            for ipo in ipo_list:
-                ipo_name = ipo.get('iponame', 'N/A')
-                display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                if display_name == selected_ipo_name:
-                    selected_ipo = ipo
-                    break
-
-            if selected_ipo:
-                # Get user's PANs
-                pans = get_all_pans(user_id)
-                if not pans:
-                    # Show PAN management keyboard when no PANs found
-                    reply_keyboard = [
-                        ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                        ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-                    ]
-                    reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-                    await update.message.reply_text(
-                        "❌ *No PAN numbers found.*\n\n"
-                        "Please add a PAN first to check IPO allotment status.",
-                        reply_markup=reply_markup,
-                        parse_mode="Markdown"
-                    )
-                    return
-
-                # Prepare API request
-                ipo_id = selected_ipo.get('ipoid', '')
-                ipo_name = selected_ipo.get('iponame', 'N/A')
-
-                try:
-                    # Extract just the PAN numbers
-                    pan_numbers = [pan["pan"] for pan in pans]
-
-                    payload = {
-                        "ipoid": ipo_id,
-                        "pancard": pan_numbers
-                    }
-
-                    logger.info(f"Sending payload to API: {payload}")
-                    response = requests.post(CHECK_ALLOTMENT_URL, json=payload, timeout=30)
-
-                    logger.info(f"API Response Status: {response.status_code}")
-                    logger.info(f"API Response Body: {response.text}")
-
-                    if response.status_code == 200:
-                        result = response.json()
-
-                        if result.get("success"):
-                            data_array = result.get("data", [])
-
-                            pan_response_map = {}
-                            for item in data_array:
-                                pancard = item.get("pancard", "")
-                                pan_response_map[pancard] = item.get("data", {})
-
-                            msg = "🏦 *IPO Allotment Status*\n\n"
-                            msg += f"📋 *IPO:* {ipo_name}\n\n"
-
-                            # Track allotment status
-                            allotted_count = 0
-                            not_allotted_count = 0
-
-                            for idx, pan_data in enumerate(pans, 1):
-                                pan_number = pan_data["pan"]
-                                pan_name = pan_data["name"]
-
-                                msg += f"*{idx}.* 👤 *{pan_name}*\n"
-                                msg += f"      📋 PAN: `{pan_number}`\n"
-
-                                pan_response = pan_response_map.get(pan_number, {})
-
-                                if pan_response and pan_response.get("success"):
-                                    data_result = pan_response.get("dataResult", {})
-                                    status = data_result.get("status", "Unknown")
-                                    shares_allotted = data_result.get("shares_allotted", "0")
-
-                                    if status.lower() == "not apply":
-                                        msg += f"      📊 Status: ❌ NOT APPLIED\n\n"
-                                    elif status.lower() == "allotted":
-                                        allotted_count += 1
-                                        msg += f"      ✅ Status: *ALLOTTED*\n"
-                                        msg += f"      📈 Shares: *{shares_allotted}*\n\n"
-                                    else:
-                                        # Check if it's "not allotted" status
-                                        if status.lower() in ["not allotted", "not alloted"]:
-                                            not_allotted_count += 1
-                                            msg += f"      ❌ Status: *NOT ALLOTTED*\n\n"
-                                        else:
-                                            # Show any other status
-                                            msg += f"      📊 Status: {status}\n"
-                                            if shares_allotted and shares_allotted != "0":
-                                                msg += f"      📈 Shares: {shares_allotted}\n"
-                                            msg += "\n"
-                                else:
-                                    msg += f"      📊 Status: ❌ NOT APPLIED\n\n"
-
-                            # Add congratulatory or encouragement message
-                            if allotted_count > 0:
-                                if allotted_count == 1:
-                                    msg += "🎉 *Congratulations!* You have been allotted 1 IPO!\n"
-                                else:
-                                    msg += f"🎉 *Congratulations!* You have been allotted {allotted_count} IPOs!\n"
-                            elif not_allotted_count > 0:
-                                msg += "💪 *Better luck next time!* Keep trying.\n"
-
-                            await update.message.reply_text(msg, parse_mode="Markdown")
-                        else:
-                            await update.message.reply_text("❌ Failed to fetch allotment status. Please try again.")
-                    else:
-                        await update.message.reply_text("❌ API Error. Please try again later.")
-                except Exception as e:
-                    logger.error(f"Error checking allotment: {e}")
-                    await update.message.reply_text("❌ An error occurred. Please try again.")
-
-    elif text == "⬅️ Previous":
-        # Handle previous page
-        try:
-            current_page = context.user_data.get("current_page", 0)
-            if current_page > 0:
-                new_page = current_page - 1
-                context.user_data["current_page"] = new_page
-
-                # Fetch and display IPO list for previous page
-                try:
-                    page = new_page
-                    res = requests.get(API_URL, timeout=10)
-                    if res.status_code == 200:
-                        ipos = res.json().get("data", [])
-                        context.user_data["ipo_list"] = ipos
-
-                        items_per_page = 5
-                        start_idx = page * items_per_page
-                        end_idx = start_idx + items_per_page
-                        page_ipos = ipos[start_idx:end_idx]
-
-                        if page_ipos:
-                            msg = f"📊 *Select an IPO* (Page {page + 1})\n\n"
-                            keyboard = []
-                            for ipo in page_ipos:
-                                ipo_name = ipo.get('iponame', 'N/A')
-                                display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                                keyboard.append([InlineKeyboardButton(display_name, callback_data=f"check_{ipo.get('ipoid')}")])
-
-                            # Add navigation buttons
-                            nav_buttons = []
-                            if page > 0:
-                                nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"ipo_list_{page - 1}"))
-                            if end_idx < len(ipos):
-                                nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"ipo_list_{page + 1}"))
-                            if nav_buttons:
-                                keyboard.append(nav_buttons)
-
-                            keyboard.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")])
-
-                            await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
-                        else:
-                            await update.message.reply_text("❌ No IPOs available on this page.")
-                    else:
-                        await update.message.reply_text("❌ Failed to fetch IPO list.")
-                except Exception as e:
-                    logger.error(f"Error fetching IPO list for previous page: {e}")
-                    await update.message.reply_text("❌ Error loading previous page.")
-            else:
-                await update.message.reply_text("❌ Already on first page.")
-        except Exception as e:
-            logger.error(f"Error handling previous page: {e}")
-            await update.message.reply_text("❌ Error processing request.")
+    # Button labels are indexed in the shared catalog
+    selected_ipo = catalog.by_label.get(text)
+    if not selected_ipo:
+        return
 
-    elif text == "Next ➡️":
-        # Handle next page
-        try:
-            current_page = context.user_data.get("current_page", 0)
-            res = requests.get(API_URL, timeout=10)
-            if res.status_code == 200:
-                ipos = res.json().get("data", [])
-                total_ipos = len(ipos)
-                total_pages = (total_ipos + IPOS_PER_PAGE - 1) // IPOS_PER_PAGE
-
-                if current_page < total_pages - 1:
-                    new_page = current_page + 1
-                    context.user_data["current_page"] = new_page
-
-                    # Display next page
-                    start_idx = new_page * IPOS_PER_PAGE
-                    end_idx = start_idx + IPOS_PER_PAGE
-                    page_ipos = ipos[start_idx:end_idx]
-
-                    if page_ipos:
-                        msg = f"📊 *Select an IPO* (Page {new_page + 1})\n\n"
-                        keyboard = []
-                        for ipo in page_ipos:
-                            ipo_name = ipo.get('iponame', 'N/A')
-                            display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                            keyboard.append([InlineKeyboardButton(display_name, callback_data=f"check_{ipo.get('ipoid')}")])
-
-                        # Add navigation buttons
-                        nav_buttons = []
-                        if new_page > 0:
-                            nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"ipo_list_{new_page - 1}"))
-                        if end_idx < total_ipos:
-                            nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"ipo_list_{new_page + 1}"))
-                        if nav_buttons:
-                            keyboard.append(nav_buttons)
-
-                        keyboard.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")])
-
-                        await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
-                    else:
-                        await update.message.reply_text("❌ No IPOs available on this page.")
-                else:
-                    await update.message.reply_text("❌ Already on last page.")
-            else:
-                await update.message.reply_text("❌ Failed to fetch IPO list.")
-        except Exception as e:
-            logger.error(f"Error handling next page: {e}")
-            await update.message.reply_text("❌ Error processing request.")
+    # Get user's PANs
+    pans = await get_all_pans(user_id)
+    if not pans:
+        # Show PAN management keyboard when no PANs found
+        await update.message.reply_text(
+            render.NO_PANS_FOR_CHECK_MESSAGE,
+            reply_markup=render.PAN_MENU_KEYBOARD,
+            parse_mode="Markdown"
+        )
+        return
 
-    elif text == "🔄 Refresh IPO List":
-        # Handle refresh - go back to page 0
-        try:
-            context.user_data["current_page"] = 0
+    try:
+        # Cached results are merged in; only missing PANs go upstream
+        msg, report = await run_allotment_check(selected_ipo.ipoid, selected_ipo.name, pans)
+        # Offer a watch while the results are not out yet
+        reply_markup = None if report.published else render.watch_offer_inline(selected_ipo.ipoid)
+        await update.message.reply_text(msg, parse_mode="Markdown", reply_markup=reply_markup)
+    except Exception as e:
+        failure = classify_failure(e)
+        if failure in (CheckFailure.TIMEOUT, CheckFailure.ERROR):
+            logger.error("Error checking allotment: %s", e)
+        await update.message.reply_text(render.ALLOTMENT_REPLY_FAILURES[failure])
+
+async def previous_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Handle previous page
+    try:
+        current_page = context.user_data.get("current_page", 0)
+        if current_page > 0:
+            new_page = current_page - 1
+            context.user_data["current_page"] = new_page
 
-            # Fetch and display IPO list
+            # Fetch and display IPO list for previous page
             try:
-                page = 0
-                res = requests.get(API_URL, timeout=10)
-                if res.status_code == 200:
-                    ipos = res.json().get("data", [])
-                    context.user_data["ipo_list"] = ipos
-
-                    items_per_page = IPOS_PER_PAGE
-                    start_idx = page * items_per_page
-                    end_idx = start_idx + items_per_page
-                    page_ipos = ipos[start_idx:end_idx]
-
-                    if page_ipos:
-                        msg = f"📊 *Select an IPO* (Page {page + 1})\n\n"
-                        keyboard = []
-                        for ipo in page_ipos:
-                            ipo_name = ipo.get('iponame', 'N/A')
-                            display_name = ipo_name[:35] + "..." if len(ipo_name) > 35 else ipo_name
-                            keyboard.append([InlineKeyboardButton(display_name, callback_data=f"check_{ipo.get('ipoid')}")])
-
-                        # Add navigation buttons
-                        nav_buttons = []
-                        if end_idx < len(ipos):
-                            nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"ipo_list_1"))
-                        if nav_buttons:
-                            keyboard.append(nav_buttons)
-
-                        keyboard.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")])
-
-                        await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="Markdown")
-                    else:
-                        await update.message.reply_text("❌ No IPOs available.")
-                else:
-                    await update.message.reply_text("❌ Failed to fetch IPO list.")
-            except requests.exceptions.Timeout:
-                await update.message.reply_text("⏱️ Request timed out. Please try again.")
+                catalog = await ipo_cache.get()
+                await reply_ipo_page(update.message, catalog, new_page)
+            except IpoListUnavailable:
+                await update.message.reply_text("❌ Failed to fetch IPO list.")
             except Exception as e:
-                logger.error(f"Error fetching IPO list: {e}")
-                await update.message.reply_text("❌ An error occurred. Please try again later.")
-        except Exception as e:
-            logger.error(f"Error refreshing IPO list: {e}")
-            await update.message.reply_text("❌ Error processing request.")
+                logger.error("Error fetching IPO list for previous page: %s", e)
+                await update.message.reply_text("❌ Error loading previous page.")
+        else:
+            await update.message.reply_text("❌ Already on first page.")
+    except Exception as e:
+        logger.error("Error handling previous page: %s", e)
+        await update.message.reply_text("❌ Error processing request.")
 
-    elif text == "📋 Manage PAN Numbers":
-        # Show PAN management menu with reply keyboard
-        msg = "📋 *PAN Number Management*\n\n"
-        msg += "Choose an option:"
+async def next_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Handle next page
+    try:
+        current_page = context.user_data.get("current_page", 0)
+        catalog = await ipo_cache.get()
 
-        # Reply keyboard for PAN management
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
+        if current_page < catalog.total_pages - 1:
+            new_page = current_page + 1
+            context.user_data["current_page"] = new_page
 
-        await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+            # Display next page
+            await reply_ipo_page(update.message, catalog, new_page)
+        else:
+            await update.message.reply_text("❌ Already on last page.")
+    except IpoListUnavailable:
+        await update.message.reply_text("❌ Failed to fetch IPO list.")
+    except Exception as e:
+        logger.error("Error handling next page: %s", e)
+        await update.message.reply_text("❌ Error processing request.")
 
-    elif text == "➕ Add PAN Number":
-        # Handle Add PAN Number button
-        pan_count = get_pan_count(user_id)
+async def refresh_ipo_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Handle refresh - go back to page 0
+    context.user_data["current_page"] = 0
 
-        # Check if user has reached the limit
-        if pan_count >= 20:
-            msg = "❌ *Limit Reached*\n\n"
-            msg += "You have reached the maximum limit of 20 PAN numbers.\n"
-            msg += "Please delete some PANs before adding new ones."
-
-            # Show PAN management keyboard
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
-        else:
-            context.user_data["awaiting_pan"] = True
-            msg = f"📋 *Add PAN Number* ({pan_count}/20)\n\n"
-            msg += "Please send your PAN details in one of these formats:\n\n"
-            msg += "*Format 1:* PAN only\n"
-            msg += "`ABCDE1234F`\n\n"
-            msg += "*Format 2:* PAN with name\n"
-            msg += "`ABCDE1234F  John Doe`\n\n"
-            msg += "💡 Tip: Separate PAN and name with a space"
-
-            # Show only Back to PAN Management button while waiting for PAN input
-            reply_keyboard = [
-                ["🔙 Back to PAN Management"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
-
-    elif text == "ℹ️ Help":
-        # Show help message
-        msg = "📚 *How to use IPO Allotment Bot:*\n\n"
-
-        msg += "*1. Manage PAN Numbers* 📋\n"
-        msg += "➕ Add PAN numbers with names (e.g., \"John Doe\")\n"
-        msg += "❌ Delete PAN numbers you no longer need\n"
-        msg += "👁️ View all your saved PAN numbers\n\n"
-
-        msg += "*2. Check IPO Allotment* 📊\n"
-        msg += "🔍 Click \"Check IPO Allotment\"\n"
-        msg += "📝 Select an IPO from the available list\n"
-        msg += "📈 Get allotment status for all your PAN numbers\n\n"
-
-        msg += "*Commands:*\n"
-        msg += "▶️ /start - Start the bot and show main menu\n"
-        msg += "ℹ️ /help - Show this help message\n\n"
-
-        msg += "*Flow:*\n"
-        msg += "1️⃣ Add your PAN numbers\n"
-        msg += "2️⃣ Click \"Check IPO Allotment\"\n"
-        msg += "3️⃣ Choose an IPO\n"
-        msg += "4️⃣ View results for all PANs\n\n"
-
-        msg += "💡 Use the keyboard buttons below to navigate!"
-
-        await update.message.reply_text(msg, parse_mode="Markdown")
-
-    elif text == "❌ Delete PAN Number":
-        # Show list of PANs to delete
-        pans = get_all_pans(user_id)
-        if not pans:
-            msg = "❌ *No PAN Numbers Found*\n\n"
-            msg += "You don't have any PAN numbers saved yet.\n"
-            msg += "Add a PAN number first to get started."
-
-            # Show PAN management keyboard
-            reply_keyboard = [
-                ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-            ]
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+    # Fetch and display IPO list
+    try:
+        catalog = await ipo_cache.get(force=True)
+        if catalog:
+            await reply_ipo_page(update.message, catalog, 0)
         else:
-            # Store PANs in user context for deletion
-            context.user_data["pans_for_deletion"] = pans
+            await update.message.reply_text("❌ No IPOs available.")
+    except IpoListUnavailable:
+        await update.message.reply_text("❌ Failed to fetch IPO list.")
+    except httpx.TimeoutException:
+        await update.message.reply_text("⏱️ Request timed out. Please try again.")
+    except Exception as e:
+        logger.error("Error fetching IPO list: %s", e)
+        await update.message.reply_text("❌ An error occurred. Please try again later.")
+
+async def manage_pans(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Show PAN management menu with reply keyboard
+    await update.message.reply_text(render.PAN_MENU_MESSAGE, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
+
+async def prompt_add_pan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Handle Add PAN Number button
+    pan_count = await get_pan_count(update.message.from_user.id)
+
+    # Check if user has reached the limit
+    if pan_count >= MAX_PANS_PER_USER:
+        await update.message.reply_text(render.PAN_LIMIT_MESSAGE, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
+    else:
+        set_state(context, AWAITING_PAN)
+        # Show only Back to PAN Management button while waiting for PAN input
+        await update.message.reply_text(
+            render.add_pan_prompt(pan_count),
+            reply_markup=render.AWAITING_PAN_KEYBOARD,
+            parse_mode="Markdown"
+        )
+
+async def delete_pan_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Show list of PANs to delete
+    pans = await get_all_pans(update.message.from_user.id)
+    if not pans:
+        await update.message.reply_text(
+            render.NO_PANS_TO_DELETE_MESSAGE,
+            reply_markup=render.PAN_MENU_KEYBOARD,
+            parse_mode="Markdown"
+        )
+    else:
+        # Store PANs in user context for deletion
+        context.user_data["pans_for_deletion"] = pans
+        await update.message.reply_text(
+            render.DELETE_PAN_PROMPT,
+            reply_markup=render.delete_pan_keyboard(pans),
+            parse_mode="Markdown"
+        )
+
+async def view_pans(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Show all PANs for the user
+    pans = await get_all_pans(update.message.from_user.id)
+    await update.message.reply_text(render.pan_list(pans), reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
 
-            msg = "❌ *Delete PAN Number*\n\n"
-            msg += "Select a PAN to delete from the keyboard below:"
+async def back_to_pan_management(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Clear deletion state and go back to PAN management
+    context.user_data["pans_for_deletion"] = None
+    clear_state(context)
+    await update.message.reply_text(render.PAN_MENU_TITLE, reply_markup=render.PAN_MENU_KEYBOARD, parse_mode="Markdown")
 
-            # Create keyboard with PAN list (2 buttons per row)
-            reply_keyboard = []
-            for idx, pan_data in enumerate(pans, 1):
-                name = pan_data['name']
-                pan = pan_data['pan']
-                button_text = f"🗑️ Delete {idx}: {pan} - {name}"
+async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Clear any pending state
+    clear_state(context)
+    context.user_data["pans_for_deletion"] = None
+    await show_main_menu(update.message, render.MAIN_MENU_TITLE)
 
-                # Add 2 buttons per row
-                if idx % 2 == 1:
-                    reply_keyboard.append([button_text])
-                else:
-                    reply_keyboard[-1].append(button_text)
+async def delete_selected_pan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    text = update.message.text.strip()
+    user_id = update.message.from_user.id
 
-            # Add back button
-            reply_keyboard.append(["🔙 Back to PAN Management"])
+    # Handle delete PAN button press
+    pans = context.user_data.get("pans_for_deletion", [])
+    if not pans:
+        await update.message.reply_text("❌ Error: No PANs available for deletion.")
+        return
 
-            reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-            await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
+    # Extract the index from button text (e.g., "🗑️ Delete 1: ABCDE1234F - John Doe" -> 1)
+    try:
+        # Remove the prefix "🗑️ Delete " and split by ":"
+        text_without_prefix = text.replace(render.BTN_DELETE_PREFIX, "").strip()
+        parts = text_without_prefix.split(":", 1)
+        pan_index = int(parts[0].strip()) - 1  # Convert to 0-based index
 
-    elif text == "📋 View PAN Numbers":
-        # Show all PANs for the user
-        pans = get_all_pans(user_id)
-        total_pans = len(pans)
+        if 0 <= pan_index < len(pans):
+            pan_data = pans[pan_index]
 
-        if not pans:
-            msg = "📋 *Your PAN Numbers:* (0/20)\n\n"
-            msg += "❌ No PAN numbers saved yet.\n\n"
-            msg += "💡 Add your first PAN to start checking IPO allotments."
+            # Delete the PAN
+            await delete_pan_by_id(pan_data['id'], user_id)
+
+            # Clear deletion state
+            context.user_data["pans_for_deletion"] = None
+
+            await update.message.reply_text(
+                render.pan_deleted(pan_data['name'], pan_data['pan']),
+                reply_markup=render.PAN_MENU_KEYBOARD,
+                parse_mode="Markdown"
+            )
         else:
-            msg = f"📋 *Your PAN Numbers:* ({total_pans}/20)\n\n"
-            for idx, pan_data in enumerate(pans, 1):
-                msg += f"👤 {idx}. *{pan_data['name']}*\n"
-                msg += f"   📄 PAN: `{pan_data['pan']}`\n\n"
-
-        # Show PAN management keyboard
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-        await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
-
-    elif text == "🔙 Back to PAN Management":
-        # Clear deletion state and go back to PAN management
-        context.user_data["pans_for_deletion"] = None
-        context.user_data["awaiting_pan"] = False
-
-        # Show PAN management keyboard
-        reply_keyboard = [
-            ["➕ Add PAN Number", "❌ Delete PAN Number"],
-            ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-        await update.message.reply_text("📋 *PAN Number Management*", reply_markup=reply_markup, parse_mode="Markdown")
-
-    elif text == "🔙 Back to Main Menu":
-        # Clear any pending state
-        context.user_data["awaiting_pan"] = False
-        context.user_data["pans_for_deletion"] = None
-
-        # Show Main Menu keyboard
-        reply_keyboard = [
-            ["📋 Manage PAN Numbers", "📊 Check IPO Allotment"],
-            ["ℹ️ Help"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-        await update.message.reply_text("🏠 *Main Menu*", reply_markup=reply_markup, parse_mode="Markdown")
-
-    elif text.startswith("🗑️ Delete "):
-        # Handle delete PAN button press
-        pans = context.user_data.get("pans_for_deletion", [])
-        if not pans:
-            await update.message.reply_text("❌ Error: No PANs available for deletion.")
-            return
+            await update.message.reply_text("❌ Invalid PAN selection.")
+    except (ValueError, IndexError) as e:
+        logger.error("Error parsing delete button: %s", e)
+        logger.error("Button text was: %s", text)
+        await update.message.reply_text("❌ Error processing deletion.")
+
+# Text routing table, built once: exact button labels, prefix buttons and
+# conversation states each resolve with a single lookup
+text_router = TextRouter()
+text_router.add_state(AWAITING_PAN, handle_pan_input)
+text_router.add_exact(render.BTN_CHECK_ALLOTMENT, show_ipo_list)
+text_router.add_exact(render.BTN_PREVIOUS, previous_page)
+text_router.add_exact(render.BTN_NEXT, next_page)
+text_router.add_exact(render.BTN_REFRESH_IPOS, refresh_ipo_list)
+text_router.add_exact(render.BTN_MANAGE_PANS, manage_pans)
+text_router.add_exact(render.BTN_ADD_PAN, prompt_add_pan)
+text_router.add_exact(render.BTN_HELP, help_command)
+text_router.add_exact(render.BTN_DELETE_PAN, delete_pan_menu)
+text_router.add_exact(render.BTN_VIEW_PANS, view_pans)
+text_router.add_exact(render.BTN_BACK_TO_PAN_MANAGEMENT, back_to_pan_management)
+text_router.add_exact(render.BTN_BACK_TO_MAIN, back_to_main_menu)
+text_router.add_prefix(render.BTN_DELETE_PREFIX, delete_selected_pan)
+text_router.set_fallback(check_selected_ipo)
 
-        # Extract the index from button text (e.g., "🗑️ Delete 1: ABCDE1234F - John Doe" -> 1)
-        try:
-            # Remove the prefix "🗑️ Delete " and split by ":"
-            # Format: "🗑️ Delete 1: ABCDE1234F - John Doe"
-            text_without_prefix = text.replace("🗑️ Delete ", "").strip()
-            # Split by ":" to separate index from rest
-            parts = text_without_prefix.split(":", 1)
-            pan_index = int(parts[0].strip()) - 1  # Convert to 0-based index
-
-            if 0 <= pan_index < len(pans):
-                pan_data = pans[pan_index]
-                pan_id = pan_data['id']
-                name = pan_data['name']
-                pan = pan_data['pan']
-
-                # Delete the PAN
-                delete_pan_by_id(pan_id)
-
-                msg = f"✅ *PAN Deleted Successfully*\n\n"
-                msg += f"🗑️ Deleted: `{pan}` - *{name}*"
-
-                # Clear deletion state
-                context.user_data["pans_for_deletion"] = None
-
-                # Show PAN management keyboard
-                reply_keyboard = [
-                    ["➕ Add PAN Number", "❌ Delete PAN Number"],
-                    ["📋 View PAN Numbers", "🔙 Back to Main Menu"]
-                ]
-                reply_markup = ReplyKeyboardMarkup(reply_keyboard, resize_keyboard=True)
-                await update.message.reply_text(msg, reply_markup=reply_markup, parse_mode="Markdown")
-            else:
-                await update.message.reply_text("❌ Invalid PAN selection.")
-        except (ValueError, IndexError) as e:
-            logger.error(f"Error parsing delete button: {e}")
-            logger.error(f"Button text was: {text}")
-            await update.message.reply_text("❌ Error processing deletion.")
+async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Dispatch text messages and reply-keyboard buttons via the routing table"""
+    await text_router.dispatch(update, context)
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors and notify user"""
-    logger.error(f"Update {update} caused error {context.error}")
+    # Log the update id rather than the whole update, which carries user text
+    update_id = update.update_id if isinstance(update, Update) else None
+    logger.error("Update %s caused error %r", update_id, context.error, exc_info=context.error)
     try:
         if update and update.effective_message:
             await update.effective_message.reply_text(
@@ -1153,10 +570,132 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode="Markdown"
             )
     except Exception as e:
-        logger.error(f"Error in error handler: {e}")
+        logger.error("Error in error handler: %s", e)
+
+def add_handlers(app):
+    """Register the bot's handlers on a PTB Application"""
+    app.add_handler(CommandHandler("start", metrics.instrumented(start, "command:start")))
+    app.add_handler(CommandHandler("help", metrics.instrumented(help_command, "command:help")))
+    app.add_handler(CallbackQueryHandler(metrics.instrumented(handle_buttons, callback_route)))
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+
+    # Add error handler
+    app.add_error_handler(error_handler)
+
+def build_application(token, owns=None, request=None, workers=1):
+    """Build the Application: send scheduler, persisted user state and the handlers.
+
+    owns(user_id) limits the state loaded at startup to one worker's users;
+    request replaces the Bot API transport (the benchmark's stub); workers
+    is the number of processes sending with the same bot token.
+    """
+    # Every Bot API call goes through the send scheduler (flood limits, lanes, edit coalescing).
+    # Telegram's global limit is per bot token, so worker processes split it
+    scheduler = SendScheduler(global_rate=SEND_GLOBAL_RATE / workers)
+    builder = ApplicationBuilder().token(token).rate_limiter(scheduler)
+    if request is not None:
+        builder = builder.request(request)
+    # context.user_data survives restarts (STATE_BACKEND)
+    store = create_state_store()
+    if store is not None:
+        builder = builder.persistence(StatePersistence(store, owns))
+    app = builder.build()
+    add_handlers(app)
+    return app
+
+async def run_ingress(token, webhook_url, port):
+    """Web process of multi-worker webhook mode: queues updates for the worker processes"""
+    logger.info(f"Using webhook mode with {WEB_WORKERS} workers: {webhook_url}")
+    pool = WorkerPool(WEB_WORKERS)
+    ingress_queue = IngressQueue()
+    # The workers' dependencies are not visible from here; this checks the web process itself
+    # and fails liveness once a worker kept crashing
+    health = HealthChecks(database=False, ingress=ingress_queue, alive=lambda: not pool.failed)
+    web_server = None
+    lag_monitor = None
+    try:
+        # Updates are accepted into the queue while the workers start
+        with startup.phase("web server"):
+            web_server = start_web_server(ingress_queue.append, port, token, health)
+        lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+        with startup.phase("workers"):
+            pool.start()
+        async with Bot(token) as ingress_bot:
+            with startup.phase("webhook"):
+                await ingress_bot.set_webhook(
+                    url=f"{webhook_url}/{token}",
+                    allowed_updates=Update.ALL_TYPES,
+                    # Updates queued while the bot was down are still wanted
+                    drop_pending_updates=False
+                )
+            startup.report("Webhook ingress")
+            health.mark_ready()
+            logger.info("✅ Webhook started successfully")
+            print("✅ Webhook started successfully")
+            await asyncio.Event().wait()
+    finally:
+        if lag_monitor is not None:
+            lag_monitor.cancel()
+        if web_server is not None:
+            web_server.stop()
+        await pool.stop()
+        await ingress_queue.close()
+
+def run_worker(index, count, stop_event):
+    """Entry point of a worker process in multi-worker webhook mode (see workers.py)"""
+    asyncio.run(serve_worker(index, count, stop_event))
+
+async def serve_worker(index, count, stop_event):
+    app = build_application(
+        os.getenv("BOT_TOKEN"), owns=lambda user_id: partition(user_id, count) == index, workers=count
+    )
+    await http_client.init_http_client()
+    loop_watchdog = start_watchdog()
+    lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+
+    ingress_queue = IngressQueue()
+    consumer = IngressConsumer(ingress_queue, app, index, count)
+    ipo_watcher = None
+    try:
+        await asyncio.gather(
+            startup.timed("database", prepare_database()),
+            startup.timed("ipo list", warm_ipo_cache()),
+            startup.timed("application", app.initialize()),
+        )
+        await app.start()
+
+        # Background jobs run once, in the first worker; the others start from the
+        # snapshot and refetch the IPO list themselves when their copy expires
+        if index == 0:
+            ipo_cache.start_prefetcher()
+            ipo_watcher = IpoWatcher(app.bot, CHECK_ALLOTMENT_URL)
+            ipo_watcher.start()
+        startup.report(f"Worker {index} of {count}")
+
+        # Runs until the web process sets stop_event
+        await consumer.run(should_stop=stop_event.is_set)
+    finally:
+        await consumer.stop()
+        await ingress_queue.close()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        lag_monitor.cancel()
+        if loop_watchdog is not None:
+            loop_watchdog.stop()
+        if ipo_watcher is not None:
+            await ipo_watcher.stop()
+        await ipo_cache.stop_prefetcher()
+        await http_client.close_http_client()
+        await close_db()
 
 async def run_bot():
-    """Run bot with webhook or polling mode"""
+    """Run bot with webhook or polling mode.
+
+    Module-level state (the IPO list, PAN list and allotment caches, the
+    database schema) outlives a run, so a restart by main() starts warm;
+    only the Application, which is bound to its event loop, is rebuilt.
+    """
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     WEBHOOK_URL = os.getenv("WEBHOOK_URL")
     PORT = int(os.getenv("PORT", 10000))
@@ -1166,40 +705,76 @@ async def run_bot():
         logger.error("❌ BOT_TOKEN not set in environment variables")
         sys.exit(1)
 
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
-
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CallbackQueryHandler(handle_buttons))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
+    if USE_WEBHOOK and WEBHOOK_URL and WEB_WORKERS > 1:
+        # This process only receives webhooks; handlers run in the workers
+        await run_ingress(BOT_TOKEN, WEBHOOK_URL, PORT)
+        return
 
-    # Add error handler
-    app.add_error_handler(error_handler)
+    with startup.phase("application build"):
+        app = build_application(BOT_TOKEN)
 
     logger.info("🚀 Bot is starting...")
     print("🚀 Bot is starting...")
 
+    # Shared connection-pooled HTTP client for all upstream API calls
+    await http_client.init_http_client()
+
+    # Optional blocking-call detector (LOOP_WATCHDOG=true)
+    loop_watchdog = start_watchdog()
+
+    # Checks watched IPOs in the background and notifies users once results are out
+    ipo_watcher = IpoWatcher(app.bot, CHECK_ALLOTMENT_URL)
+
     if USE_WEBHOOK and WEBHOOK_URL:
         # Webhook mode for production (Render)
         logger.info(f"Using webhook mode: {WEBHOOK_URL}")
-        logger.info("✅ Bot is ready to receive updates via webhook")
-        print("✅ Bot is ready to receive updates via webhook")
 
+        # Webhook updates are queued durably and processed from the queue
+        ingress_queue = IngressQueue()
+        consumer = IngressConsumer(ingress_queue, app)
+        consumer_task = None
+        # /healthz fails if update processing died, /readyz if a local dependency is failing
+        health = HealthChecks(
+            ipo_cache, ingress=ingress_queue, alive=lambda: consumer_task is None or not consumer_task.done()
+        )
+        web_server = None
+        lag_monitor = None
         try:
-            # Initialize and start bot
-            await app.initialize()
-            await app.start()
+            # Serve the webhook, /metrics and the health probes on PORT first:
+            # updates that arrive during the rest of startup wait in the ingress queue
+            with startup.phase("web server"):
+                web_server = start_web_server(consumer.sink(), PORT, BOT_TOKEN, health)
+            lag_monitor = asyncio.create_task(metrics.monitor_event_loop())
+
+            async def register_webhook():
+                # Initialize the bot (getMe, saved user state), then register the webhook
+                with startup.phase("application"):
+                    await app.initialize()
+                with startup.phase("webhook"):
+                    await app.bot.set_webhook(
+                        url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
+                        allowed_updates=Update.ALL_TYPES,
+                        # Updates queued while the bot was down are still wanted
+                        drop_pending_updates=False
+                    )
 
-            # Run webhook
-            await app.updater.start_webhook(
-                listen="0.0.0.0",
-                port=PORT,
-                url_path=BOT_TOKEN,
-                webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
+            # Local warm-up runs while the Telegram calls are in flight
+            await asyncio.gather(
+                startup.timed("database", prepare_database()),
+                startup.timed("ipo list", warm_ipo_cache()),
+                register_webhook(),
             )
+            await app.start()
+
+            # Keep the IPO list fresh in the background so users never wait on the scraper
+            ipo_cache.start_prefetcher()
+            ipo_watcher.start()
 
+            # Replays updates left from the last run, then handles new ones
+            consumer_task = asyncio.create_task(consumer.run())
+
+            startup.report()
+            health.mark_ready()
             logger.info("✅ Webhook started successfully")
             print("✅ Webhook started successfully")
 
@@ -1217,16 +792,51 @@ async def run_bot():
             logger.error(f"Error in webhook mode: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
             raise
+        finally:
+            if lag_monitor is not None:
+                lag_monitor.cancel()
+            if web_server is not None:
+                web_server.stop()
+            await consumer.stop()
+            if consumer_task is not None:
+                consumer_task.cancel()
+            await ingress_queue.close()
+            # Writes out the users' conversation state
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            if loop_watchdog is not None:
+                loop_watchdog.stop()
+            await ipo_watcher.stop()
+            await ipo_cache.stop_prefetcher()
+            await http_client.close_http_client()
+            await close_db()
     else:
         # Polling mode for local development
         logger.info("Using polling mode")
         print("Using polling mode")
 
-        # Run polling
-        await app.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True
+        await asyncio.gather(
+            startup.timed("database", prepare_database()),
+            startup.timed("ipo list", warm_ipo_cache()),
         )
+        ipo_cache.start_prefetcher()
+        ipo_watcher.start()
+        startup.report()
+
+        # Run polling
+        try:
+            await app.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=True
+            )
+        finally:
+            if loop_watchdog is not None:
+                loop_watchdog.stop()
+            await ipo_watcher.stop()
+            await ipo_cache.stop_prefetcher()
+            await http_client.close_http_client()
+            await close_db()
 
 
 def main():
@@ -1271,6 +881,7 @@ def main():
             print(f"🔄 Restarting bot in {retry_delay} seconds... (Attempt {retry_count}/{max_retries})")
 
             time.sleep(retry_delay)
+            startup.reset()
 
             # Exponential backoff: increase delay for next retry
             retry_delay = min(retry_delay * 1.5, max_retry_delay)
@@ -0,0 +1,146 @@
+"""Circuit breaker and adaptive timeouts for upstream hosts.
+
+http_client keeps one CircuitBreaker per upstream host (the ipoedge
+scraper):
+
+- after CIRCUIT_FAILURE_THRESHOLD failures in a row (timeouts, connection
+  errors, 5xx responses) the circuit opens and every request fails at once
+  with CircuitOpen, so callers can fall back to cached data instead of
+  waiting for a timeout
+- after CIRCUIT_RESET_TIMEOUT one probe request is let through (half-open);
+  its success closes the circuit, its failure opens it again for twice as
+  long (up to CIRCUIT_MAX_RESET_TIMEOUT)
+- each request's timeout follows the endpoint's recent successful
+  latencies: p99 x CIRCUIT_TIMEOUT_FACTOR, between CIRCUIT_MIN_TIMEOUT and
+  the caller's timeout
+"""
+import logging
+import os
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Failures in a row that open the circuit
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# Seconds the circuit stays open before a probe, and the longest such wait
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 15))
+CIRCUIT_MAX_RESET_TIMEOUT = float(os.getenv("CIRCUIT_MAX_RESET_TIMEOUT", 120))
+# Adaptive timeout: p99 of recent successful latencies times this factor,
+# never below CIRCUIT_MIN_TIMEOUT seconds
+CIRCUIT_TIMEOUT_FACTOR = float(os.getenv("CIRCUIT_TIMEOUT_FACTOR", 3))
+CIRCUIT_MIN_TIMEOUT = float(os.getenv("CIRCUIT_MIN_TIMEOUT", 2))
+
+# Successful requests an endpoint needs before its timeout adapts
+CIRCUIT_MIN_SAMPLES = 20
+# Latencies considered for the adaptive timeout (seconds)
+CIRCUIT_LATENCY_WINDOW = 600
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+circuit_state = metrics.Gauge(
+    "bot_circuit_state", "Upstream circuit state by host (0 closed, 1 half-open, 2 open)", ("host",)
+)
+circuit_rejected_total = metrics.Counter(
+    "bot_circuit_rejected_total", "Upstream requests failed fast by an open circuit, by host", ("host",)
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an upstream host whose circuit is open"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"{host} is unavailable (circuit open, next probe in {retry_in:.0f}s)")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Failure tracking and adaptive timeouts for one upstream host"""
+
+    def __init__(self, host, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT,
+                 max_reset_timeout=CIRCUIT_MAX_RESET_TIMEOUT, timeout_factor=CIRCUIT_TIMEOUT_FACTOR,
+                 min_timeout=CIRCUIT_MIN_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.timeout_factor = timeout_factor
+        self.min_timeout = min_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._open_for = reset_timeout
+        self._open_until = 0.0
+        self._probing = False
+        self._latencies = {}      # endpoint -> LatencyWindow of successful requests
+        circuit_state.set(_STATE_VALUES[CLOSED], host)
+
+    def _set_state(self, state, reason=""):
+        if state != self.state:
+            log = logger.warning if state == OPEN else logger.info
+            log(f"Circuit for {self.host}: {self.state} -> {state}{f' ({reason})' if reason else ''}")
+            self.state = state
+            circuit_state.set(_STATE_VALUES[state], self.host)
+
+    def acquire(self):
+        """Admit one request; returns True if it is the half-open probe.
+
+        Raises CircuitOpen while the circuit is open, and for requests that
+        arrive while the probe is in flight.
+        """
+        if self.state == OPEN:
+            retry_in = self._open_until - time.monotonic()
+            if retry_in > 0:
+                circuit_rejected_total.inc(self.host)
+                raise CircuitOpen(self.host, retry_in)
+            self._set_state(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probing:
+                circuit_rejected_total.inc(self.host)
+                raise CircuitOpen(self.host, 0)
+            self._probing = True
+            return True
+        return False
+
+    def release(self, probe):
+        """The request ended without telling anything about the host (e.g. it was cancelled)"""
+        if probe:
+            self._probing = False
+
+    def record_success(self, endpoint, latency, probe):
+        if probe:
+            self._probing = False
+            self._open_for = self.reset_timeout
+        self._failures = 0
+        self._set_state(CLOSED)
+        window = self._latencies.get(endpoint)
+        if window is None:
+            window = self._latencies[endpoint] = metrics.LatencyWindow(CIRCUIT_LATENCY_WINDOW)
+        window.observe(latency)
+
+    def record_failure(self, probe):
+        self._failures += 1
+        if probe:
+            self._probing = False
+            # Still down: wait longer before the next probe
+            self._open_for = min(self.max_reset_timeout, self._open_for * 2)
+            self._open(f"probe failed, next in {self._open_for:.0f}s")
+        elif self.state == CLOSED and self._failures >= self.failure_threshold:
+            self._open(f"{self._failures} failures in a row, probing in {self._open_for:.0f}s")
+
+    def _open(self, reason):
+        self._open_until = time.monotonic() + self._open_for
+        self._set_state(OPEN, reason)
+
+    def timeout(self, endpoint, ceiling):
+        """Timeout for a request to endpoint; the caller's timeout is the upper bound"""
+        window = self._latencies.get(endpoint)
+        values = window.values() if window is not None else []
+        if len(values) < CIRCUIT_MIN_SAMPLES:
+            return ceiling
+        adapted = metrics.percentile(values, 99) * self.timeout_factor
+        return min(ceiling, max(self.min_timeout, adapted))
@@ -1,5 +1,10 @@
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
 
 # Use persistent storage path if available (Render Disk), otherwise use local
 DATA_DIR = os.getenv("DATA_DIR", ".")
@@ -9,79 +14,231 @@ DB_NAME = DB_PATH
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
+# SQLite tuning (optional environment overrides)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 8192))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 64 * 1024 * 1024))
+
+MAX_PANS_PER_USER = 20
+# Number of users whose PAN lists are kept in memory
+PAN_CACHE_SIZE = int(os.getenv("PAN_CACHE_SIZE", 10000))
+
+# Allotment statuses that never change once the registrar has published them
+FINAL_ALLOTMENT_STATUSES = {"allotted", "not allotted", "not alloted", "not apply"}
+# How long (seconds) a non-final or failed allotment result is reused
+ALLOTMENT_RETRY_TTL = int(os.getenv("ALLOTMENT_RETRY_TTL", 120))
+
+# Schema migrations, applied in order by init_db(). PRAGMA user_version
+# records how many have already run on this database file.
+MIGRATIONS = [
+    # 1: covering index for get_all_pans - filters by user, is already sorted
+    #    by created_at and holds every selected column (no table lookups)
+    """
+    CREATE INDEX IF NOT EXISTS idx_pan_numbers_user_created
+    ON pan_numbers (user_id, created_at, id, name, pan)
+    """,
+    # 2: IPOs a user asked to be notified about once allotment results are out
+    """
+    CREATE TABLE IF NOT EXISTS ipo_watches (
+        user_id INTEGER NOT NULL,
+        ipoid TEXT NOT NULL,
+        ipo_name TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (user_id, ipoid)
+    )
+    """,
+]
+
+# One long-lived connection (and cursor) shared by all calls; the lock keeps
+# statements from different threads from interleaving
+_conn = None
+_cursor = None
+_lock = threading.RLock()
+
+class PanListCache:
+    """Size-bounded LRU cache of each user's PAN list.
+
+    Filled by get_all_pans/get_pan_count and invalidated by every write, so
+    reads never return stale data. Callers must hold _lock.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, user_id):
+        pans = self._data.get(user_id)
+        if pans is None:
+            self.misses += 1
+            metrics.cache_requests_total.inc("pan_list", "miss")
+            return None
+        self.hits += 1
+        metrics.cache_requests_total.inc("pan_list", "hit")
+        self._data.move_to_end(user_id)
+        return pans
+
+    def put(self, user_id, pans):
+        self._data[user_id] = pans
+        self._data.move_to_end(user_id)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._data.pop(user_id, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+pan_cache = PanListCache(PAN_CACHE_SIZE)
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+def get_cursor():
+    """Get the shared cursor, opening the connection on first use (hold _lock)"""
+    global _conn, _cursor
+    if _conn is None:
+        _conn = _connect()
+        _cursor = _conn.cursor()
+    return _cursor
+
+def close_db():
+    """Close the shared connection (it is reopened on next use)"""
+    global _conn, _cursor
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+            _cursor = None
+
+def ping():
+    """Round trip through the shared connection (used by the readiness check)"""
+    with _lock:
+        get_cursor().execute("SELECT 1").fetchone()
+
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # Create new table for multiple PANs with unique constraint
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS pan_numbers (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            pan TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, pan)
-        )
-    """)
-    conn.commit()
-    conn.close()
+    with _lock:
+        c = get_cursor()
+        # Create new table for multiple PANs with unique constraint
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS pan_numbers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                pan TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(user_id, pan)
+            )
+        """)
+        # Cache of allotment results per (IPO, PAN)
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS allotment_results (
+                ipoid TEXT NOT NULL,
+                pan TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                status TEXT,
+                shares_allotted TEXT,
+                is_final INTEGER NOT NULL DEFAULT 0,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (ipoid, pan)
+            )
+        """)
+        c.connection.commit()
+        _migrate(c)
+
+def _migrate(c):
+    """Apply pending schema migrations, each in its own transaction"""
+    version = c.execute("PRAGMA user_version").fetchone()[0]
+    for number, statement in enumerate(MIGRATIONS[version:], version + 1):
+        c.execute("BEGIN")
+        try:
+            c.execute(statement)
+            c.execute(f"PRAGMA user_version = {number}")
+            c.connection.commit()
+        except Exception:
+            c.connection.rollback()
+            raise
+
+def get_schema_version():
+    """Get the number of schema migrations applied to the database"""
+    with _lock:
+        return get_cursor().execute("PRAGMA user_version").fetchone()[0]
 
 def add_pan(user_id, name, pan):
     """Add a new PAN number for a user (max 20 PANs per user)"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-
-    # Check if user already has 20 PANs
-    c.execute("SELECT COUNT(*) FROM pan_numbers WHERE user_id = ?", (user_id,))
-    count = c.fetchone()[0]
+    with _lock:
+        c = get_cursor()
+        try:
+            # Single statement: the count condition enforces the limit and
+            # UNIQUE(user_id, pan) rejects duplicates
+            c.execute(
+                "INSERT INTO pan_numbers (user_id, name, pan) "
+                "SELECT ?, ?, ? WHERE (SELECT COUNT(*) FROM pan_numbers WHERE user_id = ?) < ?",
+                (user_id, name, pan, user_id, MAX_PANS_PER_USER)
+            )
+            inserted = c.rowcount
+            c.connection.commit()
+            pan_cache.invalidate(user_id)
+        except sqlite3.IntegrityError:
+            c.connection.rollback()
+            raise Exception("This PAN number is already added")
 
-    if count >= 20:
-        conn.close()
+    if inserted == 0:
         raise Exception("Maximum 20 PAN numbers allowed per user")
 
-    # Check if this PAN already exists for this user
-    c.execute("SELECT COUNT(*) FROM pan_numbers WHERE user_id = ? AND pan = ?", (user_id, pan))
-    exists = c.fetchone()[0]
-
-    if exists > 0:
-        conn.close()
-        raise Exception("This PAN number is already added")
-
-    # Insert the new PAN
-    try:
-        c.execute("INSERT INTO pan_numbers (user_id, name, pan) VALUES (?, ?, ?)", (user_id, name, pan))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise Exception("This PAN number is already added")
-    finally:
-        conn.close()
+def _load_pans(user_id):
+    pans = pan_cache.get(user_id)
+    if pans is None:
+        c = get_cursor()
+        c.execute("SELECT id, name, pan FROM pan_numbers WHERE user_id = ? ORDER BY created_at", (user_id,))
+        pans = tuple({"id": r[0], "name": r[1], "pan": r[2]} for r in c.fetchall())
+        pan_cache.put(user_id, pans)
+    return pans
 
 def get_all_pans(user_id):
     """Get all PAN numbers for a user"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT id, name, pan FROM pan_numbers WHERE user_id = ? ORDER BY created_at", (user_id,))
-    results = c.fetchall()
-    conn.close()
-    return [{"id": r[0], "name": r[1], "pan": r[2]} for r in results]
-
-def delete_pan_by_id(pan_id):
-    """Delete a specific PAN by ID"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM pan_numbers WHERE id = ?", (pan_id,))
-    conn.commit()
-    conn.close()
+    with _lock:
+        return list(_load_pans(user_id))
+
+def delete_pan_by_id(pan_id, user_id):
+    """Delete a specific PAN by ID if it belongs to the user (returns True if deleted)"""
+    with _lock:
+        c = get_cursor()
+        c.execute("DELETE FROM pan_numbers WHERE id = ? AND user_id = ?", (pan_id, user_id))
+        deleted = c.rowcount
+        c.connection.commit()
+        pan_cache.invalidate(user_id)
+    return deleted > 0
 
 def get_pan_count(user_id):
     """Get count of PANs for a user"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM pan_numbers WHERE user_id = ?", (user_id,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else 0
+    with _lock:
+        return len(_load_pans(user_id))
+
+def get_pan_cache_stats():
+    """Get hit/miss counters and size of the PAN list cache"""
+    with _lock:
+        return pan_cache.stats()
 
 # Legacy functions for backward compatibility (deprecated)
 def set_pan(user_id, pan):
@@ -95,8 +252,124 @@ def get_pan(user_id):
 
 def delete_pan(user_id):
     """Legacy function - deletes all PANs for user"""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM pan_numbers WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with _lock:
+        c = get_cursor()
+        c.execute("DELETE FROM pan_numbers WHERE user_id = ?", (user_id,))
+        c.connection.commit()
+        pan_cache.invalidate(user_id)
+
+def get_cached_allotments(ipoid, pans, include_expired=False):
+    """Get cached allotment results for PANs of an IPO.
+
+    Returns {pan: response data} in the same shape as the check-allotment API,
+    skipping PANs that are not cached or whose non-final result has expired
+    (unless include_expired, used when the upstream is unavailable).
+    """
+    if not pans:
+        return {}
+    placeholders = ",".join("?" * len(pans))
+    expired_before = 0 if include_expired else time.time() - ALLOTMENT_RETRY_TTL
+    with _lock:
+        c = get_cursor()
+        c.execute(
+            f"SELECT pan, success, status, shares_allotted FROM allotment_results "
+            f"WHERE ipoid = ? AND pan IN ({placeholders}) AND (is_final = 1 OR fetched_at > ?)",
+            (ipoid, *pans, expired_before)
+        )
+        results = c.fetchall()
+
+    cached = {}
+    for pan, success, status, shares_allotted in results:
+        if success:
+            cached[pan] = {
+                "success": True,
+                "dataResult": {"status": status, "shares_allotted": shares_allotted}
+            }
+        else:
+            cached[pan] = {"success": False}
+    return cached
+
+def save_allotments(ipoid, pan_responses):
+    """Store allotment results ({pan: response data}) from the check-allotment API"""
+    if not pan_responses:
+        return
+    fetched_at = time.time()
+    rows = []
+    for pan, pan_response in pan_responses.items():
+        if pan_response and pan_response.get("success"):
+            data_result = pan_response.get("dataResult", {})
+            status = data_result.get("status", "Unknown")
+            shares_allotted = data_result.get("shares_allotted", "0")
+            is_final = status.lower() in FINAL_ALLOTMENT_STATUSES
+            rows.append((ipoid, pan, 1, status, shares_allotted, int(is_final), fetched_at))
+        else:
+            # Transient failure, retried after ALLOTMENT_RETRY_TTL
+            rows.append((ipoid, pan, 0, None, None, 0, fetched_at))
+
+    with _lock:
+        c = get_cursor()
+        # A final result is never overwritten by a later (possibly failed) check
+        c.executemany(
+            "INSERT INTO allotment_results "
+            "(ipoid, pan, success, status, shares_allotted, is_final, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(ipoid, pan) DO UPDATE SET "
+            "success = excluded.success, status = excluded.status, "
+            "shares_allotted = excluded.shares_allotted, is_final = excluded.is_final, "
+            "fetched_at = excluded.fetched_at "
+            "WHERE allotment_results.is_final = 0",
+            rows
+        )
+        c.connection.commit()
+
+def add_watch(user_id, ipoid, ipo_name):
+    """Watch an IPO for a user (returns False if it was already watched)"""
+    with _lock:
+        c = get_cursor()
+        c.execute(
+            "INSERT INTO ipo_watches (user_id, ipoid, ipo_name, created_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id, ipoid) DO NOTHING",
+            (user_id, ipoid, ipo_name, time.time())
+        )
+        added = c.rowcount
+        c.connection.commit()
+    return added > 0
+
+def remove_watch(user_id, ipoid):
+    """Stop watching an IPO for a user (returns True if it was watched)"""
+    with _lock:
+        c = get_cursor()
+        c.execute("DELETE FROM ipo_watches WHERE user_id = ? AND ipoid = ?", (user_id, ipoid))
+        removed = c.rowcount
+        c.connection.commit()
+    return removed > 0
+
+def get_watch_targets():
+    """Get every watched IPO with the watching users' PANs.
+
+    Returns {ipoid: {"name": ipo name, "users": {user_id: [{"name", "pan"}, ...]}}};
+    users without PANs are left out.
+    """
+    with _lock:
+        c = get_cursor()
+        c.execute(
+            "SELECT w.ipoid, w.ipo_name, w.user_id, p.name, p.pan "
+            "FROM ipo_watches w JOIN pan_numbers p ON p.user_id = w.user_id "
+            "ORDER BY w.ipoid, w.user_id, p.created_at"
+        )
+        rows = c.fetchall()
+
+    targets = {}
+    for ipoid, ipo_name, user_id, name, pan in rows:
+        target = targets.setdefault(ipoid, {"name": ipo_name, "users": {}})
+        target["users"].setdefault(user_id, []).append({"name": name, "pan": pan})
+    return targets
+
+def purge_watches(max_age):
+    """Delete watches older than max_age seconds (returns how many)"""
+    with _lock:
+        c = get_cursor()
+        c.execute("DELETE FROM ipo_watches WHERE created_at < ?", (time.time() - max_age,))
+        purged = c.rowcount
+        c.connection.commit()
+    return purged
@@ -0,0 +1,134 @@
+"""Liveness and readiness checks served by web_server.py.
+
+GET /healthz (liveness) answers 200 while the event loop runs and the
+bot's update processing is alive, so the orchestrator restarts an instance
+that hangs or loses its consumer. GET /readyz (readiness) reports each
+dependency and answers 503 while the bot is still starting or one of its
+local dependencies is outside its limit, so traffic can be routed away
+from a broken instance:
+
+- sqlite: round trip of a trivial query through the database thread
+- ingress_queue: round trip through the ingress queue's database thread
+- event_loop: lag measured by metrics.monitor_event_loop
+
+The ipoedge upstream is shared by every instance, so its checks are only
+reported (status "degraded") and never make an instance unready; taking
+all of them out of rotation at once would also stop PAN management and
+the cached-result fallback:
+
+- ipo_list: age of the cached IPO list
+- upstream: p95 latency of ipoedge requests over UPSTREAM_WINDOW_SECONDS
+"""
+import asyncio
+import logging
+import os
+import time
+
+import metrics
+from async_db import ping as ping_db
+
+logger = logging.getLogger(__name__)
+
+# Limits: IPO list age (seconds), upstream p95, SQLite round trip and
+# event-loop lag (milliseconds); the first two are only reported
+READY_MAX_IPO_LIST_AGE = float(os.getenv("READY_MAX_IPO_LIST_AGE", 3600))
+READY_MAX_UPSTREAM_P95_MS = float(os.getenv("READY_MAX_UPSTREAM_P95_MS", 5000))
+READY_MAX_SQLITE_MS = float(os.getenv("READY_MAX_SQLITE_MS", 250))
+READY_MAX_LOOP_LAG_MS = float(os.getenv("READY_MAX_LOOP_LAG_MS", 500))
+
+# A probe that takes longer than this fails (seconds)
+READY_PROBE_TIMEOUT = 2.0
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class HealthChecks:
+    """State and probes behind /healthz and /readyz.
+
+    ipo_cache, database and ingress (an IngressQueue) select the checks
+    that apply to this process; alive() is an optional liveness condition
+    (e.g. the consumer task is running).
+    """
+
+    def __init__(self, ipo_cache=None, database=True, ingress=None, alive=None):
+        self.ipo_cache = ipo_cache
+        self.database = database
+        self.ingress = ingress
+        self.alive = alive
+        self.started_at = time.monotonic()
+        self.ready = False
+
+    def mark_ready(self):
+        """Startup has finished; readiness now depends on the checks only"""
+        self.ready = True
+
+    def liveness(self):
+        """(alive, report)"""
+        alive = self.alive is None or self.alive()
+        return alive, {
+            "status": "ok" if alive else "dead",
+            "uptime_seconds": round(time.monotonic() - self.started_at, 1),
+        }
+
+    async def readiness(self):
+        """(ready, report)"""
+        checks = {}
+        if self.database:
+            checks["sqlite"] = await self._check_sqlite("sqlite", ping_db)
+        if self.ingress is not None:
+            checks["ingress_queue"] = await self._check_sqlite("ingress_queue", self.ingress.ping)
+        checks["event_loop"] = self._check_event_loop()
+        ready = self.ready and all(check["ok"] for check in checks.values())
+
+        shared = {"upstream": self._check_upstream()}
+        if self.ipo_cache is not None:
+            shared["ipo_list"] = self._check_ipo_list()
+        checks.update(shared)
+
+        if not self.ready:
+            status = "starting"
+        elif not ready:
+            status = "unavailable"
+        else:
+            status = "ready" if all(check["ok"] for check in shared.values()) else "degraded"
+        return ready, {"status": status, "checks": checks}
+
+    def _check_ipo_list(self):
+        age = self.ipo_cache.age()
+        if age is None:
+            # Without a prefetcher the list is only fetched when a user asks for it
+            ok = not self.ipo_cache.prefetching
+        else:
+            ok = age <= READY_MAX_IPO_LIST_AGE
+        return {
+            "ok": ok,
+            "age_seconds": None if age is None else round(age, 1),
+            "limit_seconds": READY_MAX_IPO_LIST_AGE,
+        }
+
+    def _check_upstream(self):
+        values = metrics.upstream_latency_window.values()
+        p95 = metrics.percentile(values, 95)
+        return {
+            # No recent requests: nothing suggests the upstream is slow
+            "ok": p95 is None or p95 * 1000 <= READY_MAX_UPSTREAM_P95_MS,
+            "p95_ms": _ms(p95),
+            "samples": len(values),
+            "limit_ms": READY_MAX_UPSTREAM_P95_MS,
+        }
+
+    async def _check_sqlite(self, name, ping):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(ping(), READY_PROBE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Readiness probe {name} failed: {e!r}")
+            return {"ok": False, "rtt_ms": None, "limit_ms": READY_MAX_SQLITE_MS, "error": type(e).__name__}
+        rtt = time.perf_counter() - start
+        return {"ok": rtt * 1000 <= READY_MAX_SQLITE_MS, "rtt_ms": _ms(rtt), "limit_ms": READY_MAX_SQLITE_MS}
+
+    def _check_event_loop(self):
+        lag = metrics.loop_lag_seconds.value()
+        return {"ok": lag * 1000 <= READY_MAX_LOOP_LAG_MS, "lag_ms": _ms(lag), "limit_ms": READY_MAX_LOOP_LAG_MS}
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+import metrics
+from circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Connection pool settings (can be tuned per deployment via environment variables)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30))
+# Maximum number of in-flight requests to a single upstream host
+HTTP_MAX_PER_HOST = int(os.getenv("HTTP_MAX_PER_HOST", 20))
+# Retries of idempotent requests after a timeout, connection error or 5xx
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 2))
+
+# Retry backoff: full jitter over base * 2^(retry - 1), capped (seconds)
+HTTP_RETRY_BASE_DELAY = 0.2
+HTTP_RETRY_MAX_DELAY = 2.0
+
+_client = None
+_host_semaphores = {}
+# Circuit breakers outlive the client so a restart doesn't forget a down upstream
+_breakers = {}
+
+
+def _build_client():
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(30.0))
+
+
+async def init_http_client():
+    """Create the shared HTTP client (call once from run_bot)"""
+    global _client
+    if _client is None:
+        _client = _build_client()
+        logger.info(
+            f"HTTP client started (max_connections={HTTP_MAX_CONNECTIONS}, "
+            f"max_per_host={HTTP_MAX_PER_HOST})"
+        )
+    return _client
+
+
+async def close_http_client():
+    """Close the shared HTTP client and release pooled connections"""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _host_semaphores.clear()
+        logger.info("HTTP client closed")
+
+
+def _get_client():
+    # Fall back to a lazily created client so handlers also work when they
+    # are driven without run_bot() (e.g. from scripts)
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+def _host_semaphore(url):
+    host = urlsplit(url).netloc
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(HTTP_MAX_PER_HOST)
+        _host_semaphores[host] = semaphore
+    return semaphore
+
+
+def _breaker(url):
+    host = urlsplit(url).netloc
+    breaker = _breakers.get(host)
+    if breaker is None:
+        breaker = _breakers[host] = CircuitBreaker(host)
+    return breaker
+
+
+def _endpoint(url):
+    # Metrics label: last path segment, e.g. "allotedipo-list"
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1] or "/"
+
+
+async def _attempt(method, url, endpoint, breaker, timeout, deadline, **kwargs):
+    # Raises CircuitOpen at once while the upstream is known to be down
+    probe = breaker.acquire()
+    if not probe:
+        # The probe gets the full timeout: a slower but working upstream must still close the circuit
+        timeout = breaker.timeout(endpoint, timeout)
+    start = time.perf_counter()
+    try:
+        async with _host_semaphore(url):
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    # Queued behind other requests until the caller's deadline: not the upstream's fault
+                    raise httpx.PoolTimeout(f"Deadline passed before {method} {url} was sent")
+            sent = time.perf_counter()
+            # httpx applies its timeout to each connect/read separately; this bounds the whole
+            # request, so it times out (and counts as a failure) instead of being cancelled
+            response = await asyncio.wait_for(
+                _get_client().request(method, url, timeout=timeout, **kwargs), timeout
+            )
+    except httpx.PoolTimeout:
+        metrics.upstream_errors_total.inc(endpoint, "timeout")
+        breaker.release(probe)
+        raise
+    except (httpx.TimeoutException, asyncio.TimeoutError) as e:
+        metrics.upstream_errors_total.inc(endpoint, "timeout")
+        breaker.record_failure(probe)
+        if isinstance(e, httpx.TimeoutException):
+            raise
+        raise httpx.ReadTimeout(f"{method} {url} took longer than {timeout:.1f}s") from e
+    except asyncio.CancelledError:
+        # The caller gave up (e.g. shutdown); says nothing about the upstream
+        metrics.upstream_errors_total.inc(endpoint, "cancelled")
+        breaker.release(probe)
+        raise
+    except Exception:
+        metrics.upstream_errors_total.inc(endpoint, "error")
+        breaker.record_failure(probe)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.upstream_seconds.observe(elapsed, endpoint)
+        metrics.upstream_latency_window.observe(elapsed)
+
+    metrics.upstream_responses_total.inc(endpoint, response.status_code)
+    if response.status_code >= 500:
+        breaker.record_failure(probe)
+    else:
+        # Time on the wire only, so the adaptive timeout ignores queueing for the semaphore
+        breaker.record_success(endpoint, time.perf_counter() - sent, probe)
+    return response
+
+
+async def _request(method, url, timeout, idempotent, total_timeout=None, **kwargs):
+    endpoint = _endpoint(url)
+    breaker = _breaker(url)
+    deadline = None if total_timeout is None else time.monotonic() + total_timeout
+    attempts = 1 + (HTTP_MAX_RETRIES if idempotent else 0)
+    for attempt in range(1, attempts + 1):
+        try:
+            response, error = await _attempt(method, url, endpoint, breaker, timeout, deadline, **kwargs), None
+        except httpx.TransportError as e:
+            # Timeouts and connection errors; CircuitOpen is never retried
+            response, error = None, e
+        if response is not None and response.status_code < 500:
+            return response
+        delay = random.uniform(0, min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+        # Give up after the last attempt, or when a retry couldn't start before the deadline
+        if attempt == attempts or (deadline is not None and time.monotonic() + delay >= deadline):
+            if error is not None:
+                raise error
+            return response
+        metrics.upstream_retries_total.inc(endpoint)
+        await asyncio.sleep(delay)
+
+
+async def get(url, timeout=10, total_timeout=None, **kwargs):
+    """Send a GET request through the shared client (retried on failure).
+
+    timeout bounds each attempt, total_timeout (if given) all attempts together.
+    """
+    return await _request("GET", url, timeout, True, total_timeout, **kwargs)
+
+
+async def post(url, json=None, timeout=30, idempotent=False, total_timeout=None, **kwargs):
+    """Send a POST request through the shared client.
+
+    Only retried on failure when the caller marks it idempotent; timeout
+    bounds each attempt, total_timeout (if given) all attempts together.
+    """
+    return await _request("POST", url, timeout, idempotent, total_timeout, json=json, **kwargs)
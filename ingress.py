@@ -0,0 +1,327 @@
+"""Durable ingress queue for webhook updates.
+
+The webhook handler only appends the raw update to a SQLite queue
+(DATA_DIR/ingress.db) and answers Telegram, so the webhook responds in
+about a millisecond however slow the upstream is. IngressConsumer takes
+the queued updates in order and runs them through
+Application.process_update, concurrently across users but one at a time
+per user, and deletes each update once it has been handled. Updates still
+queued when the bot stops or crashes are replayed on the next start.
+Handler errors go to the bot's error handler and are not retried; only
+an update that could not be decoded, or that was being handled every
+time the process died, is dropped.
+"""
+import asyncio
+import collections
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from telegram import Update
+
+import metrics
+from database import DATA_DIR, SQLITE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+INGRESS_DB_PATH = os.getenv("INGRESS_DB_PATH", os.path.join(DATA_DIR, "ingress.db"))
+# Users whose updates are processed at the same time (per process)
+INGRESS_CONCURRENCY = int(os.getenv("INGRESS_CONCURRENCY", 64))
+# Times an update may be started (it is replayed when the process died while
+# handling it) before it is dropped as the likely cause of the crash
+INGRESS_MAX_ATTEMPTS = int(os.getenv("INGRESS_MAX_ATTEMPTS", 3))
+# Queued updates older than this are dropped on startup instead of replayed (seconds)
+INGRESS_REPLAY_MAX_AGE = float(os.getenv("INGRESS_REPLAY_MAX_AGE", 3600))
+# How often an idle consumer looks for updates appended by another process (seconds)
+INGRESS_POLL_INTERVAL = float(os.getenv("INGRESS_POLL_INTERVAL_MS", 20)) / 1000
+
+# Updates read from the queue at once / held in memory by one consumer
+INGRESS_FETCH_SIZE = 256
+INGRESS_MAX_BUFFERED = 1024
+
+ingress_wait_seconds = metrics.Histogram(
+    "bot_ingress_wait_seconds", "Time from webhook receipt to the start of processing"
+)
+ingress_failures_total = metrics.Counter(
+    "bot_ingress_failures_total", "Queued updates dropped, by reason (undecodable, crashed)", ("reason",)
+)
+ingress_replayed_total = metrics.Counter(
+    "bot_ingress_replayed_total", "Updates found in the queue at startup and processed again"
+)
+
+
+def update_user_id(data):
+    """User id of a raw update (the sender of whatever it carries); 0 if it has none"""
+    for key, value in data.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return 0
+
+
+def partition(user_id, count):
+    """Index of the worker that handles a user"""
+    return user_id % count
+
+
+class QueuedUpdate(NamedTuple):
+    seq: int
+    user_id: int
+    data: str
+    received_at: float
+    attempts: int     # times its processing was started before
+
+
+class IngressQueue:
+    """Append-only SQLite queue of raw updates, shared by all processes"""
+
+    def __init__(self, path=INGRESS_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingress")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingress (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    update_id INTEGER UNIQUE,
+                    user_id INTEGER NOT NULL,
+                    data TEXT NOT NULL,
+                    received_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _partition_filter(index, count):
+        # Same result as partition() for negative ids (channel chats) too
+        return "AND ((user_id % ?) + ?) % ? = ?", (count, count, count, index)
+
+    def _append(self, update_id, user_id, data):
+        conn = self._connection()
+        # Telegram may deliver an update twice; the update_id keeps one copy
+        conn.execute(
+            "INSERT OR IGNORE INTO ingress (update_id, user_id, data, received_at) VALUES (?, ?, ?, ?)",
+            (update_id, user_id, data, time.time())
+        )
+        conn.commit()
+
+    def _fetch(self, after_seq, limit, index, count):
+        conn = self._connection()
+        condition, params = self._partition_filter(index, count)
+        rows = conn.execute(
+            f"SELECT seq, user_id, data, received_at, attempts FROM ingress "
+            f"WHERE seq > ? {condition} ORDER BY seq LIMIT ?",
+            (after_seq, *params, limit)
+        ).fetchall()
+        return [QueuedUpdate(*row) for row in rows]
+
+    def _mark_started(self, seq):
+        conn = self._connection()
+        conn.execute("UPDATE ingress SET attempts = attempts + 1 WHERE seq = ?", (seq,))
+        conn.commit()
+
+    def _ack(self, seq):
+        conn = self._connection()
+        conn.execute("DELETE FROM ingress WHERE seq = ?", (seq,))
+        conn.commit()
+
+    def _purge(self, max_age, index, count):
+        conn = self._connection()
+        condition, params = self._partition_filter(index, count)
+        purged = conn.execute(
+            f"DELETE FROM ingress WHERE received_at < ? {condition}", (time.time() - max_age, *params)
+        ).rowcount
+        conn.commit()
+        return purged
+
+    def _depth(self, index, count):
+        condition, params = self._partition_filter(index, count)
+        return self._connection().execute(f"SELECT COUNT(*) FROM ingress WHERE 1 {condition}", params).fetchone()[0]
+
+    def _ping(self):
+        self._connection().execute("SELECT 1").fetchone()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def append(self, data):
+        """Durably queue a raw update (decoded webhook JSON)"""
+        await self._run(self._append, data.get("update_id"), update_user_id(data), json.dumps(data))
+
+    async def fetch(self, after_seq, limit=INGRESS_FETCH_SIZE, index=0, count=1):
+        """Queued updates of one partition after after_seq, oldest first"""
+        return await self._run(self._fetch, after_seq, limit, index, count)
+
+    async def mark_started(self, seq):
+        """Count a try of an update before it is processed, so one that crashes
+        the process is not replayed forever"""
+        await self._run(self._mark_started, seq)
+
+    async def ack(self, seq):
+        """Remove a handled update"""
+        await self._run(self._ack, seq)
+
+    async def purge(self, max_age, index=0, count=1):
+        """Drop updates of one partition received more than max_age seconds ago"""
+        return await self._run(self._purge, max_age, index, count)
+
+    async def depth(self, index=0, count=1):
+        return await self._run(self._depth, index, count)
+
+    async def ping(self):
+        """Round trip through the queue's database thread (used by the readiness check)"""
+        await self._run(self._ping)
+
+    async def close(self):
+        await self._run(self._close)
+
+
+class IngressConsumer:
+    """Processes one partition of the ingress queue with an Application.
+
+    Each user with queued updates gets a lane that handles them in order;
+    at most `concurrency` lanes run handlers at the same time.
+    """
+
+    def __init__(self, queue, application, index=0, count=1, concurrency=INGRESS_CONCURRENCY,
+                 max_attempts=INGRESS_MAX_ATTEMPTS):
+        self.queue = queue
+        self.application = application
+        self.index = index
+        self.count = count
+        self.max_attempts = max_attempts
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._lanes = {}          # user_id -> deque of QueuedUpdate
+        self._tasks = set()
+        self._buffered = 0
+        self._last_seq = 0
+        self._wakeup = asyncio.Event()
+        self._room = asyncio.Event()
+        self._stopping = False
+
+    def notify(self):
+        """Wake the consumer after an append in this process"""
+        self._wakeup.set()
+
+    def sink(self):
+        """Webhook sink: queue the update durably, then wake the consumer"""
+        async def append(data):
+            await self.queue.append(data)
+            self.notify()
+        return append
+
+    async def run(self, should_stop=None):
+        """Replay what is left from the last run, then process new updates until stopped"""
+        purged = await self.queue.purge(INGRESS_REPLAY_MAX_AGE, self.index, self.count)
+        if purged:
+            logger.warning(f"Dropped {purged} queued update(s) older than {INGRESS_REPLAY_MAX_AGE:.0f}s")
+        replay = await self.queue.depth(self.index, self.count)
+        if replay:
+            ingress_replayed_total.inc(amount=replay)
+            logger.info(f"Replaying {replay} queued update(s)")
+
+        while not self._stopping and (should_stop is None or not should_stop()):
+            if self._buffered >= INGRESS_MAX_BUFFERED:
+                self._room.clear()
+                await self._room.wait()
+                continue
+
+            rows = await self.queue.fetch(self._last_seq, INGRESS_FETCH_SIZE, self.index, self.count)
+            if rows:
+                self._last_seq = rows[-1].seq
+                for row in rows:
+                    self._enqueue(row)
+                continue
+
+            self._wakeup.clear()
+            # A single process is woken by notify(); workers poll for the web process's appends
+            poll_interval = INGRESS_POLL_INTERVAL if self.count > 1 else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self, timeout=10):
+        """Stop fetching and give the running lanes time to finish"""
+        self._stopping = True
+        self._wakeup.set()
+        self._room.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                # Not acknowledged, so replayed on the next start
+                task.cancel()
+
+    def _enqueue(self, row):
+        self._buffered += 1
+        lane = self._lanes.get(row.user_id)
+        if lane is not None:
+            lane.append(row)
+            return
+        lane = self._lanes[row.user_id] = collections.deque([row])
+        task = asyncio.create_task(self._run_lane(row.user_id, lane))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_lane(self, user_id, lane):
+        try:
+            while lane and not self._stopping:
+                async with self._semaphore:
+                    if self._stopping:
+                        # Not started, so replayed on the next start without using up a try
+                        break
+                    await self._process(lane[0])
+                lane.popleft()
+                self._buffered -= 1
+                self._room.set()
+        finally:
+            self._lanes.pop(user_id, None)
+
+    async def _process(self, row):
+        if row.attempts >= self.max_attempts:
+            ingress_failures_total.inc("crashed")
+            logger.error("Dropping update seq=%s: the process stopped during all %s tries", row.seq, row.attempts)
+            await self.queue.ack(row.seq)
+            return
+
+        await self.queue.mark_started(row.seq)
+        ingress_wait_seconds.observe(time.time() - row.received_at)
+        try:
+            update = Update.de_json(json.loads(row.data), self.application.bot)
+        except Exception as e:
+            # Would fail the same way again, so it is not retried
+            ingress_failures_total.inc("undecodable")
+            logger.error("Dropping undecodable update seq=%s: %r", row.seq, e)
+        else:
+            if update:
+                try:
+                    # Handler errors are reported to the error handler by PTB and not retried:
+                    # the handler may already have messaged the user
+                    await self.application.process_update(update)
+                except Exception as e:
+                    # The application itself failed (e.g. it is shutting down); not acknowledged,
+                    # so replayed on the next start
+                    logger.error("Could not process update seq=%s, keeping it queued: %r", row.seq, e)
+                    return
+        await self.queue.ack(row.seq)
@@ -0,0 +1,235 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import time
+
+import http_client
+import metrics
+from circuit_breaker import CircuitOpen
+from database import DATA_DIR
+from ipo_catalog import IpoCatalog
+
+logger = logging.getLogger(__name__)
+
+# How long a fetched IPO list is served without touching the upstream (seconds)
+IPO_CACHE_TTL = float(os.getenv("IPO_CACHE_TTL", 300))
+# How long an expired list may still be served while a background refresh runs
+IPO_CACHE_MAX_STALE = float(os.getenv("IPO_CACHE_MAX_STALE", 3600))
+# Minimum gap between two forced refreshes ("🔄 Refresh IPO List")
+IPO_REFRESH_MIN_INTERVAL = float(os.getenv("IPO_REFRESH_MIN_INTERVAL", 30))
+
+# Background prefetch: refresh period (seconds, 0 disables), +/- jitter as a
+# fraction of the period, and the longest retry delay after failed refreshes
+IPO_PREFETCH_INTERVAL = float(os.getenv("IPO_PREFETCH_INTERVAL", 120))
+IPO_PREFETCH_JITTER = float(os.getenv("IPO_PREFETCH_JITTER", 0.1))
+IPO_PREFETCH_MAX_BACKOFF = float(os.getenv("IPO_PREFETCH_MAX_BACKOFF", 600))
+# First retry delay after a failed prefetch; doubles per consecutive failure
+IPO_PREFETCH_RETRY_DELAY = 5.0
+
+# Last good IPO list, loaded at startup so the list is served before the first fetch
+IPO_SNAPSHOT_PATH = os.getenv("IPO_SNAPSHOT_PATH", os.path.join(DATA_DIR, "ipo_catalog.json"))
+
+prefetch_total = metrics.Counter(
+    "bot_ipo_prefetch_total", "Background IPO list refreshes, by outcome", ("outcome",)
+)
+
+
+class IpoListUnavailable(Exception):
+    """Raised when the IPO list cannot be fetched and no usable copy is cached"""
+
+
+class IpoCache:
+    """In-process cache of the allotted-IPO list as an IpoCatalog.
+
+    Concurrent misses share a single upstream request (single-flight), and an
+    expired list is served while it is refreshed in the background. While
+    the prefetcher runs, any cached list is served as-is and users never
+    wait on the upstream; every good list is saved to snapshot_path.
+    """
+
+    def __init__(self, url, per_page, ttl=IPO_CACHE_TTL, max_stale=IPO_CACHE_MAX_STALE,
+                 refresh_min_interval=IPO_REFRESH_MIN_INTERVAL, snapshot_path=None):
+        self.url = url
+        self.per_page = per_page
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.refresh_min_interval = refresh_min_interval
+        self.snapshot_path = snapshot_path
+        self._catalog = None
+        self._fetched_at = 0.0
+        self._last_forced_at = 0.0
+        self._refresh_task = None
+        self._prefetch_task = None
+
+    def age(self):
+        """Seconds since the cached list was fetched (None if nothing cached)"""
+        if self._catalog is None:
+            return None
+        return time.monotonic() - self._fetched_at
+
+    def peek(self):
+        """Return the cached catalog without fetching (None if nothing cached)"""
+        return self._catalog
+
+    async def get(self, force=False):
+        """Return the IPO catalog, fetching it from the upstream only when needed"""
+        age = self.age()
+
+        if force:
+            now = time.monotonic()
+            if age is not None and now - self._last_forced_at < self.refresh_min_interval:
+                logger.info("Forced IPO list refresh rate-limited, serving cached list")
+                metrics.cache_requests_total.inc("ipo_list", "hit")
+                return self._catalog
+            self._last_forced_at = now
+            metrics.cache_requests_total.inc("ipo_list", "refresh")
+            return await self._refresh_or_cached()
+
+        if age is not None:
+            if age < self.ttl or self.prefetching:
+                metrics.cache_requests_total.inc("ipo_list", "hit")
+                return self._catalog
+            if age < self.max_stale:
+                # Stale but still usable: answer now and refresh behind the scenes
+                metrics.cache_requests_total.inc("ipo_list", "stale")
+                self._start_refresh()
+                return self._catalog
+
+        metrics.cache_requests_total.inc("ipo_list", "miss")
+        return await self._refresh_or_cached()
+
+    async def _refresh_or_cached(self):
+        try:
+            return await self._refresh()
+        except Exception as e:
+            if self._catalog is None:
+                if isinstance(e, CircuitOpen):
+                    raise IpoListUnavailable(str(e)) from e
+                raise
+            # A timeout, error status or open circuit: any list beats an error
+            logger.info("IPO list refresh failed (%r), serving cached list", e)
+            metrics.cache_requests_total.inc("ipo_list", "stale")
+            return self._catalog
+
+    async def _refresh(self):
+        return await asyncio.shield(self._start_refresh())
+
+    def _start_refresh(self):
+        task = self._refresh_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.create_task(self._fetch())
+            task.add_done_callback(self._on_refresh_done)
+            self._refresh_task = task
+        return task
+
+    def _on_refresh_done(self, task):
+        # Failures are logged by the prefetcher itself while it runs, and an
+        # open circuit is logged once by the breaker
+        if task.cancelled() or self.prefetching:
+            return
+        error = task.exception()
+        if error is not None and not isinstance(error, CircuitOpen):
+            logger.error(f"Error refreshing IPO list: {error!r}")
+
+    async def _fetch(self):
+        res = await http_client.get(self.url, timeout=10)
+        if res.status_code != 200:
+            raise IpoListUnavailable(f"IPO list request failed with status {res.status_code}")
+
+        ipos = res.json().get("data", [])
+        catalog = IpoCatalog(ipos, self.per_page)
+        self._catalog = catalog
+        self._fetched_at = time.monotonic()
+        logger.info(f"IPO list refreshed ({len(catalog)} IPOs)")
+
+        if self.snapshot_path:
+            try:
+                await asyncio.to_thread(self._save_snapshot, ipos)
+            except Exception as e:
+                logger.warning(f"Could not save IPO list snapshot: {e}")
+        return catalog
+
+    # ---- Snapshot ----
+
+    def _save_snapshot(self, ipos):
+        # Runs in a worker thread; written to a temp file first so a crash
+        # never leaves a truncated snapshot behind. The temp file is per
+        # process: worker processes save the same snapshot concurrently
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"saved_at": time.time(), "data": ipos}, f)
+            os.replace(tmp_path, self.snapshot_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+    def load_snapshot(self):
+        """Serve the last saved IPO list until the first refresh (True if one was loaded)"""
+        if not self.snapshot_path or self._catalog is not None:
+            return False
+        try:
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            catalog = IpoCatalog(snapshot["data"], self.per_page)
+            saved_age = max(0.0, time.time() - snapshot["saved_at"])
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable IPO list snapshot {self.snapshot_path}: {e}")
+            return False
+
+        self._catalog = catalog
+        self._fetched_at = time.monotonic() - saved_age
+        logger.info(f"Loaded IPO list snapshot ({len(catalog)} IPOs, {saved_age:.0f}s old)")
+        return True
+
+    # ---- Background prefetch ----
+
+    @property
+    def prefetching(self):
+        return self._prefetch_task is not None and not self._prefetch_task.done()
+
+    def start_prefetcher(self, interval=IPO_PREFETCH_INTERVAL, jitter=IPO_PREFETCH_JITTER,
+                         max_backoff=IPO_PREFETCH_MAX_BACKOFF):
+        """Start refreshing the list in the background (returns the task, None if disabled)"""
+        if interval <= 0:
+            return None
+        self.load_snapshot()
+        self._prefetch_task = asyncio.create_task(self._prefetch_forever(interval, jitter, max_backoff))
+        logger.info(f"IPO list prefetcher started (every {interval:.0f}s)")
+        return self._prefetch_task
+
+    async def stop_prefetcher(self):
+        task, self._prefetch_task = self._prefetch_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _prefetch_forever(self, interval, jitter, max_backoff):
+        # A fresh enough snapshot postpones the first fetch
+        age = self.age()
+        delay = 0.0 if age is None else max(0.0, interval - age)
+        failures = 0
+
+        while True:
+            if delay:
+                await asyncio.sleep(delay * random.uniform(1 - jitter, 1 + jitter))
+            try:
+                await self._refresh()
+            except Exception as e:
+                failures += 1
+                prefetch_total.inc("error")
+                delay = min(max_backoff, IPO_PREFETCH_RETRY_DELAY * 2 ** (failures - 1))
+                logger.warning(f"IPO list prefetch failed ({failures} in a row), retrying in {delay:.0f}s: {e!r}")
+            else:
+                failures = 0
+                prefetch_total.inc("ok")
+                delay = interval
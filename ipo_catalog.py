@@ -0,0 +1,70 @@
+from typing import NamedTuple
+
+# Longest IPO name shown on a keyboard button before it is truncated
+IPO_LABEL_MAX_LENGTH = 35
+
+
+class IpoEntry(NamedTuple):
+    ipoid: str
+    name: str
+    label: str
+    raw: dict
+
+
+def make_label(ipo_name):
+    """Button label for an IPO name (long names are truncated)"""
+    if len(ipo_name) > IPO_LABEL_MAX_LENGTH:
+        return ipo_name[:IPO_LABEL_MAX_LENGTH] + "..."
+    return ipo_name
+
+
+class IpoCatalog:
+    """Read-only, indexed view of one fetched IPO list.
+
+    Built once per refresh and shared by every user: display labels, the
+    ipoid and label indexes and the pages are all precomputed here.
+    """
+
+    def __init__(self, ipos, per_page):
+        entries = []
+        by_id = {}
+        by_label = {}
+
+        for ipo in ipos:
+            name = ipo.get('iponame', 'N/A')
+            label = make_label(name)
+
+            # Names that truncate to the same label get a numeric suffix so
+            # every button still maps to exactly one IPO
+            if label in by_label:
+                suffix = 2
+                while f"{label} ({suffix})" in by_label:
+                    suffix += 1
+                label = f"{label} ({suffix})"
+
+            entry = IpoEntry(ipo.get('ipoid', ''), name, label, ipo)
+            entries.append(entry)
+            by_label[label] = entry
+            by_id.setdefault(entry.ipoid, entry)
+
+        self.per_page = per_page
+        self.entries = tuple(entries)
+        self.by_id = by_id
+        self.by_label = by_label
+        self.pages = tuple(
+            self.entries[start:start + per_page]
+            for start in range(0, len(self.entries), per_page)
+        )
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def total_pages(self):
+        return len(self.pages)
+
+    def page(self, page):
+        """IPO entries on a page (empty tuple if the page does not exist)"""
+        if 0 <= page < len(self.pages):
+            return self.pages[page]
+        return ()
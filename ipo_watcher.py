@@ -0,0 +1,152 @@
+"""Background allotment checks for watched IPOs.
+
+Users whose results are not out yet can watch the IPO instead of pressing
+the button again and again. Every IPO_WATCH_INTERVAL the watcher loads all
+watched (ipoid, PAN) pairs, probes each IPO with one batch and, once the
+registrar has published results, checks every watched PAN of that IPO in
+large deduplicated batches. Each user then gets one message covering all
+their PANs, and the watch is removed.
+"""
+import asyncio
+import logging
+import os
+import random
+
+from telegram.error import Forbidden
+
+import metrics
+import render
+from allotment import AllotmentService, AllotmentStatus
+from async_db import get_watch_targets, purge_watches, remove_watch
+from sender import bulk
+
+logger = logging.getLogger(__name__)
+
+# How often watched IPOs are checked (seconds, 0 disables), +/- 10% jitter
+IPO_WATCH_INTERVAL = float(os.getenv("IPO_WATCH_INTERVAL", 900))
+# PANs per check-allotment request and requests in flight for watch checks
+# (kept apart from the interactive checks' limits)
+IPO_WATCH_BATCH_SIZE = int(os.getenv("IPO_WATCH_BATCH_SIZE", 20))
+IPO_WATCH_CONCURRENCY = int(os.getenv("IPO_WATCH_CONCURRENCY", 2))
+# Watches are dropped after this many days without results
+IPO_WATCH_MAX_AGE_DAYS = float(os.getenv("IPO_WATCH_MAX_AGE_DAYS", 30))
+
+IPO_WATCH_JITTER = 0.1
+
+# A PAN in one of these states is retried in the next round instead of being sent
+_UNRESOLVED = (AllotmentStatus.PENDING, AllotmentStatus.FAILED)
+
+watch_notifications_total = metrics.Counter(
+    "bot_watch_notifications_total", "Result notifications for watched IPOs, by outcome", ("outcome",)
+)
+watch_rounds_total = metrics.Counter(
+    "bot_watch_rounds_total", "Watched-IPO checks, by result (published, not_published, error)", ("result",)
+)
+
+
+class IpoWatcher:
+    """Periodically checks watched IPOs and notifies users once results are out"""
+
+    def __init__(self, bot, url, interval=IPO_WATCH_INTERVAL, batch_size=IPO_WATCH_BATCH_SIZE,
+                 concurrency=IPO_WATCH_CONCURRENCY, max_age_days=IPO_WATCH_MAX_AGE_DAYS):
+        self.bot = bot
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_age = max_age_days * 86400
+        # Results land in the same cache as interactive checks
+        self.service = AllotmentService(
+            url, window=0, max_batch_size=batch_size, chunk_size=batch_size, max_concurrency=concurrency
+        )
+        self._task = None
+
+    def start(self):
+        """Start the background loop (returns the task, None if disabled)"""
+        if self.interval <= 0:
+            return None
+        self._task = asyncio.create_task(self._run_forever())
+        logger.info(f"IPO watcher started (every {self.interval:.0f}s)")
+        return self._task
+
+    async def stop(self):
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval * random.uniform(1 - IPO_WATCH_JITTER, 1 + IPO_WATCH_JITTER))
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"IPO watcher round failed: {e!r}")
+
+    async def run_once(self):
+        """Check every watched IPO once; returns the number of users notified"""
+        purged = await purge_watches(self.max_age)
+        if purged:
+            logger.info(f"Dropped {purged} expired IPO watch(es)")
+
+        notified = 0
+        for ipo_id, target in (await get_watch_targets()).items():
+            notified += await self._check_ipo(ipo_id, target["name"], target["users"])
+        return notified
+
+    async def _check_ipo(self, ipo_id, ipo_name, users):
+        # Users watching the same IPO often share PANs (family accounts)
+        pan_numbers = list(dict.fromkeys(
+            pan_data["pan"] for pans in users.values() for pan_data in pans
+        ))
+
+        try:
+            # One batch tells whether the registrar has published anything yet
+            probe = await self.service.check(ipo_id, pan_numbers[:self.batch_size])
+            if not any(result.is_final for result in probe.results.values()):
+                watch_rounds_total.inc("not_published")
+                return 0
+            report = await self.service.check(ipo_id, pan_numbers)
+        except Exception as e:
+            watch_rounds_total.inc("error")
+            logger.warning(f"Watched IPO {ipo_id} could not be checked: {e!r}")
+            return 0
+
+        watch_rounds_total.inc("published")
+        sends = []
+        for user_id, pans in users.items():
+            user_report = report.subset([pan_data["pan"] for pan_data in pans])
+            if any(result.status in _UNRESOLVED for result in user_report.results.values()):
+                continue
+            sends.append(self._notify(user_id, ipo_id, ipo_name, pans, user_report))
+        # Sent together; the send scheduler paces them
+        notified = sum(await asyncio.gather(*sends))
+
+        logger.info(f"Watched IPO {ipo_id}: {len(pan_numbers)} PAN(s) checked, {notified}/{len(users)} user(s) notified")
+        return notified
+
+    async def _notify(self, user_id, ipo_id, ipo_name, pans, report):
+        try:
+            await self.bot.send_message(
+                chat_id=user_id,
+                text=render.watch_notification(ipo_name, pans, report),
+                parse_mode="Markdown",
+                reply_markup=render.ALLOTMENT_RESULT_INLINE,
+                # Paced by the send scheduler behind interactive replies
+                **bulk(self.bot)
+            )
+        except Forbidden:
+            # The user blocked the bot; nothing more to send them
+            watch_notifications_total.inc("blocked")
+            await remove_watch(user_id, ipo_id)
+            return False
+        except Exception as e:
+            # Kept for the next round
+            watch_notifications_total.inc("error")
+            logger.warning(f"Could not notify user {user_id} about IPO {ipo_id}: {e}")
+            return False
+
+        watch_notifications_total.inc("sent")
+        await remove_watch(user_id, ipo_id)
+        return True
@@ -0,0 +1,134 @@
+"""Logging setup: non-blocking handler, JSON lines and PAN masking.
+
+Log calls only put the record on an in-memory queue (QueueHandler); a
+QueueListener thread does the formatting and the writing, so a slow stderr
+never stalls the event loop. PAN numbers are masked in every line, and
+upstream payloads/bodies are only logged at DEBUG for a sampled fraction
+of requests (see should_log_payload).
+"""
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Root log level
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# "text" (human-readable, the default) or "json" (one JSON object per line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Fraction of upstream requests whose payload and response body are logged
+# (needs LOG_LEVEL=DEBUG; PANs are masked)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.0))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Libraries that log every request at INFO
+QUIET_LOGGERS = ("httpx", "httpcore")
+
+PAN_RE = re.compile(r"\b([A-Z]{2})[A-Z]{3}[0-9]{4}([A-Z])\b", re.IGNORECASE)
+
+# LogRecord attributes that aren't structured `extra` fields
+_RECORD_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener = None
+
+
+def mask_pans(text):
+    """Replace PAN numbers in text, e.g. ABCDE1234F -> AB*******F"""
+    return PAN_RE.sub(r"\1*******\2", text)
+
+
+def should_log_payload(logger):
+    """True if this request's payload should be logged (DEBUG enabled and sampled)"""
+    return (
+        LOG_PAYLOAD_SAMPLE_RATE > 0
+        and logger.isEnabledFor(logging.DEBUG)
+        and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+    )
+
+
+class MaskingFormatter(logging.Formatter):
+    """Text formatter that masks PAN numbers"""
+
+    def format(self, record):
+        return mask_pans(super().format(record))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, any `extra` fields and exc"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return mask_pans(json.dumps(entry, ensure_ascii=False, default=str))
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler formats the whole line in the caller; here only the
+    message arguments are merged (they may be mutated after the call) and
+    the traceback is rendered, and `extra` fields survive for JSON output.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Route all logging through a queue to a single stream handler"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if fmt == "json" else MaskingFormatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+    _listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
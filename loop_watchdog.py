@@ -0,0 +1,127 @@
+"""Event-loop watchdog: detects calls that block the asyncio loop.
+
+A heartbeat task on the loop stamps the time every interval, and a daemon
+thread checks the stamp. When the loop has not run for longer than the
+threshold, the thread samples the loop thread's stack and the handler that
+was running, and logs them; when the loop recovers the heartbeat records
+how long the stall lasted. Enabled with LOOP_WATCHDOG=true.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_WATCHDOG_ENABLED = os.getenv("LOOP_WATCHDOG", "false").lower() == "true"
+# Stalls longer than this are reported (milliseconds)
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv("LOOP_WATCHDOG_THRESHOLD_MS", 100)) / 1000
+# Heartbeat / check period (milliseconds)
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL_MS", 50)) / 1000
+# Innermost frames kept from a sampled stack
+LOOP_WATCHDOG_STACK_DEPTH = int(os.getenv("LOOP_WATCHDOG_STACK_DEPTH", 20))
+
+stalls_total = metrics.Counter(
+    "bot_event_loop_stalls_total", "Event-loop stalls over the watchdog threshold, by handler", ("handler",)
+)
+stall_seconds = metrics.Histogram(
+    "bot_event_loop_stall_duration_seconds", "Duration of event-loop stalls over the watchdog threshold",
+    ("handler",)
+)
+
+
+class LoopWatchdog:
+    def __init__(self, threshold=LOOP_WATCHDOG_THRESHOLD, interval=LOOP_WATCHDOG_INTERVAL,
+                 stack_depth=LOOP_WATCHDOG_STACK_DEPTH):
+        self.threshold = threshold
+        self.interval = interval
+        self.stack_depth = stack_depth
+        self._loop = None
+        self._loop_thread_id = None
+        self._beat = 0.0
+        self._sample = None      # (beat, handler, stack) of the current stall
+        self._heartbeat_task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start watching the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat_task = self._loop.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Event-loop watchdog started (threshold={self.threshold * 1000:.0f}ms, "
+            f"interval={self.interval * 1000:.0f}ms)"
+        )
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+
+    async def _heartbeat(self):
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - self._beat - self.interval
+            if lag > self.threshold:
+                self._record_stall(lag)
+
+    def _record_stall(self, lag):
+        sample = self._sample
+        self._sample = None
+        handler = sample[1] if sample and sample[0] == self._beat else self._current_handler()
+        stalls_total.inc(handler)
+        stall_seconds.observe(lag, handler)
+        logger.warning(
+            f"Event loop was blocked for {lag * 1000:.0f}ms (handler: {handler})",
+            extra={"event": "loop_stall_end", "lag_ms": round(lag * 1000, 1), "handler": handler}
+        )
+
+    def _watch(self):
+        # Runs in the watchdog thread
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+            if lag <= self.threshold or (self._sample and self._sample[0] == beat):
+                continue
+
+            handler = self._current_handler()
+            stack = self._loop_stack()
+            self._sample = (beat, handler, stack)
+            logger.warning(
+                f"Event loop blocked for over {lag * 1000:.0f}ms in handler {handler}:\n{stack}",
+                extra={"event": "loop_stall", "lag_ms": round(lag * 1000, 1), "handler": handler, "stack": stack}
+            )
+
+    def _current_handler(self):
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        return metrics.active_handlers.get(task, "-")
+
+    def _loop_stack(self):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return ""
+        return "".join(traceback.format_stack(frame)[-self.stack_depth:])
+
+
+def start_watchdog():
+    """Start a LoopWatchdog on the running loop if LOOP_WATCHDOG is enabled"""
+    if not LOOP_WATCHDOG_ENABLED:
+        return None
+    watchdog = LoopWatchdog()
+    watchdog.start()
+    return watchdog
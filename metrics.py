@@ -0,0 +1,286 @@
+"""In-process metrics exported in the Prometheus text exposition format.
+
+Counters, gauges and histograms are registered at import by the modules
+that update them and rendered by render_metrics() for GET /metrics.
+Updates are guarded by a lock because the SQLite worker thread records
+metrics too.
+"""
+import asyncio
+import collections
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# How often the event-loop lag probe wakes up (seconds)
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 1.0))
+# Upstream latencies kept for the /readyz p95 (seconds)
+UPSTREAM_WINDOW_SECONDS = float(os.getenv("UPSTREAM_WINDOW_SECONDS", 300))
+
+# Default latency buckets (seconds)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Buckets for fast in-process work such as SQLite queries
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0)
+
+_lock = threading.Lock()
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [*zip(labelnames, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(value) for value in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Copy of {label values: value} for every series"""
+        with _lock:
+            return dict(self._values)
+
+    def _samples(self):
+        with _lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values = {}   # labels -> [bucket counts..., sum]
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _samples(self):
+        with _lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = (("le", _format_value(float(bound))),)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of sorted values by nearest rank; None if there are none"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(len(values) * q / 100) - 1)]
+
+
+class LatencyWindow:
+    """Latencies observed in the last `seconds` (at most maxlen of them).
+
+    Not exported to /metrics, where quantiles come from the histograms; it
+    gives health checks a current percentile without a Prometheus server.
+    """
+
+    def __init__(self, seconds, maxlen=2048):
+        self.seconds = seconds
+        self._samples = collections.deque(maxlen=maxlen)   # (monotonic time, seconds)
+
+    def observe(self, value):
+        with _lock:
+            self._samples.append((time.monotonic(), value))
+
+    def values(self):
+        """Sorted latencies still inside the window"""
+        cutoff = time.monotonic() - self.seconds
+        with _lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return sorted(value for _, value in self._samples)
+
+
+def render_metrics():
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---- Bot metrics ----
+
+updates_total = Counter(
+    "bot_updates_total", "Updates handled, by handler/route and outcome", ("handler", "outcome")
+)
+handler_seconds = Histogram(
+    "bot_handler_duration_seconds", "Time spent handling one update, by handler/route", ("handler",)
+)
+
+upstream_seconds = Histogram(
+    "bot_upstream_request_duration_seconds", "Upstream API request latency, by endpoint", ("endpoint",)
+)
+upstream_responses_total = Counter(
+    "bot_upstream_responses_total", "Upstream API responses, by endpoint and HTTP status code",
+    ("endpoint", "code")
+)
+upstream_errors_total = Counter(
+    "bot_upstream_errors_total", "Upstream API requests that got no response, by endpoint and reason",
+    ("endpoint", "reason")
+)
+upstream_retries_total = Counter(
+    "bot_upstream_retries_total", "Upstream API requests retried after a failure, by endpoint", ("endpoint",)
+)
+# Every upstream request's latency (failures included), for /readyz
+upstream_latency_window = LatencyWindow(UPSTREAM_WINDOW_SECONDS)
+
+cache_requests_total = Counter(
+    "bot_cache_requests_total", "Cache lookups, by cache and result (hit, stale, miss, refresh)", ("cache", "result")
+)
+
+sqlite_query_seconds = Histogram(
+    "bot_sqlite_query_duration_seconds", "SQLite call latency on the database thread, by function",
+    ("query",), buckets=FAST_BUCKETS
+)
+
+loop_lag_seconds = Gauge(
+    "bot_event_loop_lag_seconds", "How late the last event-loop lag probe woke up"
+)
+loop_lag_histogram = Histogram(
+    "bot_event_loop_lag_distribution_seconds", "Distribution of event-loop lag probe delays",
+    buckets=FAST_BUCKETS + (2.5, 5.0)
+)
+
+
+# Name of the handler each asyncio task is running (read by loop_watchdog)
+active_handlers = {}
+
+
+def record_handler(name, elapsed, failed=False):
+    """Count one update handled by name and record how long it took"""
+    handler_seconds.observe(elapsed, name)
+    updates_total.inc(name, "error" if failed else "ok")
+
+
+@contextmanager
+def track_handler(name):
+    """Time the enclosed block as the handling of one update by name"""
+    task = asyncio.current_task()
+    outer = active_handlers.get(task)
+    active_handlers[task] = name
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        record_handler(name, time.perf_counter() - start, failed)
+        if outer is None:
+            active_handlers.pop(task, None)
+        else:
+            active_handlers[task] = outer
+
+
+def instrumented(handler, name=None):
+    """Wrap a PTB handler callback with track_handler.
+
+    name is a string or a function of the update (for callback queries whose
+    route is encoded in their data); it defaults to the callback's name.
+    """
+    @wraps(handler)
+    async def wrapper(update, context):
+        route = name(update) if callable(name) else (name or handler.__name__)
+        with track_handler(route):
+            return await handler(update, context)
+    return wrapper
+
+
+async def monitor_event_loop(interval=LOOP_LAG_INTERVAL):
+    """Measure how late the event loop wakes a sleeping task, forever"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        loop_lag_seconds.set(lag)
+        loop_lag_histogram.observe(lag)
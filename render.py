@@ -0,0 +1,396 @@
+"""Keyboards and message templates for the bot's screens.
+
+Constant keyboards and static messages are built once at import and the
+same (immutable) objects are reused for every reply. Dynamic screens are
+rendered by collecting their pieces in a list and joining it once, and IPO
+page keyboards are memoized per catalog, so they are rebuilt only after the
+IPO list is refreshed.
+"""
+from functools import lru_cache
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
+
+from allotment import AllotmentStatus, CheckFailure
+from database import MAX_PANS_PER_USER
+
+# Reply-keyboard button labels (also the text routes in bot.py)
+BTN_CHECK_ALLOTMENT = "📊 Check IPO Allotment"
+BTN_MANAGE_PANS = "📋 Manage PAN Numbers"
+BTN_HELP = "ℹ️ Help"
+BTN_ADD_PAN = "➕ Add PAN Number"
+BTN_DELETE_PAN = "❌ Delete PAN Number"
+BTN_VIEW_PANS = "📋 View PAN Numbers"
+BTN_BACK_TO_MAIN = "🔙 Back to Main Menu"
+BTN_BACK_TO_PAN_MANAGEMENT = "🔙 Back to PAN Management"
+BTN_PREVIOUS = "⬅️ Previous"
+BTN_NEXT = "Next ➡️"
+BTN_REFRESH_IPOS = "🔄 Refresh IPO List"
+# Prefix of the per-PAN buttons on the delete keyboard
+BTN_DELETE_PREFIX = "🗑️ Delete "
+
+# Maximum number of memoized IPO page keyboards
+IPO_PAGE_CACHE_SIZE = 64
+
+# ---- Constant keyboards ----
+
+MAIN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [[BTN_MANAGE_PANS, BTN_CHECK_ALLOTMENT], [BTN_HELP]],
+    resize_keyboard=True
+)
+
+PAN_MENU_KEYBOARD = ReplyKeyboardMarkup(
+    [[BTN_ADD_PAN, BTN_DELETE_PAN], [BTN_VIEW_PANS, BTN_BACK_TO_MAIN]],
+    resize_keyboard=True
+)
+
+# Only the way back is offered while waiting for PAN input
+AWAITING_PAN_KEYBOARD = ReplyKeyboardMarkup([[BTN_BACK_TO_PAN_MANAGEMENT]], resize_keyboard=True)
+
+BACK_TO_MENU_INLINE = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")]]
+)
+
+ADD_PAN_NOW_INLINE = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("➕ Add PAN Now", callback_data="add_pan")]]
+)
+
+ALLOTMENT_RESULT_INLINE = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔄 Refresh IPO List", callback_data="ipo_list_0")],
+    [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="back_to_menu")]
+])
+
+BACK_TO_IPO_LIST_INLINE = InlineKeyboardMarkup(
+    [[InlineKeyboardButton("🔙 Back", callback_data="ipo_list_0")]]
+)
+
+# Inline buttons to subscribe to / unsubscribe from an IPO's results
+BTN_WATCH = "🔔 Notify me when results are out"
+BTN_UNWATCH = "🔕 Stop notifications"
+
+# ---- Static messages ----
+
+WELCOME_MESSAGE = (
+    "🎉 *Welcome to IPO Allotment Bot!*\n\n"
+    "This bot helps you check IPO allotment status for multiple PAN numbers.\n\n"
+    "*Features:*\n"
+    "• 📋 Manage multiple PAN numbers with names\n"
+    "• 📊 Select from available IPOs\n"
+    "• ✅ Check allotment status for all your PANs\n\n"
+    "Use the menu below to get started! 👇"
+)
+
+HELP_MESSAGE = (
+    "📚 *How to use IPO Allotment Bot:*\n\n"
+
+    "*1. Manage PAN Numbers* 📋\n"
+    "➕ Add PAN numbers with names (e.g., \"John Doe\")\n"
+    "❌ Delete PAN numbers you no longer need\n"
+    "👁️ View all your saved PAN numbers\n\n"
+
+    "*2. Check IPO Allotment* 📊\n"
+    "🔍 Click \"Check IPO Allotment\"\n"
+    "📝 Select an IPO from the available list\n"
+    "📈 Get allotment status for all your PAN numbers\n"
+    "🔔 Results not out yet? Tap \"Notify me\" to get them once published\n\n"
+
+    "*Commands:*\n"
+    "▶️ /start - Start the bot and show main menu\n"
+    "ℹ️ /help - Show this help message\n\n"
+
+    "*Flow:*\n"
+    "1️⃣ Add your PAN numbers\n"
+    "2️⃣ Click \"Check IPO Allotment\"\n"
+    "3️⃣ Choose an IPO\n"
+    "4️⃣ View results for all PANs\n\n"
+
+    "💡 Use the keyboard buttons below to navigate!"
+)
+
+MAIN_MENU_MESSAGE = "🏠 *Main Menu*\n\nWhat would you like to do?"
+MAIN_MENU_TITLE = "🏠 *Main Menu*"
+
+PAN_MENU_MESSAGE = "📋 *PAN Number Management*\n\nChoose an option:"
+PAN_MENU_TITLE = "📋 *PAN Number Management*"
+
+WATCH_REMOVED_MESSAGE = "🔕 *Notifications turned off*\n\nYou won't be notified about this IPO."
+
+PAN_LIMIT_MESSAGE = (
+    "❌ *Limit Reached*\n\n"
+    f"You have reached the maximum limit of {MAX_PANS_PER_USER} PAN numbers.\n"
+    "Please delete some PANs before adding new ones."
+)
+
+INVALID_PAN_FORMAT_MESSAGE = (
+    "❌ *Invalid Format*\n\n"
+    "Please use one of these formats:\n"
+    "• ABCDE1234F (PAN only)\n"
+    "• ABCDE1234F  John Doe (PAN with name)"
+)
+
+INVALID_PAN_LENGTH_MESSAGE = (
+    "❌ *Invalid PAN*\n\n"
+    "PAN must be 10 characters long.\n"
+    "*Format:* ABCDE1234F"
+)
+
+DUPLICATE_PAN_MESSAGE = (
+    "❌ *Duplicate PAN*\n\n"
+    "This PAN number is already added to your account."
+)
+
+ADD_PAN_FAILED_MESSAGE = "❌ *Error*\n\nFailed to add PAN. Please try again."
+
+NO_PANS_TO_DELETE_MESSAGE = (
+    "❌ *No PAN Numbers Found*\n\n"
+    "You don't have any PAN numbers saved yet.\n"
+    "Add a PAN number first to get started."
+)
+
+DELETE_PAN_PROMPT = "❌ *Delete PAN Number*\n\nSelect a PAN to delete from the keyboard below:"
+
+PAN_REMOVED_MESSAGE = "✅ *PAN Deleted Successfully*\n\nThe PAN has been removed from your list."
+PAN_NOT_IN_LIST_MESSAGE = "❌ *PAN Not Found*\n\nThis PAN is not in your list."
+
+# No PANs when an IPO is picked from the reply keyboard / an inline button
+NO_PANS_FOR_CHECK_MESSAGE = (
+    "❌ *No PAN numbers found.*\n\n"
+    "Please add a PAN first to check IPO allotment status."
+)
+PAN_REQUIRED_MESSAGE = (
+    "❌ *PAN Not Found!*\n\n"
+    "Please add your PAN card to check allotment status."
+)
+
+ALLOTMENT_TIMEOUT_MESSAGE = (
+    "⏱️ *Request Timed Out*\n\n"
+    "The server is taking too long to respond.\n"
+    "Please try again later."
+)
+ALLOTMENT_FAILED_MESSAGE = "❌ *An error occurred*\n\nPlease try again later."
+ALLOTMENT_UNAVAILABLE_MESSAGE = (
+    "⚠️ *Allotment Service Unavailable*\n\n"
+    "The allotment server is not responding right now.\n"
+    "Please try again in a few minutes."
+)
+
+# Failed checks started from the reply keyboard (no loading message to edit)
+ALLOTMENT_REPLY_FAILURES = {
+    CheckFailure.API_ERROR: "❌ API Error. Please try again later.",
+    CheckFailure.REJECTED: "❌ Failed to fetch allotment status. Please try again.",
+    CheckFailure.TIMEOUT: "❌ An error occurred. Please try again.",
+    CheckFailure.UNAVAILABLE: "⚠️ The allotment server is not responding right now. Please try again in a few minutes.",
+    CheckFailure.ERROR: "❌ An error occurred. Please try again.",
+}
+
+# ---- Dynamic screens ----
+
+def add_pan_prompt(pan_count):
+    """Instructions shown when the user starts adding a PAN"""
+    return (
+        f"➕ *Add PAN Number* ({pan_count}/{MAX_PANS_PER_USER})\n\n"
+        "Please send your PAN details in one of these formats:\n\n"
+        "*Format 1:* PAN only\n"
+        "`ABCDE1234F`\n\n"
+        "*Format 2:* PAN with name\n"
+        "`ABCDE1234F  John Doe`\n\n"
+        "💡 Tip: Separate PAN and name with a space"
+    )
+
+
+def pan_added(name, pan):
+    return (
+        "✅ *PAN Added Successfully!*\n\n"
+        f"👤 *Name:* {name}\n"
+        f"📄 *PAN:* `{pan}`\n\n"
+        "🎉 You can now check IPO allotment status."
+    )
+
+
+def pan_deleted(name, pan):
+    return f"✅ *PAN Deleted Successfully*\n\n🗑️ Deleted: `{pan}` - *{name}*"
+
+
+def pan_list(pans):
+    """The user's saved PANs"""
+    if not pans:
+        return (
+            f"📋 *Your PAN Numbers:* (0/{MAX_PANS_PER_USER})\n\n"
+            "❌ No PAN numbers saved yet.\n\n"
+            "💡 Add your first PAN to start checking IPO allotments."
+        )
+
+    parts = [f"📋 *Your PAN Numbers:* ({len(pans)}/{MAX_PANS_PER_USER})\n\n"]
+    parts.extend(
+        f"👤 {idx}. *{pan_data['name']}*\n   📄 PAN: `{pan_data['pan']}`\n\n"
+        for idx, pan_data in enumerate(pans, 1)
+    )
+    return "".join(parts)
+
+
+def delete_pan_keyboard(pans):
+    """One delete button per PAN (2 per row) plus the way back"""
+    buttons = [
+        f"{BTN_DELETE_PREFIX}{idx}: {pan_data['pan']} - {pan_data['name']}"
+        for idx, pan_data in enumerate(pans, 1)
+    ]
+    rows = [buttons[start:start + 2] for start in range(0, len(buttons), 2)]
+    rows.append([BTN_BACK_TO_PAN_MANAGEMENT])
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+
+def checking_message(pan_count):
+    return f"🔍 *Checking allotment status...*\n\n⏳ Checking {pan_count} PAN number(s)...\nPlease wait..."
+
+
+def allotment_failure(failure, error, ipo_id):
+    """Message and inline keyboard replacing the loading message of a failed check"""
+    if failure is CheckFailure.API_ERROR:
+        msg = f"❌ *Failed to check allotment*\n\nError code: {error.status_code}\n\nPlease try again later."
+    elif failure is CheckFailure.REJECTED:
+        msg = f"❌ *Error*\n\n{error}"
+    elif failure in (CheckFailure.TIMEOUT, CheckFailure.UNAVAILABLE):
+        msg = ALLOTMENT_TIMEOUT_MESSAGE if failure is CheckFailure.TIMEOUT else ALLOTMENT_UNAVAILABLE_MESSAGE
+        return msg, InlineKeyboardMarkup(
+            [[InlineKeyboardButton("🔄 Try Again", callback_data=f"check_{ipo_id}")]]
+        )
+    else:
+        msg = ALLOTMENT_FAILED_MESSAGE
+    return msg, BACK_TO_IPO_LIST_INLINE
+
+
+def ipo_list_message(total_ipos, pan_count, page, total_pages):
+    """Header of the IPO list shown with the reply keyboard"""
+    return (
+        "📊 *IPO Allotment Check*\n\n"
+        f"✅ IPO list updated ({total_ipos} IPOs available)\n\n"
+        f"Select an IPO to check allotment status for your {pan_count} PAN number(s):\n\n"
+        f"📄 Page {page + 1} of {total_pages}"
+    )
+
+
+@lru_cache(maxsize=IPO_PAGE_CACHE_SIZE)
+def ipo_page_keyboard(catalog, page):
+    """Reply keyboard for one page of a catalog: IPO labels (2 per row) and navigation"""
+    labels = [entry.label for entry in catalog.page(page)]
+    rows = [labels[start:start + 2] for start in range(0, len(labels), 2)]
+
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(BTN_PREVIOUS)
+    if page < catalog.total_pages - 1:
+        nav_buttons.append(BTN_NEXT)
+    if nav_buttons:
+        rows.append(nav_buttons)
+
+    rows.append([BTN_REFRESH_IPOS, BTN_BACK_TO_MAIN])
+    return ReplyKeyboardMarkup(rows, resize_keyboard=True)
+
+
+@lru_cache(maxsize=IPO_PAGE_CACHE_SIZE)
+def ipo_page_inline(catalog, page):
+    """Inline keyboard for one page of a catalog: one check button per IPO and navigation"""
+    rows = [
+        [InlineKeyboardButton(entry.label, callback_data=f"check_{entry.ipoid}")]
+        for entry in catalog.page(page)
+    ]
+
+    nav_buttons = []
+    if page > 0:
+        nav_buttons.append(InlineKeyboardButton(BTN_PREVIOUS, callback_data=f"ipo_list_{page - 1}"))
+    if page < catalog.total_pages - 1:
+        nav_buttons.append(InlineKeyboardButton(BTN_NEXT, callback_data=f"ipo_list_{page + 1}"))
+    if nav_buttons:
+        rows.append(nav_buttons)
+
+    rows.append([InlineKeyboardButton("🔙 Back to Menu", callback_data="back_to_menu")])
+    return InlineKeyboardMarkup(rows)
+
+
+def ipo_page_title(page):
+    return f"📊 *Select an IPO* (Page {page + 1})\n\n"
+
+
+# Per-PAN status lines of the allotment report
+_STATUS_LINES = {
+    AllotmentStatus.PENDING: "      ⏳ Status: Checking...\n\n",
+    AllotmentStatus.FAILED: "      ⚠️ Status: Check failed, please try again\n\n",
+    AllotmentStatus.NOT_APPLIED: "      📊 Status: ❌ NOT APPLIED\n\n",
+    AllotmentStatus.NOT_ALLOTTED: "      ❌ Status: *NOT ALLOTTED*\n\n",
+}
+
+
+def _status_lines(result):
+    if result.status is AllotmentStatus.ALLOTTED:
+        return f"      ✅ Status: *ALLOTTED*\n      📈 Shares: *{result.shares}*\n\n"
+    if result.status is AllotmentStatus.OTHER:
+        # Show any other status
+        if result.shares and result.shares != "0":
+            return f"      📊 Status: {result.status_text}\n      📈 Shares: {result.shares}\n\n"
+        return f"      📊 Status: {result.status_text}\n\n"
+    return _STATUS_LINES[result.status]
+
+
+def allotment_status(ipo_name, pans, report):
+    """Allotment report for all PANs (pending PANs are shown as being checked)"""
+    parts = [f"🏦 *IPO Allotment Status*\n\n📋 *IPO:* {ipo_name}\n\n"]
+    results = report.results
+
+    for idx, pan_data in enumerate(pans, 1):
+        pan_number = pan_data["pan"]
+        parts.append(
+            f"*{idx}.* 👤 *{pan_data['name']}*\n      📋 PAN: `{pan_number}`\n"
+            f"{_status_lines(results[pan_number])}"
+        )
+
+    pending = report.pending
+    allotted_count = report.count(AllotmentStatus.ALLOTTED)
+    if pending:
+        parts.append(f"⏳ *{pending} pending...*\n")
+    # Add congratulatory or encouragement message
+    elif allotted_count == 1:
+        parts.append("🎉 *Congratulations!* You have been allotted 1 IPO!\n")
+    elif allotted_count > 1:
+        parts.append(f"🎉 *Congratulations!* You have been allotted {allotted_count} IPOs!\n")
+    elif report.count(AllotmentStatus.NOT_ALLOTTED):
+        parts.append("💪 *Better luck next time!* Keep trying.\n")
+
+    return "".join(parts)
+
+
+# ---- Result notifications ----
+
+@lru_cache(maxsize=IPO_PAGE_CACHE_SIZE)
+def watch_offer_inline(ipo_id):
+    """Allotment result buttons plus the offer to be notified when results are out"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(BTN_WATCH, callback_data=f"watch_{ipo_id}")],
+        *ALLOTMENT_RESULT_INLINE.inline_keyboard
+    ])
+
+
+@lru_cache(maxsize=IPO_PAGE_CACHE_SIZE)
+def unwatch_inline(ipo_id):
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(BTN_UNWATCH, callback_data=f"unwatch_{ipo_id}")],
+        [InlineKeyboardButton("🔙 Back to Main Menu", callback_data="back_to_menu")]
+    ])
+
+
+def allotment_result_inline(report):
+    """Buttons under a finished check: offer a watch while results are not out"""
+    if report.published:
+        return ALLOTMENT_RESULT_INLINE
+    return watch_offer_inline(report.ipo_id)
+
+
+def watch_added(ipo_name):
+    return (
+        f"🔔 *Watching {ipo_name}*\n\n"
+        "You'll get one message with the results for all your PAN numbers "
+        "as soon as they are published."
+    )
+
+
+def watch_notification(ipo_name, pans, report):
+    """Message pushed to a watching user once the results are out"""
+    return "🔔 *Allotment results are out!*\n\n" + allotment_status(ipo_name, pans, report)
@@ -0,0 +1,108 @@
+"""Routing of plain-text messages (reply-keyboard buttons) to handlers.
+
+The routing table is built once at startup: exact button labels live in a
+dict and prefix buttons (e.g. "🗑️ Delete 1: ...") in a character trie, so
+dispatching a message costs one lookup however many buttons exist. A
+per-user conversation state (such as waiting for a PAN) takes precedence
+over both, and anything unmatched goes to the fallback handler.
+"""
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# context.user_data key holding the user's conversation state
+STATE_KEY = "state"
+
+# Conversation states
+AWAITING_PAN = "awaiting_pan"
+
+# Marks the end of a prefix in the trie
+_END = object()
+
+
+def get_state(context):
+    """Get the user's conversation state (None when idle)"""
+    return context.user_data.get(STATE_KEY)
+
+
+def set_state(context, state):
+    """Set the user's conversation state"""
+    context.user_data[STATE_KEY] = state
+
+
+def clear_state(context):
+    """Return the user to the idle state"""
+    context.user_data.pop(STATE_KEY, None)
+
+
+class TextRouter:
+    """Maps message text to handler coroutines (update, context).
+
+    Lookup order: conversation state, exact label, longest matching prefix,
+    fallback. Each route's calls and latency are counted by
+    metrics.track_handler under "text:<handler name>".
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._exact = {}
+        self._prefixes = {}
+        self._fallback = None
+
+    def _route(self, handler):
+        return handler.__name__, handler
+
+    def add_state(self, state, handler):
+        """Route every message from users in the given conversation state"""
+        self._states[state] = self._route(handler)
+
+    def add_exact(self, text, handler):
+        """Route messages equal to text (a button label)"""
+        self._exact[text] = self._route(handler)
+
+    def add_prefix(self, prefix, handler):
+        """Route messages starting with prefix"""
+        node = self._prefixes
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[_END] = self._route(handler)
+
+    def set_fallback(self, handler):
+        """Route messages that match nothing else"""
+        self._fallback = self._route(handler)
+
+    def _match_prefix(self, text):
+        node = self._prefixes
+        match = None
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            match = node.get(_END, match)
+        return match
+
+    def resolve(self, text, state=None):
+        """Return the (name, handler) route for a message, or None"""
+        if state is not None:
+            route = self._states.get(state)
+            if route is not None:
+                return route
+        route = self._exact.get(text)
+        if route is None:
+            route = self._match_prefix(text)
+        if route is None:
+            route = self._fallback
+        return route
+
+    async def dispatch(self, update, context):
+        """Run the handler routed for the update's message text"""
+        text = update.message.text.strip()
+        route = self.resolve(text, get_state(context))
+        if route is None:
+            return
+
+        name, handler = route
+        with metrics.track_handler(f"text:{name}"):
+            await handler(update, context)
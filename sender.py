@@ -0,0 +1,249 @@
+"""Outbound Telegram rate limiting.
+
+SendScheduler is plugged into the Application (ApplicationBuilder().
+rate_limiter(...)), so every Bot API call made by the handlers -
+reply_text, edit_text, answer, send_message - passes through it:
+
+- a global token bucket and one per chat (private chats and groups have
+  different limits) keep the bot under Telegram's flood limits
+- waiting requests are served by lane: interactive replies go ahead of
+  bulk notifications (rate_limit_args={"priority": BULK})
+- an edit of a message that is still waiting to be sent is replaced by a
+  newer edit of the same message; both callers get the newer result
+- a RetryAfter (429) pauses all sending for the time Telegram asks for
+  and the request is retried
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Messages per second across all chats
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", 30))
+# Messages per second to one private chat, and how many may go out at once
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", 1))
+SEND_CHAT_BURST = float(os.getenv("SEND_CHAT_BURST", 3))
+# Messages per minute to one group chat
+SEND_GROUP_RATE_PER_MIN = float(os.getenv("SEND_GROUP_RATE_PER_MIN", 20))
+# Retries of a request after Telegram answered 429 RetryAfter
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", 2))
+
+# Lanes (lower is served first)
+INTERACTIVE = 0
+BULK = 1
+LANE_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Bot API methods whose pending calls are superseded by a newer call for the same message
+COALESCED_ENDPOINTS = frozenset({"editMessageText"})
+
+# Idle per-chat buckets are dropped every this many requests
+_SWEEP_EVERY = 1024
+
+send_wait_seconds = metrics.Histogram(
+    "bot_send_wait_seconds", "Time Bot API requests waited for the rate limiter, by lane", ("lane",)
+)
+send_retry_after_total = metrics.Counter(
+    "bot_send_retry_after_total", "429 RetryAfter responses from Telegram, by endpoint", ("endpoint",)
+)
+send_coalesced_total = metrics.Counter(
+    "bot_send_coalesced_total", "Message edits replaced by a newer edit before being sent"
+)
+
+
+class TokenBucket:
+    """Token bucket whose waiters are woken in (priority, arrival) order"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._waiters = []        # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._wakeup = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def idle(self):
+        """True if the bucket is full and nobody waits (same as a new bucket)"""
+        self._refill()
+        return not self._waiters and self._tokens >= self.capacity
+
+    async def acquire(self, priority=INTERACTIVE):
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The token was granted just as the caller gave up
+                self._tokens += 1
+            raise
+
+    def _schedule(self):
+        if self._wakeup is None and self._waiters:
+            delay = max(0.0, (1 - self._tokens) / self.rate)
+            self._wakeup = asyncio.get_running_loop().call_later(delay, self._wake)
+
+    def _wake(self):
+        self._wakeup = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # cancelled while waiting
+            self._tokens -= 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+
+class _PendingEdit:
+    __slots__ = ("callback", "args", "kwargs", "future")
+
+    def __init__(self, callback, args, kwargs, future):
+        self.callback = callback
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+
+
+def _consume_exception(future):
+    if not future.cancelled():
+        future.exception()
+
+
+class SendScheduler(BaseRateLimiter):
+    """PTB rate limiter with per-chat and global buckets, lanes and edit coalescing"""
+
+    def __init__(self, global_rate=SEND_GLOBAL_RATE, chat_rate=SEND_CHAT_RATE, chat_burst=SEND_CHAT_BURST,
+                 group_rate_per_min=SEND_GROUP_RATE_PER_MIN, max_retries=SEND_MAX_RETRIES):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate_per_min / 60
+        self.max_retries = max_retries
+        self._global = None
+        self._chats = {}
+        self._pending_edits = {}
+        self._resume_at = 0.0
+        self._requests = 0
+
+    async def initialize(self):
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats = {}
+        self._pending_edits = {}
+        self._resume_at = 0.0
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            else:
+                # Groups, supergroups and channels (@username ids)
+                bucket = TokenBucket(self.group_rate, self.group_rate * 60)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _sweep(self):
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle]:
+            del self._chats[chat_id]
+
+    async def _wait_resume(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _acquire(self, chat_id, priority):
+        start = time.monotonic()
+        await self._wait_resume()
+        if chat_id is not None:
+            await self._chat_bucket(chat_id).acquire(priority)
+        await self._global.acquire(priority)
+        send_wait_seconds.observe(time.monotonic() - start, LANE_NAMES.get(priority, str(priority)))
+
+        self._requests += 1
+        if self._requests % _SWEEP_EVERY == 0:
+            self._sweep()
+
+    async def _call(self, endpoint, callback, args, kwargs):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_resume()
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                send_retry_after_total.inc(endpoint)
+                if attempt == self.max_retries:
+                    raise
+                delay = float(e.retry_after)
+                # Telegram asks the whole bot to back off, not just this chat
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                logger.warning(f"Telegram flood limit on {endpoint}, pausing sends for {delay:.0f}s")
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        priority = (rate_limit_args or {}).get("priority", INTERACTIVE)
+        chat_id = data.get("chat_id")
+
+        if endpoint not in COALESCED_ENDPOINTS or "message_id" not in data:
+            await self._acquire(chat_id, priority)
+            return await self._call(endpoint, callback, args, kwargs)
+
+        key = (chat_id, data["message_id"])
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # Still waiting for its turn: send this (newer) edit instead
+            pending.callback, pending.args, pending.kwargs = callback, args, kwargs
+            send_coalesced_total.inc()
+            return await asyncio.shield(pending.future)
+
+        pending = _PendingEdit(callback, args, kwargs, asyncio.get_running_loop().create_future())
+        pending.future.add_done_callback(_consume_exception)
+        self._pending_edits[key] = pending
+        try:
+            try:
+                await self._acquire(chat_id, priority)
+            finally:
+                # From here on a newer edit is a separate request
+                if self._pending_edits.get(key) is pending:
+                    del self._pending_edits[key]
+            result = await self._call(endpoint, pending.callback, pending.args, pending.kwargs)
+        except BaseException as e:
+            if not pending.future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    pending.future.cancel()
+                else:
+                    pending.future.set_exception(e)
+            raise
+        pending.future.set_result(result)
+        return result
+
+
+def bulk(bot):
+    """Keyword arguments that send a Bot API call in the bulk lane (if the bot is rate limited)"""
+    if getattr(bot, "rate_limiter", None) is None:
+        return {}
+    return {"rate_limit_args": {"priority": BULK}}
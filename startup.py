@@ -0,0 +1,131 @@
+"""Startup timing.
+
+Every start records how long its phases took (imports, database init, IPO
+list warm-up, webhook registration, ...) and logs one summary line once
+the bot is ready. With STARTUP_PROFILE=true the slowest module imports are
+logged too, measured by an import hook installed when this module is
+imported, so bot.py imports it before anything else.
+"""
+import importlib.abc
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Log per-phase and per-import startup timings (slightly slows imports)
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "false").lower() == "true"
+
+# Slowest imports listed in the profile
+STARTUP_PROFILE_TOP_IMPORTS = 10
+
+_started = time.perf_counter()
+_phases = []          # (name, seconds) in completion order
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """Wraps a module's loader and records how long executing it took"""
+
+    def __init__(self, loader, timer):
+        self._loader = loader
+        self._timer = timer
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            # Includes the modules it imported
+            self._timer.imports[module.__name__] = time.perf_counter() - start
+
+    def __getattr__(self, name):
+        # get_resource_reader, get_source, ... of the wrapped loader
+        return getattr(self._loader, name)
+
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    def __init__(self):
+        self.imports = {}
+        self._finding = False
+
+    def find_spec(self, fullname, path, target=None):
+        if self._finding:
+            return None
+        self._finding = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, "find_spec"):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._finding = False
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self)
+        return spec
+
+
+_import_timer = None
+if STARTUP_PROFILE:
+    _import_timer = _ImportTimer()
+    sys.meta_path.insert(0, _import_timer)
+
+
+def elapsed():
+    """Seconds since the process started importing the bot"""
+    return time.perf_counter() - _started
+
+
+def record(name, seconds):
+    _phases.append((name, seconds))
+
+
+@contextmanager
+def phase(name):
+    """Time a block of startup work"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+async def timed(name, coro):
+    """Await a coroutine as a startup phase (for phases run concurrently with asyncio.gather)"""
+    with phase(name):
+        return await coro
+
+
+def report(label="Bot"):
+    """Log how long startup took and stop timing imports"""
+    global _import_timer
+    total = elapsed()
+    phases = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in _phases)
+    logger.info(f"⏱️ {label} ready {total * 1000:.0f}ms after start ({phases})")
+
+    if _import_timer is not None:
+        sys.meta_path.remove(_import_timer)
+        # Top-level packages only; their time includes their submodules
+        imports = sorted(
+            ((name, seconds) for name, seconds in _import_timer.imports.items() if "." not in name),
+            key=lambda item: item[1], reverse=True
+        )
+        slowest = ", ".join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in imports[:STARTUP_PROFILE_TOP_IMPORTS])
+        logger.info(f"⏱️ Slowest imports: {slowest}")
+        _import_timer = None
+
+    _phases.clear()
+
+
+def reset():
+    """Time the next start (e.g. a restart after a crash) from now"""
+    global _started
+    _started = time.perf_counter()
@@ -0,0 +1,189 @@
+"""Pluggable storage for per-user conversation state (context.user_data).
+
+StateStore is the interface a backend implements. SqliteStateStore keeps
+the state in a SQLite file in DATA_DIR that every worker process can open.
+A networked store (Redis, Postgres, ...) only has to provide the same
+coroutines. StatePersistence plugs a store into PTB, so a user's state
+(e.g. waiting for a PAN, the IPO list page) survives restarts and crashes.
+"""
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import DATA_DIR, SQLITE_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" (default) or "memory" (state is lost on restart)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", os.path.join(DATA_DIR, "state.db"))
+# How often changed user_data is written to the store (seconds)
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", 1.0))
+
+
+class StateStore(abc.ABC):
+    """Interface of a conversation-state backend; user data is a JSON-able dict"""
+
+    @abc.abstractmethod
+    async def load_users(self, owns=None):
+        """Get {user_id: data} for every stored user (only those owns(user_id) accepts)"""
+
+    @abc.abstractmethod
+    async def save_user(self, user_id, data):
+        pass
+
+    @abc.abstractmethod
+    async def delete_user(self, user_id):
+        pass
+
+    async def close(self):
+        pass
+
+
+class SqliteStateStore(StateStore):
+    """State in a SQLite file, used from one worker thread like async_db"""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS user_state (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        return self._conn
+
+    def _load_users(self, owns):
+        rows = self._connection().execute("SELECT user_id, data FROM user_state").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows if owns is None or owns(user_id)}
+
+    def _save_user(self, user_id, data):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            (user_id, data, time.time())
+        )
+        conn.commit()
+
+    def _delete_user(self, user_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+        conn.commit()
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def load_users(self, owns=None):
+        return await self._run(self._load_users, owns)
+
+    async def save_user(self, user_id, data):
+        # Serialized here, before the handler can change the dict again
+        await self._run(self._save_user, user_id, json.dumps(data))
+
+    async def delete_user(self, user_id):
+        await self._run(self._delete_user, user_id)
+
+    async def close(self):
+        await self._run(self._close)
+
+
+def create_state_store(backend=STATE_BACKEND):
+    """The configured store (None when state is kept in memory only)"""
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return SqliteStateStore()
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
+
+
+class StatePersistence(BasePersistence):
+    """PTB persistence for user_data backed by a StateStore.
+
+    owns(user_id) limits the users loaded at startup to the ones this
+    worker handles; chat, bot and callback data are not persisted.
+    """
+
+    def __init__(self, store, owns=None, update_interval=STATE_FLUSH_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = store
+        self.owns = owns
+
+    async def get_user_data(self):
+        users = await self.store.load_users(self.owns)
+        logger.info(f"Loaded conversation state of {len(users)} user(s)")
+        return users
+
+    async def update_user_data(self, user_id, data):
+        if data:
+            await self.store.save_user(user_id, data)
+        else:
+            await self.store.delete_user(user_id)
+
+    async def drop_user_data(self, user_id):
+        await self.store.delete_user(user_id)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def flush(self):
+        await self.store.close()
+
+    # Not persisted (see store_data)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
@@ -0,0 +1,96 @@
+"""Run with: python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from allotment import AllotmentDispatcher  # noqa: E402
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    def _dispatcher(self, **options):
+        dispatcher = AllotmentDispatcher("http://ipo/check", **options)
+        self.posts = []
+        self.release = asyncio.Event()
+
+        async def post(ipo_id, pan_numbers):
+            # Stands in for the upstream request; answers once released
+            self.posts.append((ipo_id, list(pan_numbers)))
+            await self.release.wait()
+            return {pan: {"success": True, "pan": pan} for pan in pan_numbers}
+
+        dispatcher._post = post
+        return dispatcher
+
+    async def _settle(self):
+        # Let the created batch tasks run up to their request
+        for _ in range(3):
+            await asyncio.sleep(0)
+
+    async def test_concurrent_lookups_share_one_request(self):
+        dispatcher = self._dispatcher(window=0.05, max_batch_size=20, chunk_size=5)
+        futures = {}
+        for user in range(3):
+            futures.update(dispatcher.lookup("ipo", [f"PAN{user}A", f"PAN{user}B"]))
+
+        await asyncio.sleep(0.1)
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(sorted(self.posts[0][1]), sorted(futures))
+
+        self.release.set()
+        results = await asyncio.gather(*futures.values())
+        self.assertEqual([result["pan"] for result in results], list(futures))
+
+    async def test_full_batch_is_sent_at_once(self):
+        dispatcher = self._dispatcher(window=10, max_batch_size=4, chunk_size=4)
+        dispatcher.lookup("ipo", ["A", "B", "C", "D"])
+        await self._settle()
+        self.assertEqual(self.posts, [("ipo", ["A", "B", "C", "D"])])
+        self.release.set()
+
+    async def test_remainder_waits_for_the_window(self):
+        dispatcher = self._dispatcher(window=0.05, max_batch_size=4, chunk_size=2)
+        futures = {}
+        for user in range(3):
+            futures.update(dispatcher.lookup("ipo", [f"PAN{user}A", f"PAN{user}B"]))
+
+        # Two users' chunks fill a batch; the third user's chunk waits for more lookups
+        await self._settle()
+        self.assertEqual([len(pans) for _, pans in self.posts], [4])
+        await asyncio.sleep(0.1)
+        self.assertEqual([len(pans) for _, pans in self.posts], [4, 2])
+
+        self.release.set()
+        await asyncio.gather(*futures.values())
+        self.assertEqual(dispatcher._pending, {})
+        self.assertEqual(dispatcher._inflight, {})
+
+    async def test_one_lookup_is_split_into_concurrent_chunks(self):
+        dispatcher = self._dispatcher(window=0.05, max_batch_size=20, chunk_size=2)
+        dispatcher.lookup("ipo", ["A", "B", "C", "D", "E"])
+        await asyncio.sleep(0.1)
+        self.assertEqual([pans for _, pans in self.posts], [["A", "B"], ["C", "D"], ["E"]])
+        self.release.set()
+
+    async def test_duplicate_pans_share_one_future(self):
+        dispatcher = self._dispatcher(window=0.05, max_batch_size=20, chunk_size=5)
+        first = dispatcher.lookup("ipo", ["A", "B"])
+        second = dispatcher.lookup("ipo", ["B", "C"])
+        self.assertIs(first["B"], second["B"])
+
+        await asyncio.sleep(0.1)
+        # Still in flight: a new lookup joins the running request
+        third = dispatcher.lookup("ipo", ["A"])
+        self.assertIs(third["A"], first["A"])
+        self.assertEqual([sorted(pans) for _, pans in self.posts], [["A", "B", "C"]])
+
+        self.release.set()
+        self.assertEqual((await third["A"])["pan"], "A")
+        # The same PAN of another IPO is a separate lookup
+        self.assertIsNot(dispatcher.lookup("other", ["A"])["A"], first["A"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""Run with: python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+from allotment import AllotmentService, CheckFailure, classify_failure  # noqa: E402
+from circuit_breaker import OPEN, CircuitOpen  # noqa: E402
+
+
+class HungUpstreamTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.connections = []
+        self.server = await asyncio.start_server(self._hang, "127.0.0.1", 0)
+        self.host = f"127.0.0.1:{self.server.sockets[0].getsockname()[1]}"
+        self.url = f"http://{self.host}/api/check-allotment"
+        http_client._breakers.clear()
+        await http_client.init_http_client()
+
+    async def asyncTearDown(self):
+        await http_client.close_http_client()
+        http_client._breakers.clear()
+        for writer in self.connections:
+            writer.close()
+        self.server.close()
+
+    async def _hang(self, reader, writer):
+        # Accept the connection and read the request, but never answer
+        self.connections.append(writer)
+        await reader.read(65536)
+
+    async def test_hung_upstream_opens_circuit(self):
+        dispatcher = AllotmentService(self.url, window=0.01, chunk_timeout=0.5).dispatcher
+        # Sequential checks, each given up by the chunk deadline
+        failures = []
+        for i in range(8):
+            future = dispatcher.lookup(f"ipo-{i}", ["ABCDE1234F"])["ABCDE1234F"]
+            try:
+                await future
+            except Exception as e:
+                failures.append(classify_failure(e))
+
+        breaker = http_client._breakers[self.host]
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(len(failures), 8)
+        self.assertIn(CheckFailure.TIMEOUT, failures)
+        # Once open, checks fail at once instead of waiting for the deadline
+        self.assertEqual(failures[-1], CheckFailure.UNAVAILABLE)
+        with self.assertRaises(CircuitOpen):
+            await http_client.post(self.url, json={}, timeout=0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
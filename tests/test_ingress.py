@@ -0,0 +1,69 @@
+"""Run with: python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingress import IngressConsumer, IngressQueue  # noqa: E402
+
+
+class SlowApplication:
+    """Stands in for the PTB Application: records updates, slowly"""
+
+    bot = None
+
+    def __init__(self, processed):
+        self.processed = processed
+
+    async def process_update(self, update):
+        await asyncio.sleep(0.02)
+        self.processed.append(update.update_id)
+
+
+class IngressRestartTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.queue = IngressQueue(os.path.join(self.tmp.name, "ingress.db"))
+
+    async def asyncTearDown(self):
+        await self.queue.close()
+        self.tmp.cleanup()
+
+    async def _run_for(self, processed, seconds):
+        consumer = IngressConsumer(self.queue, SlowApplication(processed), max_attempts=3)
+        task = asyncio.create_task(consumer.run())
+        await asyncio.sleep(seconds)
+        await consumer.stop()
+        task.cancel()
+
+    async def test_restarts_with_a_backlog_drop_nothing(self):
+        # One user, so the updates are handled one at a time and most stay buffered
+        for update_id in range(1, 41):
+            await self.queue.append({"update_id": update_id})
+
+        processed = []
+        for _ in range(3):
+            await self._run_for(processed, 0.05)
+        self.assertLess(len(processed), 40)
+
+        await self._run_for(processed, 2)
+        self.assertEqual(sorted(processed), list(range(1, 41)))
+        self.assertEqual(await self.queue.depth(), 0)
+
+    async def test_update_started_every_time_the_process_died_is_dropped(self):
+        await self.queue.append({"update_id": 1})
+        for _ in range(3):
+            # What a crash leaves behind: started, never acknowledged
+            await self.queue.mark_started((await self.queue.fetch(0))[0].seq)
+
+        processed = []
+        await self._run_for(processed, 0.2)
+        self.assertEqual(processed, [])
+        self.assertEqual(await self.queue.depth(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
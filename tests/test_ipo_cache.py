@@ -0,0 +1,47 @@
+"""Run with: python -m unittest discover tests"""
+import os
+import sys
+import unittest
+from unittest import mock
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CircuitOpen  # noqa: E402
+from ipo_cache import IpoCache, IpoListUnavailable  # noqa: E402
+
+IPOS = [{"ipoid": "1", "name": "Alpha"}, {"ipoid": "2", "name": "Beta"}]
+
+
+def _response(status_code, ipos=()):
+    return httpx.Response(status_code, json={"data": list(ipos)}, request=httpx.Request("GET", "http://ipo"))
+
+
+class ForcedRefreshTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = IpoCache("http://ipo", per_page=5, refresh_min_interval=0, snapshot_path=None)
+
+    async def _get(self, force, **patch):
+        with mock.patch("http_client.get", **patch):
+            return await self.cache.get(force=force)
+
+    async def test_failed_refresh_serves_cached_list(self):
+        catalog = await self._get(False, return_value=_response(200, IPOS))
+        for failure in (dict(side_effect=httpx.ReadTimeout("slow")),
+                        dict(return_value=_response(502)),
+                        dict(side_effect=CircuitOpen("ipo", 10))):
+            with self.subTest(failure=failure):
+                self.assertIs(await self._get(True, **failure), catalog)
+
+    async def test_failed_fetch_without_cached_list_raises(self):
+        with self.assertRaises(httpx.ReadTimeout):
+            await self._get(True, side_effect=httpx.ReadTimeout("slow"))
+        with self.assertRaises(IpoListUnavailable):
+            await self._get(False, return_value=_response(502))
+        with self.assertRaises(IpoListUnavailable):
+            await self._get(False, side_effect=CircuitOpen("ipo", 10))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+"""Run with: python -m unittest discover tests"""
+import asyncio
+import os
+import sys
+import time
+import unittest
+
+from telegram.error import RetryAfter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sender import BULK, INTERACTIVE, SendScheduler  # noqa: E402
+
+# Slack for timer and scheduling jitter (seconds)
+SLACK = 0.03
+
+
+class SendSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def _scheduler(self, **options):
+        options.setdefault("global_rate", 1000)
+        options.setdefault("chat_rate", 1000)
+        options.setdefault("chat_burst", 1000)
+        scheduler = SendScheduler(**options)
+        await scheduler.initialize()
+        self.start = time.monotonic()
+        self.sent = []    # (label, seconds after start) in the order requests reached Telegram
+        return scheduler
+
+    def _send(self, scheduler, label, chat_id, endpoint="sendMessage", priority=INTERACTIVE, data=None,
+              callback=None):
+        async def call():
+            self.sent.append((label, time.monotonic() - self.start))
+            return label
+
+        data = dict(data or {}, chat_id=chat_id)
+        return asyncio.create_task(scheduler.process_request(
+            callback or call, (), {}, endpoint, data, {"priority": priority}
+        ))
+
+    def _at(self, label):
+        return dict(self.sent)[label]
+
+    async def test_global_bucket_spreads_a_burst(self):
+        scheduler = await self._scheduler(global_rate=20)
+        await asyncio.gather(*(self._send(scheduler, i, chat_id=i) for i in range(25)))
+        # A full second's worth goes out at once, then one every 1/20 s
+        self.assertLess(self._at(19), SLACK)
+        self.assertGreaterEqual(self._at(24), 5 / 20 - SLACK)
+
+    async def test_chat_bucket_limits_one_chat_only(self):
+        scheduler = await self._scheduler(chat_rate=10, chat_burst=2)
+        await asyncio.gather(
+            *(self._send(scheduler, f"a{i}", chat_id=1) for i in range(4)),
+            self._send(scheduler, "b0", chat_id=2),
+        )
+        self.assertLess(self._at("a1"), SLACK)
+        self.assertGreaterEqual(self._at("a2"), 0.1 - SLACK)
+        self.assertGreaterEqual(self._at("a3"), 0.2 - SLACK)
+        # Another chat is not held back by the first one
+        self.assertLess(self._at("b0"), SLACK)
+
+    async def test_interactive_lane_goes_before_bulk(self):
+        scheduler = await self._scheduler(global_rate=10)
+        # Use up the global bucket so the next requests have to queue
+        await asyncio.gather(*(self._send(scheduler, f"x{i}", chat_id=100 + i) for i in range(10)))
+        tasks = [self._send(scheduler, f"bulk{i}", chat_id=i, priority=BULK) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(self._send(scheduler, "reply", chat_id=50))
+        await asyncio.gather(*tasks)
+        order = [label for label, _ in self.sent[10:]]
+        self.assertEqual(order, ["reply", "bulk0", "bulk1", "bulk2"])
+
+    async def test_waiting_edits_are_coalesced(self):
+        scheduler = await self._scheduler(global_rate=10)
+        await asyncio.gather(*(self._send(scheduler, f"x{i}", chat_id=100 + i) for i in range(10)))
+
+        edit = {"message_id": 7}
+        tasks = [self._send(scheduler, f"edit{i}", 1, endpoint="editMessageText", data=edit) for i in range(3)]
+        results = await asyncio.gather(*tasks)
+
+        # Only the newest edit is sent; every caller gets its result
+        self.assertEqual([label for label, _ in self.sent[10:]], ["edit2"])
+        self.assertEqual(results, ["edit2"] * 3)
+
+    async def test_retry_after_pauses_every_send(self):
+        scheduler = await self._scheduler()
+        attempts = []
+
+        async def flooded():
+            attempts.append(time.monotonic() - self.start)
+            if len(attempts) == 1:
+                raise RetryAfter(1)
+            return "ok"
+
+        first = self._send(scheduler, "flooded", 1, callback=flooded)
+        await asyncio.sleep(0.05)
+        # Sent while the bot is paused: waits for the pause to end
+        other = self._send(scheduler, "other", 2)
+
+        self.assertEqual(await first, "ok")
+        await other
+        self.assertGreaterEqual(attempts[1], 1 - SLACK)
+        self.assertGreaterEqual(self._at("other"), 1 - SLACK)
+
+
+if __name__ == "__main__":
+    unittest.main()
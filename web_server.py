@@ -0,0 +1,110 @@
+"""HTTP server for webhook mode.
+
+Serves the Telegram webhook, GET /metrics and the /healthz and /readyz
+probes (health.py) on the same port. Webhook updates are handed to a sink,
+normally the durable ingress queue (ingress.py), and Telegram gets its
+answer as soon as the sink returns.
+"""
+import json
+import logging
+import re
+from http import HTTPStatus
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Receives updates POSTed by Telegram"""
+
+    SUPPORTED_METHODS = ("POST",)
+
+    def initialize(self, sink):
+        self.sink = sink
+
+    async def post(self):
+        if self.request.headers.get("Content-Type") != "application/json":
+            raise tornado.web.HTTPError(HTTPStatus.FORBIDDEN)
+
+        try:
+            data = json.loads(self.request.body)
+        except ValueError as e:
+            logger.error(f"Invalid webhook update: {e}")
+            raise tornado.web.HTTPError(HTTPStatus.BAD_REQUEST, reason="Update could not be decoded")
+
+        try:
+            await self.sink(data)
+        except Exception as e:
+            # e.g. SQLite busy or disk full; a 5xx makes Telegram deliver the update again
+            logger.error(f"Could not queue webhook update: {e!r}")
+            raise tornado.web.HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, reason="Update could not be queued")
+
+        self.set_status(HTTPStatus.OK)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Prometheus scrape endpoint"""
+
+    SUPPORTED_METHODS = ("GET",)
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.render_metrics())
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Liveness probe"""
+
+    SUPPORTED_METHODS = ("GET",)
+
+    def initialize(self, health):
+        self.health = health
+
+    def get(self):
+        alive, report = self.health.liveness()
+        self.set_status(HTTPStatus.OK if alive else HTTPStatus.SERVICE_UNAVAILABLE)
+        self.write(report)
+
+
+class ReadinessHandler(tornado.web.RequestHandler):
+    """Readiness probe with per-dependency details"""
+
+    SUPPORTED_METHODS = ("GET",)
+
+    def initialize(self, health):
+        self.health = health
+
+    async def get(self):
+        ready, report = await self.health.readiness()
+        self.set_status(HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE)
+        self.set_header("Cache-Control", "no-store")
+        self.write(report)
+
+
+class WebApp(tornado.web.Application):
+    def log_request(self, handler):
+        # Request logging is left to our own handlers
+        pass
+
+
+def start_web_server(sink, port, webhook_path, health, listen="0.0.0.0"):
+    """Start serving the webhook, /metrics, /healthz and /readyz; returns the HTTPServer.
+
+    sink is a coroutine function called with each decoded update, e.g.
+    IngressConsumer.sink() or IngressQueue.append; health is a
+    health.HealthChecks.
+    """
+    routes = [
+        (rf"/{re.escape(webhook_path)}/?", TelegramWebhookHandler, {"sink": sink}),
+        (r"/metrics", MetricsHandler),
+        (r"/healthz", HealthHandler, {"health": health}),
+        (r"/readyz", ReadinessHandler, {"health": health}),
+    ]
+    server = HTTPServer(WebApp(routes))
+    server.listen(port, address=listen)
+    logger.info(f"Web server listening on {listen}:{port} (webhook, /metrics, /healthz, /readyz)")
+    return server
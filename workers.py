@@ -0,0 +1,114 @@
+"""Multi-process webhook mode.
+
+With WEB_WORKERS > 1 the main process only receives webhooks and appends
+them to the durable ingress queue (ingress.py). The queue is partitioned
+by user id over N worker processes, each running its own Application with
+the bot's handlers and consuming its partition. All of a user's updates go
+to the same worker and are handled there in order, so per-process caches
+(such as the PAN list cache) stay correct. Conversation state is kept in
+the shared state store (state_store.py), and users.db is shared through
+SQLite's WAL mode.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes in webhook mode (1 = handle updates in the web process)
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", 1))
+# Restarts of a worker that keeps crashing before the pool gives up (and /healthz fails)
+WORKER_MAX_RESTARTS = int(os.getenv("WORKER_MAX_RESTARTS", 5))
+
+# Seconds given to a worker to finish the updates it is handling on shutdown
+WORKER_STOP_TIMEOUT = 15
+# How often dead workers are looked for (seconds)
+WORKER_CHECK_INTERVAL = 1.0
+# Delay before restarting a crashed worker; doubles per crash in a row, capped (seconds)
+WORKER_RESTART_DELAY = 1.0
+WORKER_RESTART_MAX_DELAY = 60.0
+# A worker that ran this long before exiting is restarted as if it had never crashed (seconds)
+WORKER_STABLE_AFTER = 300.0
+
+
+def _worker_entry(index, count, stop_event):
+    # Runs in the worker process; bot is imported here so the web process
+    # never builds handlers it doesn't use
+    import bot
+    bot.run_worker(index, count, stop_event)
+
+
+class WorkerPool:
+    """Worker processes, each consuming one partition of the ingress queue"""
+
+    def __init__(self, count=WEB_WORKERS):
+        self.count = count
+        # spawn: workers must not inherit the web process's event loop and threads
+        self._context = multiprocessing.get_context("spawn")
+        self._stop_event = self._context.Event()
+        self._processes = [None] * count
+        self._started_at = [0.0] * count
+        self._crashes = [0] * count        # crashes in a row, per worker
+        self._restart_at = [None] * count  # when a crashed worker is due to restart
+        self._monitor = None
+        self._stopping = False
+        self.failed = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=_worker_entry, args=(index, self.count, self._stop_event),
+            name=f"bot-worker-{index}", daemon=False
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        self._monitor = asyncio.create_task(self._watch_workers())
+
+    async def _watch_workers(self):
+        # A crashed worker is restarted with backoff; its partition waits in the queue
+        while not self._stopping:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if self._stopping:
+                    return
+                if self._restart_at[index] is not None:
+                    if now >= self._restart_at[index]:
+                        self._restart_at[index] = None
+                        self._spawn(index)
+                    continue
+                if process.is_alive():
+                    continue
+
+                if now - self._started_at[index] >= WORKER_STABLE_AFTER:
+                    self._crashes[index] = 0
+                self._crashes[index] += 1
+                if self._crashes[index] > WORKER_MAX_RESTARTS:
+                    logger.critical(
+                        f"Worker {index} exited with code {process.exitcode}, "
+                        f"{self._crashes[index]} crashes in a row; not restarting it again"
+                    )
+                    self.failed = True
+                    return
+                delay = min(WORKER_RESTART_MAX_DELAY, WORKER_RESTART_DELAY * 2 ** (self._crashes[index] - 1))
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting in {delay:.0f}s")
+                self._restart_at[index] = now + delay
+
+    async def stop(self):
+        """Let the workers finish the updates they are handling, then stop them"""
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        self._stop_event.set()
+        for index, process in enumerate(self._processes):
+            await asyncio.to_thread(process.join, WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time, terminating")
+                process.terminate()